@@ -0,0 +1,187 @@
+"""
+按时间分区存储的日志在Admin中的浏览
+列表每次只查询一个分区（默认为最新的分区），详情页根据主键直接定位分区，
+请求体/响应体在详情页才从内容存储中取出并解压。
+日志表可能有数千万行，列表页的每个查询都要能走索引：
+- 总数使用估算值，不执行 COUNT(*)
+- 日期按分区的起止时间下钻，代替 date_hierarchy 的 SELECT DISTINCT
+- 过滤器的选项来自choices或小表，不对日志执行 SELECT DISTINCT
+- 只按请求路径前缀和调用ID搜索，不使用 icontains
+"""
+from datetime import datetime, time, timedelta
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import Paginator
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .estimates import estimate_count
+
+# 时间范围不超过此天数时按日下钻，否则按月
+DAY_DRILL_DOWN_MAX_DAYS = 62
+
+
+class EstimatedCountPaginator(Paginator):
+    """总数使用估算值（见 automationapi/estimates.py），大分区上不执行 COUNT(*)"""
+    
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class PartitionListFilter(admin.SimpleListFilter):
+    """选择要浏览的分区，没有"全部"选项"""
+    
+    title = '分区'
+    parameter_name = 'partition'
+    
+    def __init__(self, request, params, model, model_admin):
+        self.current = model_admin.get_partition(request).name
+        super().__init__(request, params, model, model_admin)
+    
+    def lookups(self, request, model_admin):
+        return [
+            (partition.name, '分区前的日志' if partition.is_default else partition.name)
+            for partition in model_admin.partitions.partitions()
+        ]
+    
+    def queryset(self, request, queryset):
+        # 分区已由 PartitionedLogAdmin.get_queryset 选定
+        return queryset
+    
+    def choices(self, changelist):
+        for name, title in self.lookup_choices:
+            yield {
+                'selected': name == self.current,
+                'query_string': changelist.get_query_string({self.parameter_name: name}),
+                'display': title,
+            }
+
+
+class DateDrillDownFilter(admin.SimpleListFilter):
+    """
+    按日（时间范围较长时按月）缩小列表范围，代替 date_hierarchy
+    选项由分区的起止时间算出，默认分区读取时间字段索引上的 MIN/MAX，不扫描日志
+    """
+    
+    title = '日期'
+    parameter_name = 'date'
+    
+    def __init__(self, request, params, model, model_admin):
+        self.time_field = model_admin.partitions.time_field
+        super().__init__(request, params, model, model_admin)
+    
+    def lookups(self, request, model_admin):
+        partition = model_admin.get_partition(request)
+        start, end = partition.start, partition.end
+        if partition.is_default:
+            bounds = partition.model._default_manager.aggregate(start=Min(self.time_field), end=Max(self.time_field))
+            if bounds['start'] is None:
+                return []
+            start, end = bounds['start'], bounds['end'] + timedelta(microseconds=1)
+        end = min(end, timezone.now())
+        if start >= end:
+            return []
+        
+        first = timezone.localtime(start).date()
+        last = timezone.localtime(end - timedelta(microseconds=1)).date()
+        if (last - first).days < DAY_DRILL_DOWN_MAX_DAYS:
+            days = [last - timedelta(days=i) for i in range((last - first).days + 1)]
+            return [(day.isoformat(), day.strftime('%m-%d')) for day in days]
+        
+        months = []
+        year, month = last.year, last.month
+        while (year, month) >= (first.year, first.month):
+            months.append((f'{year}-{month:02d}', f'{year}-{month:02d}'))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return months
+    
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        try:
+            if len(value) == 7:
+                first = datetime.strptime(value, '%Y-%m').date()
+                last = first.replace(year=first.year + first.month // 12, month=first.month % 12 + 1)
+            else:
+                first = datetime.strptime(value, '%Y-%m-%d').date()
+                last = first + timedelta(days=1)
+        except ValueError:
+            raise IncorrectLookupParameters(f"无效的日期: {value}")
+        return queryset.filter(**{
+            f'{self.time_field}__gte': timezone.make_aware(datetime.combine(first, time.min)),
+            f'{self.time_field}__lt': timezone.make_aware(datetime.combine(last, time.min)),
+        })
+
+
+class RequestMethodListFilter(admin.SimpleListFilter):
+    """请求方法（固定选项，默认的过滤器会对日志执行 SELECT DISTINCT）"""
+    
+    title = '请求方法'
+    parameter_name = 'request_method'
+    
+    METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+    
+    def lookups(self, request, model_admin):
+        return [(method, method) for method in self.METHODS]
+    
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(request_method=self.value())
+        return queryset
+
+
+class PartitionedLogAdmin(admin.ModelAdmin):
+    """按时间分区存储的日志（partitions 为模型的 PartitionedTable，bodies 为请求体/响应体的 BodyStore）"""
+    
+    partitions = None
+    bodies = None
+    
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # 列表不读取的大字段，详情页通过 get_object 读取完整的行
+    list_defer = ('request_url', 'request_body', 'response_body', 'error_message')
+    # 前缀匹配走 request_path 上的索引（PostgreSQL另建 varchar_pattern_ops 索引），调用ID精确匹配
+    search_fields = ['request_path__startswith', 'request_id__exact']
+    search_help_text = '按请求路径前缀（如 /v1.0/teams、/k/v1/records）或调用ID搜索'
+    
+    def get_partition(self, request):
+        """请求中选择的分区，未选择时为最新的分区"""
+        name = request.GET.get(PartitionListFilter.parameter_name)
+        return (name and self.partitions.get(name)) or self.partitions.partitions()[0]
+    
+    def get_queryset(self, request):
+        queryset = self.get_partition(request).model._default_manager.get_queryset().defer(*self.list_defer)
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+    
+    def get_list_filter(self, request):
+        return [PartitionListFilter, DateDrillDownFilter, *super().get_list_filter(request)]
+    
+    def get_object(self, request, object_id, from_field=None):
+        """根据主键定位所在分区"""
+        try:
+            partition = self.partitions.partition_for_pk(object_id)
+            return partition.model._default_manager.get(pk=object_id)
+        except (ObjectDoesNotExist, ValueError, TypeError):
+            return None
+    
+    def _body(self, obj, field):
+        digest = getattr(obj, f'{field}_digest')
+        return (self.bodies.get(digest) if digest else getattr(obj, field)) or '-'
+    
+    def request_body_display(self, obj):
+        """请求体（旧日志直接保存在日志行中）"""
+        return self._body(obj, 'request_body')
+    request_body_display.short_description = '请求体'
+    
+    def response_body_display(self, obj):
+        """响应体（旧日志直接保存在日志行中）"""
+        return self._body(obj, 'response_body')
+    response_body_display.short_description = '响应体'
@@ -0,0 +1,63 @@
+"""
+异步API视图工具
+DRF 3.14 的视图集不支持协程，异步接口以原生Django异步视图实现，
+响应格式与同步接口保持一致
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from . import fastjson
+from .errors import error_status
+
+
+def api_response(payload, status=200):
+    """返回与DRF接口一致的JSON响应"""
+    return JsonResponse(payload, status=status, safe=False, encoder=fastjson.FastJSONEncoder,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def error_response(message, status=400):
+    return api_response({'status': 'error', 'message': message}, status=status)
+
+
+def exception_response(error):
+    """调用上游失败时的错误响应，熔断和限流的状态码见 automationapi/errors.py"""
+    status, headers = error_status(error)
+    response = error_response(str(error), status=status)
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+def _is_authenticated(request):
+    return request.user.is_authenticated
+
+
+def async_api_view(methods):
+    """
+    异步API视图装饰器
+    校验HTTP方法和登录状态，并把JSON请求体解析到 request.data
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return error_response(f'不支持的请求方法: {request.method}', status=405)
+            
+            # request.user 的惰性加载会查询数据库，需在线程中执行
+            if not await sync_to_async(_is_authenticated)(request):
+                return error_response('身份认证信息未提供。', status=403)
+            
+            if request.method == 'GET':
+                request.data = request.GET
+            else:
+                try:
+                    request.data = fastjson.loads(request.body or b'{}')
+                except ValueError:
+                    return error_response('请求体不是有效的JSON')
+            
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
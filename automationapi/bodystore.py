@@ -0,0 +1,216 @@
+"""
+调用日志请求体/响应体的压缩去重存储
+日志行只保存内容的SHA-256摘要，内容本身压缩后按摘要存入单独的表，相同的内容（大多是重复的JSON）只保存一份。
+- 压缩：安装了zstandard时默认使用zstd，否则使用zlib（LOG_BODY_CODEC）；压缩后没有变小的内容原样保存
+- 大小上限：超过上限的内容截断后保存（LOG_BODY_MAX_SIZE，可按端点覆盖），上限为0时不保存
+- 写入：内容行与日志行一样经 BufferedLogWriter 写入；启用缓冲时每个进程记住当天已写入数据库的摘要，重复内容不再写库
+- 读取：只有详情序列化器和管理后台按摘要取出并解压
+内容行的 last_used 记录最后一次被日志引用的日期，prune_logs 据此删除不再被任何日志引用的内容。
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models
+from django.utils import timezone
+
+from . import fastjson
+from .logbuffer import BufferedLogWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('zstd', 'zlib', 'none')
+
+# 每个进程记住的最近写入过的摘要数
+RECENT_CACHE_SIZE = 10000
+
+# 截断的内容与恰好等于截断结果的完整内容使用不同的摘要
+TRUNCATED_MARK = b'\x00truncated'
+
+_stores = []
+
+
+def default_codec():
+    """写入新内容时使用的压缩方式"""
+    codec = getattr(settings, 'LOG_BODY_CODEC', '') or ('zstd' if zstandard is not None else 'zlib')
+    if codec not in CODECS:
+        raise ImproperlyConfigured(f"未知的日志内容压缩方式: {codec}")
+    if codec == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured("LOG_BODY_CODEC=zstd 需要安装 zstandard")
+    return codec
+
+
+def compress(raw, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    if codec == 'zlib':
+        return zlib.compress(raw, 6)
+    return raw
+
+
+def decompress(data, codec):
+    # PostgreSQL的BinaryField读出来是memoryview
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured("读取zstd压缩的日志内容需要安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+
+def to_bytes(value):
+    """请求体/响应体转为字节串：字典和列表序列化为JSON，其余转为字符串"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    if isinstance(value, (dict, list, tuple)):
+        try:
+            return fastjson.dumps(value)
+        except (TypeError, ValueError):
+            pass
+    return str(value).encode('utf-8')
+
+
+class LogBody(models.Model):
+    """压缩保存的日志内容（抽象模型，各应用各自建表）"""
+
+    digest = models.CharField(max_length=64, primary_key=True, verbose_name='SHA-256摘要')
+    codec = models.CharField(max_length=8, verbose_name='压缩方式')
+    data = models.BinaryField(verbose_name='内容')
+    size = models.PositiveIntegerField(verbose_name='大小(字节)', help_text='压缩前（截断后）的大小')
+    truncated = models.BooleanField(default=False, verbose_name='是否截断')
+    last_used = models.DateField(db_index=True, verbose_name='最后引用日期')
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.digest
+
+    def text(self):
+        """解压后的内容"""
+        return decompress(self.data, self.codec).decode('utf-8', errors='replace')
+
+
+class BodyStore:
+    """某个内容模型（LogBody的子类）的读写"""
+
+    def __init__(self, model, partitions=None):
+        """
+        :param model: 内容模型类
+        :param partitions: 引用这些内容的日志的 PartitionedTable，用于判断内容是否还被引用
+        """
+        self.model = model
+        self.partitions = partitions
+        self.writer = BufferedLogWriter(model, storage=self, after_write=[self._remember])
+
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+        _stores.append(self)
+
+    def put(self, value, max_size=None):
+        """
+        保存一份内容
+        :param value: 请求体或响应体（str、bytes、字典或列表），为空时不保存
+        :param max_size: 最多保存的字节数，默认 LOG_BODY_MAX_SIZE，0表示不保存
+        :return: 内容的摘要（保存在日志行中），没有保存时为None
+        """
+        if max_size is None:
+            max_size = settings.LOG_BODY_MAX_SIZE
+        if not value or max_size <= 0:
+            return None
+        raw = to_bytes(value)
+
+        truncated = len(raw) > max_size
+        if truncated:
+            raw = raw[:max_size]
+        digest = hashlib.sha256(raw)
+        if truncated:
+            digest.update(TRUNCATED_MARK)
+        digest = digest.hexdigest()
+        today = timezone.localdate()
+
+        # 未启用缓冲时（测试、管理命令）每次都写入，避免事务回滚后误以为内容已存在
+        if self.writer.enabled:
+            with self._lock:
+                if self._recent.get(digest) == today:
+                    self._recent.move_to_end(digest)
+                    return digest
+
+        codec = default_codec()
+        data = compress(raw, codec)
+        if len(data) >= len(raw):
+            codec, data = 'none', raw
+        self.writer.write(self.model(
+            digest=digest, codec=codec, data=data, size=len(raw), truncated=truncated, last_used=today
+        ))
+        return digest
+
+    def _remember(self, objs):
+        """
+        内容行写入成功后记住其摘要（BufferedLogWriter的写入回调）
+        缓冲中的内容写入失败或被丢弃时不会记住，之后引用同一内容的日志会再次写入
+        """
+        if not self.writer.enabled:
+            return
+        with self._lock:
+            for obj in objs:
+                self._recent[obj.digest] = obj.last_used
+                self._recent.move_to_end(obj.digest)
+            while len(self._recent) > RECENT_CACHE_SIZE:
+                self._recent.popitem(last=False)
+
+    def bulk_create(self, objs, batch_size=None):
+        """写入内容行（BufferedLogWriter的写入目标），已存在的摘要只更新 last_used"""
+        rows = {}
+        for obj in objs:
+            rows[obj.digest] = obj
+
+        features = connections[self.model.objects.db].features
+        return self.model.objects.bulk_create(
+            list(rows.values()),
+            batch_size=batch_size,
+            update_conflicts=True,
+            update_fields=['last_used'],
+            unique_fields=['digest'] if features.supports_update_conflicts_with_target else None,
+        )
+
+    def get(self, digest):
+        """
+        按摘要取出内容
+        :return: 解压后的内容，没有摘要或内容已被删除时为None
+        """
+        if not digest:
+            return None
+        body = self.model.objects.filter(digest=digest).first()
+        return body.text() if body is not None else None
+
+    def referenced_since(self):
+        """最早一条日志的日期：last_used 早于此日期的内容不再被任何日志引用"""
+        oldest = self.partitions.oldest() if self.partitions is not None else None
+        return timezone.localdate(oldest) if oldest is not None else timezone.localdate()
+
+    def collect_garbage(self, dry_run=False):
+        """
+        删除不再被任何日志引用的内容（应在删除过期日志之后执行）
+        :return: 删除（dry_run时为将要删除）的行数
+        """
+        queryset = self.model.objects.filter(last_used__lt=self.referenced_since())
+        if dry_run:
+            return queryset.count()
+        return queryset.delete()[0]
+
+
+def body_stores():
+    """所有内容存储"""
+    return list(_stores)
@@ -0,0 +1,201 @@
+"""
+出站请求熔断器
+上游持续失败或响应过慢时熔断（open），在恢复时间内直接快速失败，不再占用worker等待网络超时；
+恢复时间过后进入半开（half_open），只放行少量探测请求，成功则恢复（closed），失败则重新熔断。
+熔断器状态保存在进程内，每个worker独立统计。
+"""
+import threading
+import time
+
+from django.conf import settings
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+    def __init__(self, key, retry_in):
+        self.key = key
+        self.retry_in = retry_in
+        super().__init__(f"上游服务暂时不可用（{key}已熔断），请在 {retry_in:.0f} 秒后重试")
+
+
+class CircuitBreaker:
+    """单个上游（端点、连接或应用）的熔断器"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, key, failure_threshold=None, recovery_timeout=None, half_open_max_calls=None,
+                 slow_call_threshold=None):
+        """
+        :param key: 熔断器的键
+        :param failure_threshold: 连续失败多少次后熔断
+        :param recovery_timeout: 熔断后多少秒进入半开
+        :param half_open_max_calls: 半开状态下同时放行的探测请求数
+        :param slow_call_threshold: 超过多少秒的调用视为失败
+        """
+        self.key = key
+        self.failure_threshold = failure_threshold or getattr(settings, 'CIRCUIT_FAILURE_THRESHOLD', 5)
+        self.recovery_timeout = recovery_timeout or getattr(settings, 'CIRCUIT_RECOVERY_TIMEOUT', 30)
+        self.half_open_max_calls = half_open_max_calls or getattr(settings, 'CIRCUIT_HALF_OPEN_MAX_CALLS', 1)
+        self.slow_call_threshold = slow_call_threshold or getattr(settings, 'CIRCUIT_SLOW_CALL_THRESHOLD', 10)
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+        self.stats = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """发送请求前检查，熔断时抛出CircuitOpenError"""
+        with self._lock:
+            if self.state == self.OPEN:
+                retry_in = self.opened_at + self.recovery_timeout - time.monotonic()
+                if retry_in > 0:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.key, retry_in)
+                self.state = self.HALF_OPEN
+                self.probes = 0
+
+            if self.state == self.HALF_OPEN:
+                if self.probes >= self.half_open_max_calls:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.key, 0)
+                self.probes += 1
+
+            self.stats['calls'] += 1
+
+    def cancel(self):
+        """before_call通过但请求没有发出（例如其他熔断器拒绝）"""
+        with self._lock:
+            self.stats['calls'] -= 1
+            if self.state == self.HALF_OPEN and self.probes:
+                self.probes -= 1
+
+    def record_success(self, duration):
+        """
+        记录成功的调用
+        :param duration: 调用耗时（秒），超过slow_call_threshold按失败处理
+        """
+        if duration > self.slow_call_threshold:
+            with self._lock:
+                self.stats['slow_calls'] += 1
+            self.record_failure()
+            return
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """记录失败的调用"""
+        with self._lock:
+            self.stats['failures'] += 1
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        if self.state != self.OPEN:
+            self.stats['opened'] += 1
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probes = 0
+
+    def reset(self):
+        """手动恢复"""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probes = 0
+
+    def snapshot(self):
+        """熔断器状态"""
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, round(self.opened_at + self.recovery_timeout - time.monotonic(), 1))
+            return {
+                'key': self.key,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_in': retry_in,
+                **self.stats,
+            }
+
+
+class CircuitBreakerRegistry:
+    """按键管理熔断器"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(key)
+            return breaker
+
+    def snapshot(self, prefix=''):
+        """列出指定前缀的熔断器状态"""
+        with self._lock:
+            breakers = [b for k, b in sorted(self._breakers.items()) if k.startswith(prefix)]
+        return [breaker.snapshot() for breaker in breakers]
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+class CircuitGuard:
+    """
+    一次请求尝试同时受多个熔断器保护（例如Kintone的连接级和应用级）
+    用法：
+        guard = CircuitGuard(breakers)
+        guard.enter()
+        ...发送请求...
+        guard.success() / guard.failure()
+    """
+
+    def __init__(self, breakers):
+        self.breakers = breakers
+        self.started = None
+
+    def enter(self):
+        """检查所有熔断器，任一熔断时抛出CircuitOpenError"""
+        entered = []
+        try:
+            for breaker in self.breakers:
+                breaker.before_call()
+                entered.append(breaker)
+        except CircuitOpenError:
+            for breaker in entered:
+                breaker.cancel()
+            raise
+        self.started = time.monotonic()
+
+    def success(self):
+        duration = time.monotonic() - self.started
+        for breaker in self.breakers:
+            breaker.record_success(duration)
+
+    def failure(self):
+        for breaker in self.breakers:
+            breaker.record_failure()
+
+    def record(self, status_code):
+        """按响应状态码记录结果：5xx为失败，其他（包括4xx和429限流）说明上游可用"""
+        if status_code >= 500:
+            self.failure()
+        else:
+            self.success()
+
+
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,170 @@
+"""
+无竞争的使用量计数器
+调用次数和最后调用时间先在内存中按行累加，由后台线程定期以 F() 原子更新写入数据库，
+不再在每次调用时读-改-写整行（并发时会丢失计数，且每次调用都要获取行写锁）。
+读取时把数据库中的值与本进程尚未写入的增量合并。
+与日志缓冲一样只在 start_counters() 之后延迟写入（由WSGI/ASGI入口调用），
+测试和管理命令中每次调用直接执行原子更新。
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection as db_connection
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_counters = []
+_started = False
+_started_lock = threading.Lock()
+
+
+class BufferedCounter:
+    """某个模型上的一组 (计数字段, 最后时间字段) 计数器"""
+
+    def __init__(self, model, count_field, time_field):
+        """
+        :param model: 模型类
+        :param count_field: 累加的整数字段
+        :param time_field: 记录最后一次时间的字段
+        """
+        self.model = model
+        self.count_field = count_field
+        self.time_field = time_field
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        _counters.append(self)
+
+    @property
+    def enabled(self):
+        return _started and getattr(settings, 'COUNTER_BUFFER_ENABLED', True)
+
+    def incr(self, pk, amount=1, at=None):
+        """
+        累加计数
+        :param pk: 行的主键
+        :param amount: 增量
+        :param at: 发生时间，默认为当前时间
+        """
+        at = at or timezone.now()
+        if not self.enabled:
+            self._apply(pk, amount, at)
+            return
+
+        with self._lock:
+            self._ensure_thread()
+            delta, last = self._pending.get(pk, (0, None))
+            self._pending[pk] = (delta + amount, at if last is None or at > last else last)
+
+    def pending(self, pk):
+        """:return: 本进程尚未写入的 (增量, 最后时间)"""
+        with self._lock:
+            return self._pending.get(pk, (0, None))
+
+    def current(self, obj):
+        """
+        合并数据库中的值与尚未写入的增量
+        :return: (计数, 最后时间)
+        """
+        delta, last = self.pending(obj.pk)
+        stored = getattr(obj, self.time_field)
+        if last is None or (stored is not None and stored > last):
+            last = stored
+        return getattr(obj, self.count_field) + delta, last
+
+    def _apply(self, pk, amount, at):
+        """原子更新一行，最后时间只会前进"""
+        self.model.objects.filter(pk=pk).update(**{
+            self.count_field: F(self.count_field) + amount,
+            self.time_field: Greatest(Coalesce(F(self.time_field), at), at),
+        })
+
+    def flush(self):
+        """把所有增量写入数据库"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        close_old_connections()
+        for pk, (amount, at) in pending.items():
+            try:
+                self._apply(pk, amount, at)
+            except Exception:
+                logger.exception("更新%s(%s)的%s失败", self.model._meta.verbose_name, pk, self.count_field)
+                # 放回增量，下次再写
+                with self._lock:
+                    delta, last = self._pending.get(pk, (0, None))
+                    self._pending[pk] = (delta + amount, at if last is None or at > last else last)
+        return len(pending)
+
+    def _ensure_thread(self):
+        """启动后台写入线程（fork后的子进程中重新启动），调用方持有锁"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._wakeup.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f'counter-{self.model._meta.model_name}', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._wakeup.wait(getattr(settings, 'COUNTER_FLUSH_INTERVAL', 5.0)):
+                self.flush()
+        finally:
+            db_connection.close()
+
+    def stop(self, timeout=10):
+        """停止后台线程并写入剩余增量"""
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self.flush()
+
+
+def start_counters():
+    """启用计数器的延迟写入（由WSGI/ASGI入口调用），进程退出时写入剩余增量"""
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    atexit.register(stop_counters)
+
+
+def flush_counters():
+    """立即写入所有计数器的增量"""
+    for counter in list(_counters):
+        counter.flush()
+
+
+def stop_counters():
+    """停止所有写入线程并写入剩余增量（例如gunicorn的worker_exit钩子）"""
+    for counter in list(_counters):
+        counter.stop()
+
+
+def _reset_after_fork():
+    # 子进程不继承父进程的线程，尚未写入的增量由父进程负责
+    for counter in _counters:
+        counter._lock = threading.Lock()
+        counter._wakeup = threading.Event()
+        counter._pending = {}
+        counter._thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,182 @@
+"""
+出站请求超时与调用截止时间
+每个入站请求带有一个截止时间（请求头 X-Request-Timeout 或默认的 API_REQUEST_TIMEOUT），
+出站请求的连接/读取超时不会超过剩余时间，剩余时间用完后多步操作的后续请求直接失败，
+重试退避也不会越过截止时间。
+分块批量写入、导出和批量请求等视图用 @long_running 改用 API_LONG_REQUEST_TIMEOUT 作为时间预算。
+"""
+import contextlib
+import contextvars
+import functools
+import time
+
+import httpx
+import requests
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+
+# 入站请求指定调用时间预算（秒）的请求头
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+# 当前请求的截止时间，ThreadPoolExecutor中需通过 contextvars.copy_context() 传递
+current_deadline = contextvars.ContextVar('current_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """调用时间预算已用完，请求没有发出"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        super().__init__(f"调用超过截止时间（{budget:g} 秒），已停止后续请求")
+
+
+class Deadline:
+    """单次入站请求的截止时间"""
+
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self):
+        """时间已用完时抛出DeadlineExceeded"""
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(self.budget)
+
+    @classmethod
+    def from_request(cls, request, default=None):
+        """
+        根据请求头创建截止时间，请求头无效时使用默认值
+        超过 API_REQUEST_TIMEOUT_MAX（默认值更大时为默认值）时按上限处理
+        :param default: 默认的时间预算（秒），为None时读取 API_REQUEST_TIMEOUT
+        """
+        if default is None:
+            default = getattr(settings, 'API_REQUEST_TIMEOUT', 25)
+        seconds = default
+        value = request.headers.get(DEADLINE_HEADER)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                pass
+        seconds = min(seconds, max(default, getattr(settings, 'API_REQUEST_TIMEOUT_MAX', 25)))
+        return cls(seconds) if seconds > 0 else None
+
+
+def get_deadline():
+    """当前请求的截止时间，没有时返回None（例如管理命令）"""
+    return current_deadline.get()
+
+
+@contextlib.contextmanager
+def use_deadline(deadline):
+    """在代码块内使用指定的截止时间，结束后恢复原来的值"""
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def check_deadline():
+    """当前请求的时间预算已用完时抛出DeadlineExceeded"""
+    deadline = get_deadline()
+    if deadline is not None:
+        deadline.check()
+
+
+def request_timeout(connect, read):
+    """
+    计算出站请求的超时，不超过当前请求的剩余时间
+    :param connect: 连接超时（秒）
+    :param read: 读取超时（秒）
+    :return: (连接超时, 读取超时)
+    """
+    deadline = get_deadline()
+    if deadline is not None:
+        remaining = deadline.remaining()
+        connect, read = min(connect, remaining), min(read, remaining)
+    return connect, read
+
+
+def httpx_timeout(connect, read):
+    """把 (连接超时, 读取超时) 转换为httpx的超时配置"""
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+
+def timeout_phase(error):
+    """
+    判断异常是否为超时以及发生在哪个阶段
+    :return: connect、read、write、pool、deadline，不是超时时返回None
+    """
+    if isinstance(error, DeadlineExceeded):
+        return 'deadline'
+    if isinstance(error, (requests.ConnectTimeout, httpx.ConnectTimeout)):
+        return 'connect'
+    if isinstance(error, (requests.ReadTimeout, httpx.ReadTimeout)):
+        return 'read'
+    if isinstance(error, httpx.WriteTimeout):
+        return 'write'
+    if isinstance(error, httpx.PoolTimeout):
+        return 'pool'
+    if isinstance(error, (requests.Timeout, httpx.TimeoutException)):
+        return 'read'
+    return None
+
+
+def long_running(view):
+    """
+    长时间运行的视图（分块批量写入、导出、批量请求）的装饰器
+    时间预算改为 API_LONG_REQUEST_TIMEOUT（从视图开始计算），X-Request-Timeout 仍可在此范围内指定；
+    可用于视图函数、异步视图和视图集的方法（放在 @action 下面）
+    """
+    def start(args):
+        request = next(arg for arg in args if hasattr(arg, 'META'))
+        return current_deadline.set(
+            Deadline.from_request(request, default=getattr(settings, 'API_LONG_REQUEST_TIMEOUT', 900))
+        )
+
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            token = start(args)
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                current_deadline.reset(token)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = start(args)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                current_deadline.reset(token)
+
+    return wrapper
+
+
+@sync_and_async_middleware
+def DeadlineMiddleware(get_response):
+    """为每个入站请求设置截止时间"""
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = current_deadline.set(Deadline.from_request(request))
+            try:
+                return await get_response(request)
+            finally:
+                current_deadline.reset(token)
+    else:
+        def middleware(request):
+            token = current_deadline.set(Deadline.from_request(request))
+            try:
+                return get_response(request)
+            finally:
+                current_deadline.reset(token)
+
+    return middleware
@@ -0,0 +1,29 @@
+"""
+调用上游失败时返回给客户端的错误响应
+熔断（CircuitOpenError）返回503、出站限流（RateLimitExceeded）返回429，都带 Retry-After，
+客户端据此退避，不会与请求参数错误（400）混淆；其他错误照旧返回400
+"""
+import math
+
+from rest_framework.response import Response
+
+from .circuit import CircuitOpenError
+from .ratelimit import RateLimitExceeded
+
+
+def error_status(error):
+    """
+    :param error: 调用上游时抛出的异常
+    :return: (HTTP状态码, 响应头)
+    """
+    if isinstance(error, CircuitOpenError):
+        return 503, {'Retry-After': str(max(1, math.ceil(error.retry_in)))}
+    if isinstance(error, RateLimitExceeded):
+        return 429, {'Retry-After': str(max(1, math.ceil(error.wait)))}
+    return 400, {}
+
+
+def exception_response(error):
+    """同步（DRF）接口的错误响应"""
+    status_code, headers = error_status(error)
+    return Response({'status': 'error', 'message': str(error)}, status=status_code, headers=headers)
@@ -0,0 +1,18 @@
+"""
+不执行 COUNT(*) 的行数估算
+PostgreSQL 读取执行计划中优化器估算的行数（与过滤条件相关，误差取决于统计信息的新旧），
+其他数据库没有可靠的估算，直接计数（SQLite等开发环境的数据量通常不大）。
+"""
+import json
+
+from django.db import connections
+
+
+def estimate_count(queryset):
+    """估算QuerySet的行数"""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset.count()
+
@@ -0,0 +1,176 @@
+"""
+出站HTTP连接池
+按主机（或自定义键）复用 requests.Session，避免每次调用都重新建立TCP+TLS连接
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+
+# 所有连接池实例，用于fork后统一重置
+_pools = weakref.WeakSet()
+
+
+class SessionPool:
+    """
+    进程内的Session注册表
+    每个键（通常是主机名）对应一个带连接池的Session，空闲超时后自动重建；
+    gunicorn等预fork模型下，子进程会丢弃从父进程继承来的连接。
+    """
+
+    def __init__(self, name, pool_maxsize=None, idle_timeout=None):
+        """
+        :param name: 连接池名称（用于统计展示）
+        :param pool_maxsize: 每个主机的最大连接数，默认读取 HTTP_POOL_MAXSIZE
+        :param idle_timeout: Session空闲超时（秒），默认读取 HTTP_POOL_IDLE_TIMEOUT
+        """
+        self.name = name
+        self._pool_maxsize = pool_maxsize
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}  # key -> [session, last_used]
+        self._pid = os.getpid()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'discarded': 0}
+        _pools.add(self)
+
+    @property
+    def pool_maxsize(self):
+        if self._pool_maxsize is not None:
+            return self._pool_maxsize
+        return getattr(settings, 'HTTP_POOL_MAXSIZE', 10)
+
+    @property
+    def idle_timeout(self):
+        if self._idle_timeout is not None:
+            return self._idle_timeout
+        return getattr(settings, 'HTTP_POOL_IDLE_TIMEOUT', 60)
+
+    def _create_session(self, headers=None):
+        """创建带连接池的Session"""
+        session = requests.Session()
+        # 每个Session只服务一个主机，pool_maxsize即该主机的并发连接上限
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if headers:
+            session.headers.update(headers)
+        return session
+
+    def _reset_after_fork(self):
+        """fork后丢弃继承的连接（不能close，socket仍属于父进程）"""
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pid = os.getpid()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'discarded': 0}
+
+    def get(self, key, headers=None):
+        """
+        获取键对应的Session，不存在或已空闲超时则新建
+        :param key: 连接池键
+        :param headers: 新建Session时附带的默认请求头
+        """
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+
+        with self._lock:
+            now = time.monotonic()
+            entry = self._sessions.get(key)
+            if entry is not None:
+                session, last_used = entry
+                if now - last_used <= self.idle_timeout:
+                    entry[1] = now
+                    self._stats['hits'] += 1
+                    return session
+                # 空闲过久，服务端多半已关闭连接，直接重建
+                del self._sessions[key]
+                session.close()
+                self._stats['expired'] += 1
+
+            session = self._create_session(headers)
+            self._sessions[key] = [session, now]
+            self._stats['misses'] += 1
+            return session
+
+    def for_url(self, url):
+        """按URL的主机获取Session"""
+        return self.get(urlsplit(url).netloc)
+
+    def discard(self, key):
+        """关闭并移除指定键的Session"""
+        self.discard_where(lambda k: k == key)
+
+    def discard_where(self, predicate):
+        """关闭并移除所有满足条件的Session"""
+        with self._lock:
+            for key in [k for k in self._sessions if predicate(k)]:
+                session, _ = self._sessions.pop(key)
+                session.close()
+                self._stats['discarded'] += 1
+
+    def close_all(self):
+        """关闭所有Session"""
+        self.discard_where(lambda k: True)
+
+    def stats(self):
+        """连接池统计"""
+        with self._lock:
+            now = time.monotonic()
+            total = self._stats['hits'] + self._stats['misses']
+            return {
+                'name': self.name,
+                'pid': self._pid,
+                'pool_maxsize': self.pool_maxsize,
+                'idle_timeout': self.idle_timeout,
+                'sessions': len(self._sessions),
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / total, 4) if total else None,
+                'keys': [
+                    {'key': str(key), 'idle_seconds': round(now - last_used, 3)}
+                    for key, (_, last_used) in self._sessions.items()
+                ],
+            }
+
+
+# 每个事件循环一个异步客户端（httpx按主机维护连接池）
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    获取当前事件循环共享的 httpx.AsyncClient
+    连接数上限读取 HTTP_ASYNC_MAX_CONNECTIONS，空闲连接保留时间沿用 HTTP_POOL_IDLE_TIMEOUT
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=getattr(settings, 'HTTP_ASYNC_MAX_CONNECTIONS', 200),
+            max_keepalive_connections=getattr(settings, 'HTTP_ASYNC_MAX_CONNECTIONS', 200),
+            keepalive_expiry=getattr(settings, 'HTTP_POOL_IDLE_TIMEOUT', 60),
+        )
+        client = httpx.AsyncClient(limits=limits, timeout=None)
+        _async_clients[loop] = client
+    return client
+
+
+def url_path(url, max_length=255):
+    """URL的路径部分（不含协议、主机和查询参数），日志中单独保存以便按前缀索引搜索"""
+    return urlsplit(url).path[:max_length]
+
+
+def _reset_pools_after_fork():
+    for pool in list(_pools):
+        pool._reset_after_fork()
+    _async_clients.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
@@ -0,0 +1,85 @@
+"""
+可合并的响应时间直方图（HDR风格的对数分桶）
+响应时间按毫秒取对数分桶，每个桶的上界是下界的 GROWTH 倍，分位数的相对误差约为 ±5%；
+直方图只保存 {桶序号: 次数}，任意多个直方图相加即可合并，
+因此汇总表的每个时间桶各存一份，查询时合并所需的时间桶后直接计算分位数，不读取也不排序原始日志。
+"""
+import math
+from collections import Counter
+
+# 相邻桶边界的倍数
+GROWTH = 1.1
+
+_LOG_GROWTH = math.log(GROWTH)
+
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+def bin_index(seconds):
+    """响应时间（秒）所在的桶，1毫秒以下都在0号桶"""
+    ms = seconds * 1000
+    if ms < 1:
+        return 0
+    return 1 + int(math.log(ms) / _LOG_GROWTH)
+
+
+def bin_value(index):
+    """桶的代表值（秒），取上下界的几何平均"""
+    if index <= 0:
+        return 0.0005
+    return GROWTH ** (index - 0.5) / 1000
+
+
+class LatencyHistogram:
+    """响应时间直方图"""
+
+    def __init__(self, counts=None):
+        """
+        :param counts: {桶序号: 次数}，键可以是字符串（从JSON读出）
+        """
+        self.counts = Counter({int(index): count for index, count in (counts or {}).items()})
+
+    def add(self, seconds, count=1):
+        self.counts[bin_index(seconds)] += count
+
+    def merge(self, other):
+        """合并另一个直方图（或 {桶序号: 次数}）"""
+        counts = other.counts if isinstance(other, LatencyHistogram) else LatencyHistogram(other).counts
+        self.counts.update(counts)
+        return self
+
+    def to_json(self):
+        return {str(index): count for index, count in sorted(self.counts.items()) if count}
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def quantile(self, q):
+        """第q分位数（秒），直方图为空时为None"""
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, math.ceil(q * total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return bin_value(index)
+        return bin_value(max(self.counts))
+
+    def summary(self, maximum=None):
+        """
+        :param maximum: 精确的最大值（秒），给出时分位数不超过此值
+        :return: {'count', 'p50', 'p90', 'p99', 'max'}，时间单位为秒
+        """
+        result = {'count': self.total}
+        for name, q in QUANTILES:
+            value = self.quantile(q)
+            if value is not None and maximum is not None:
+                value = min(value, maximum)
+            result[name] = round(value, 4) if value is not None else None
+        if maximum is None and self.counts:
+            maximum = bin_value(max(self.counts))
+        result['max'] = round(maximum, 4) if maximum is not None else None
+        return result
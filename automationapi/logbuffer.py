@@ -0,0 +1,247 @@
+"""
+调用日志的异步缓冲写入
+日志行先放入内存缓冲区，由后台线程按数量或时间批量 bulk_create，请求线程不再等待数据库写入。
+缓冲区有容量上限，写满时按 LOG_BUFFER_OVERFLOW 处理：
+- sync：在调用方线程直接写入（不丢日志，写满时退化为同步写入）
+- drop_new：丢弃新日志
+- drop_oldest：丢弃缓冲区中最旧的日志
+缓冲只在 start_log_writers() 之后生效（由WSGI/ASGI入口调用），测试和管理命令中仍同步写入。
+写入成功后依次调用 after_write 回调（例如累加到汇总表），回调失败只记录日志。
+进程退出（包括gunicorn worker正常退出）时会写完缓冲区中剩余的日志。
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connection as db_connection
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('sync', 'drop_new', 'drop_oldest')
+
+_writers = []
+_started = False
+_started_lock = threading.Lock()
+
+
+class BufferedLogWriter:
+    """单个日志模型的缓冲写入器"""
+
+    def __init__(self, model, max_size=None, batch_size=None, flush_interval=None, overflow=None, storage=None,
+                 after_write=()):
+        """
+        :param model: 日志模型类
+        :param max_size: 缓冲区最多保存的日志行数
+        :param batch_size: 达到此行数时立即写入（同时也是bulk_create的批大小）
+        :param flush_interval: 最长写入间隔（秒）
+        :param overflow: 缓冲区已满时的处理方式（见 OVERFLOW_POLICIES）
+        :param storage: 写入目标，需提供 bulk_create(objs, batch_size)，例如按时间分区的 PartitionedTable，
+            默认写入模型的原表
+        :param after_write: 写入成功后调用的函数列表，参数为写入的日志列表
+        """
+        self.model = model
+        self.storage = storage
+        self.after_write = list(after_write)
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._overflow = overflow
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._stats = {'written': 0, 'dropped': 0, 'sync_writes': 0, 'failed': 0, 'flushes': 0}
+
+        _writers.append(self)
+
+    def _setting(self, value, name, default):
+        return value if value is not None else getattr(settings, name, default)
+
+    @property
+    def max_size(self):
+        return self._setting(self._max_size, 'LOG_BUFFER_MAX_SIZE', 10000)
+
+    @property
+    def batch_size(self):
+        return self._setting(self._batch_size, 'LOG_BUFFER_BATCH_SIZE', 500)
+
+    @property
+    def flush_interval(self):
+        return self._setting(self._flush_interval, 'LOG_BUFFER_FLUSH_INTERVAL', 1.0)
+
+    @property
+    def overflow(self):
+        return self._setting(self._overflow, 'LOG_BUFFER_OVERFLOW', 'sync')
+
+    @property
+    def enabled(self):
+        return _started and getattr(settings, 'LOG_BUFFER_ENABLED', True)
+
+    def write(self, obj):
+        """
+        写入一条日志（未保存的模型实例）
+        未启用缓冲时直接保存
+        """
+        if not self.enabled:
+            self._save(obj)
+            return
+
+        with self._lock:
+            self._ensure_thread()
+            if len(self._buffer) < self.max_size:
+                self._buffer.append(obj)
+                if len(self._buffer) >= self.batch_size:
+                    self._wakeup.notify()
+                return
+
+            # 缓冲区已满
+            overflow = self.overflow
+            if overflow == 'drop_new':
+                self._stats['dropped'] += 1
+                return
+            if overflow == 'drop_oldest':
+                self._buffer.popleft()
+                self._buffer.append(obj)
+                self._stats['dropped'] += 1
+                return
+            self._stats['sync_writes'] += 1
+
+        # sync策略：在锁外同步写入
+        self._save(obj)
+
+    def _save(self, obj):
+        """在调用方线程写入单条日志"""
+        if self.storage is None:
+            obj.save()
+        else:
+            self.storage.bulk_create([obj])
+        self._after_write([obj])
+
+    def _after_write(self, objs):
+        for callback in self.after_write:
+            try:
+                callback(objs)
+            except Exception:
+                logger.exception("%s写入后的回调失败", self.model._meta.verbose_name)
+
+    def _ensure_thread(self):
+        """启动后台写入线程（fork后的子进程中重新启动），调用方持有锁"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name=f'log-writer-{self.model._meta.model_name}', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._stopping and len(self._buffer) < self.batch_size:
+                        self._wakeup.wait(self.flush_interval)
+                    stopping = self._stopping
+                self.flush()
+                if stopping:
+                    return
+        finally:
+            db_connection.close()
+
+    def flush(self):
+        """把缓冲区中的日志全部写入数据库"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._buffer)
+                self._buffer.clear()
+            if not batch:
+                return 0
+
+            close_old_connections()
+            try:
+                (self.storage or self.model.objects).bulk_create(batch, batch_size=self.batch_size)
+            except Exception:
+                logger.exception("写入%d条%s失败", len(batch), self.model._meta.verbose_name)
+                with self._lock:
+                    self._stats['failed'] += len(batch)
+                return 0
+
+            with self._lock:
+                self._stats['written'] += len(batch)
+                self._stats['flushes'] += 1
+            self._after_write(batch)
+            return len(batch)
+
+    def stop(self, timeout=10):
+        """停止后台线程并写完剩余日志"""
+        with self._lock:
+            thread = self._thread
+            self._stopping = True
+            self._wakeup.notify()
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        """缓冲区状态"""
+        with self._lock:
+            return {
+                'model': self.model._meta.label,
+                'enabled': self.enabled,
+                'pending': len(self._buffer),
+                'max_size': self.max_size,
+                'overflow': self.overflow,
+                **self._stats,
+            }
+
+
+def start_log_writers():
+    """启用日志缓冲（由WSGI/ASGI入口调用），进程退出时自动写完剩余日志"""
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        overflow = getattr(settings, 'LOG_BUFFER_OVERFLOW', 'sync')
+        if overflow not in OVERFLOW_POLICIES:
+            raise ImproperlyConfigured(f"未知的日志缓冲溢出策略: {overflow}")
+        _started = True
+    atexit.register(stop_log_writers)
+
+
+def flush_log_writers():
+    """立即写入所有缓冲区中的日志"""
+    for writer in list(_writers):
+        writer.flush()
+
+
+def stop_log_writers():
+    """停止所有写入线程并写完剩余日志（例如gunicorn的worker_exit钩子）"""
+    for writer in list(_writers):
+        writer.stop()
+
+
+def log_writer_stats():
+    """所有写入器的缓冲区状态"""
+    return [writer.stats() for writer in _writers]
+
+
+def _reset_after_fork():
+    # 子进程不继承父进程的线程，缓冲区中的日志由父进程负责写入
+    for writer in _writers:
+        writer._lock = threading.Lock()
+        writer._wakeup = threading.Condition(writer._lock)
+        writer._flush_lock = threading.Lock()
+        writer._buffer = deque()
+        writer._thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
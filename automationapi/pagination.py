@@ -0,0 +1,120 @@
+"""
+按时间分区存储的日志的键集（游标）分页
+按 (created_at, id) 倒序翻页，不透明的游标记录上一页最后一行的位置：
+- 每页只在包含该位置的分区（以及默认分区）上执行带 LIMIT 的索引范围查询，不执行 COUNT(*) 也不使用 OFFSET，
+  第1页和第10000页的耗时相同
+- 过滤参数（endpoint/app/action/status/days等）原样保留在 next 链接中
+- total=approx 时附带估算的总数（见 automationapi/estimates.py）
+请求中带 page 参数时仍按页码分页，兼容旧客户端。
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import fastjson
+
+
+class PartitionedCursorPagination(BasePagination):
+    """PartitionedQuery 的键集分页，视图通过 paginate_partitioned() 使用"""
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    total_query_param = 'total'
+    max_page_size = 1000
+    invalid_cursor_message = '无效的游标'
+
+    def __init__(self):
+        self.legacy = None
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return PageNumberPagination.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, obj, time_field):
+        position = {'t': getattr(obj, time_field).isoformat(), 'id': obj.pk}
+        return base64.urlsafe_b64encode(fastjson.dumps(position)).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        """:return: (时间, 主键)，没有游标时为None"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = fastjson.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            return datetime.fromisoformat(position['t']), int(position['id'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_partitioned(self, query, request, view=None):
+        """
+        取出一页日志
+        :param query: PartitionedQuery（已包含过滤条件）
+        :return: 日志实例列表；请求使用页码分页时为None，由视图按原方式处理
+        """
+        if 'page' in request.query_params:
+            self.legacy = PageNumberPagination()
+            return None
+
+        self.request = request
+        self.query = query
+        time_field = query.table.time_field
+        size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        keyset = None
+        if cursor is not None:
+            moment, pk = cursor
+            keyset = Q(**{f'{time_field}__lt': moment}) | Q(**{time_field: moment, 'pk__lt': pk})
+
+        rows = []
+        for partition in query.partitions():
+            if not partition.is_default:
+                # 整个分区都在游标之后，或者已经取够且这个分区的日志都更早
+                if cursor is not None and partition.start > cursor[0]:
+                    continue
+                if len(rows) > size and getattr(rows[size], time_field) >= partition.end:
+                    continue
+            rows.extend(query.run(partition, lambda queryset: list(
+                (queryset.filter(keyset) if keyset is not None else queryset).order_by(f'-{time_field}', '-pk')[:size + 1]
+            ), default=[]))
+            rows.sort(key=lambda obj: (getattr(obj, time_field), obj.pk), reverse=True)
+            del rows[size + 1:]
+
+        self.has_next = len(rows) > size
+        self.page = rows[:size]
+        self.next_cursor = self.encode_cursor(self.page[-1], time_field) if self.has_next else None
+        return self.page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """页码分页（兼容旧客户端）"""
+        self.legacy = self.legacy or PageNumberPagination()
+        return self.legacy.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        response = {
+            'next': self.get_next_link(),
+            'first': self.get_first_link(),
+            'results': data,
+        }
+        if self.request.query_params.get(self.total_query_param) == 'approx':
+            response['approximate_count'] = self.query.estimate_count()
+        return Response(response)
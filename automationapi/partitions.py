@@ -0,0 +1,606 @@
+"""
+调用日志的按时间分区存储
+日志按月（或按周）写入各自的分区表 <原表名>_m20261001 / <原表名>_w20261012，
+分区表由日志模型克隆而来，SQLite和PostgreSQL上的做法相同，不依赖数据库的原生分区：
+- 查询按时间范围只访问相关的分区，days= 等过滤不再扫描全部日志
+- 保留期清理直接删除整个分区表，不再逐行DELETE
+- 各分区的主键从 (起始日期序数 × 2 + 周期) × ID_BLOCK 开始，根据主键即可定位分区
+原表作为默认分区保留，存放启用分区之前的日志和直接通过 objects 写入的日志。
+分区表不建外键约束，关联对象删除时由 pre_delete 信号按原外键的 on_delete 删除日志或清空外键；
+日志模型的字段变更后需要执行 prune_logs --sync-schema 同步到已有分区。
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections, models, router, transaction
+from django.db.models.signals import pre_delete
+
+from .estimates import estimate_count
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('month', 'week')
+
+# 每个分区可用的主键数量
+ID_BLOCK = 10 ** 9
+
+# 分区列表的缓存时间（秒），其他进程新建的分区最迟在此时间后可见
+LIST_CACHE_TTL = 60
+
+_partitioned_tables = []
+
+
+def period_start(moment, period):
+    """moment 所在分区的起始时间（按UTC划分）"""
+    moment = moment.astimezone(dt_timezone.utc)
+    if period == 'month':
+        return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+    day = moment.date() - timedelta(days=moment.weekday())
+    return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+
+
+def period_end(start, period):
+    """从 start 开始的分区的结束时间（不含）"""
+    if period == 'month':
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+    return start + timedelta(days=7)
+
+
+class Partition:
+    """单个分区，默认分区（原表）的 period、start、end 为None"""
+
+    def __init__(self, model, period=None, start=None):
+        self.model = model
+        self.table = model._meta.db_table
+        self.period = period
+        self.start = start
+        self.end = period_end(start, period) if start is not None else None
+
+    @property
+    def is_default(self):
+        return self.start is None
+
+    @property
+    def name(self):
+        """分区名，例如 2026-10、2026-W42、default"""
+        if self.is_default:
+            return 'default'
+        if self.period == 'month':
+            return self.start.strftime('%Y-%m')
+        year, week, _ = self.start.isocalendar()
+        return f'{year}-W{week:02d}'
+
+    @property
+    def first_id(self):
+        if self.is_default:
+            return None
+        return (self.start.toordinal() * 2 + PERIODS.index(self.period)) * ID_BLOCK
+
+    def overlaps(self, since=None, until=None):
+        """分区是否可能包含 [since, until) 内的日志"""
+        if self.is_default:
+            return True
+        return (since is None or self.end > since) and (until is None or self.start < until)
+
+    def __repr__(self):
+        return f'<Partition {self.table}>'
+
+
+class PartitionedTable:
+    """按时间分区存储的日志模型"""
+
+    def __init__(self, model, time_field='created_at', period=None):
+        """
+        :param model: 日志模型类（其原表作为默认分区）
+        :param time_field: 划分分区的时间字段
+        :param period: month或week，默认读取 LOG_PARTITION_PERIOD
+        """
+        self.model = model
+        self.time_field = time_field
+        self._period = period
+        self.default = Partition(model)
+
+        self._table_re = re.compile(rf'^{re.escape(model._meta.db_table)}_([mw])(\d{{8}})$')
+        self._models = {}
+        self._partitions = None
+        self._listed_at = 0
+        self._lock = threading.RLock()
+
+        _partitioned_tables.append(self)
+        pre_delete.connect(self._related_deleted, weak=False,
+                           dispatch_uid=f'partitions:{model._meta.label_lower}')
+
+    @property
+    def period(self):
+        period = self._period or getattr(settings, 'LOG_PARTITION_PERIOD', 'month')
+        if period not in PERIODS:
+            raise ImproperlyConfigured(f"未知的日志分区周期: {period}")
+        return period
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'LOG_PARTITION_ENABLED', True)
+
+    @property
+    def db(self):
+        return router.db_for_write(self.model)
+
+    def table_name(self, period, start):
+        return f'{self.model._meta.db_table}_{period[0]}{start:%Y%m%d}'
+
+    # ---- 分区模型 ----
+
+    def _partition(self, period, start):
+        """构造分区对象（分区表不一定存在）"""
+        table = self.table_name(period, start)
+        with self._lock:
+            model = self._models.get(table)
+            if model is None:
+                model = self._models[table] = self._build_model(table, period, start)
+        return Partition(model, period, start)
+
+    def _build_model(self, table, period, start):
+        """克隆日志模型的字段，生成指向分区表的模型类"""
+        opts = self.model._meta
+        suffix = table[len(opts.db_table) + 1:]
+
+        attrs = {'__module__': self.model.__module__, '__str__': self.model.__str__}
+        for field in opts.local_fields:
+            clone = field.clone()
+            if clone.remote_field is not None:
+                # 分区表不建外键约束，关联对象删除时由 _related_deleted 处理分区中的日志
+                clone.remote_field.related_name = '+'
+                clone.remote_field.on_delete = models.DO_NOTHING
+                clone.db_constraint = False
+            attrs[field.name] = clone
+
+        attrs['Meta'] = type('Meta', (), {
+            'app_label': opts.app_label,
+            'db_table': table,
+            'managed': False,
+            'ordering': opts.ordering,
+            'verbose_name': f'{opts.verbose_name}（{Partition(self.model, period, start).name}）',
+            'indexes': [
+                models.Index(fields=index.fields, name=f'{table}_{i}')
+                for i, index in enumerate(opts.indexes)
+            ],
+        })
+        return type(f'{self.model.__name__}_{suffix}', (models.Model,), attrs)
+
+    def _related_deleted(self, sender, instance, **kwargs):
+        """
+        关联对象删除时按日志模型外键的 on_delete 处理各分区中的日志：
+        CASCADE 删除日志，SET_NULL 清空外键，避免留下 select_related 查不到的日志。
+        默认分区是原表，由Django照常处理
+        """
+        fields = [
+            field for field in self.model._meta.local_fields
+            if field.remote_field is not None and field.related_model is sender._meta.concrete_model
+        ]
+        if not fields:
+            return
+        query = self.query()
+        for partition in query.partitions():
+            if partition.is_default:
+                continue
+            for field in fields:
+                on_delete = field.remote_field.on_delete
+                if on_delete is models.CASCADE:
+                    query.run(partition, lambda queryset: queryset.filter(
+                        **{field.attname: instance.pk})._raw_delete(self.db))
+                elif on_delete is models.SET_NULL:
+                    query.run(partition, lambda queryset: queryset.filter(
+                        **{field.attname: instance.pk}).update(**{field.attname: None}))
+
+    def _unregister(self, partition):
+        """分区表删除后注销分区模型"""
+        with self._lock:
+            model = self._models.pop(partition.table, None)
+        if model is not None:
+            apps.all_models[model._meta.app_label].pop(model._meta.model_name, None)
+            apps.clear_cache()
+
+    # ---- 分区列表 ----
+
+    def partitions(self, refresh=False):
+        """
+        所有分区，按起始时间从新到旧排列，默认分区在最后
+        :param refresh: 忽略缓存重新读取数据库中的表
+        """
+        with self._lock:
+            if refresh or self._partitions is None or time.monotonic() - self._listed_at > LIST_CACHE_TTL:
+                self._refresh()
+            return list(self._partitions)
+
+    def _refresh(self):
+        partitions = []
+        for table in connections[self.db].introspection.table_names():
+            match = self._table_re.match(table)
+            if match:
+                kind, day = match.groups()
+                start = datetime.strptime(day, '%Y%m%d').replace(tzinfo=dt_timezone.utc)
+                partitions.append(self._partition('month' if kind == 'm' else 'week', start))
+        partitions.sort(key=lambda p: (p.start, p.period), reverse=True)
+
+        # 其他进程已删除的分区
+        tables = {p.table for p in partitions}
+        for stale in [p for p in self._partitions or [] if p.table not in tables and not p.is_default]:
+            self._unregister(stale)
+
+        self._partitions = partitions + [self.default]
+        self._listed_at = time.monotonic()
+
+    def get(self, name):
+        """按分区名查找分区（缓存中没有时重新读取一次），不存在时返回None"""
+        for refresh in (False, True):
+            for partition in self.partitions(refresh=refresh):
+                if partition.name == name:
+                    return partition
+        return None
+
+    def partition_for_pk(self, pk, refresh=False):
+        """
+        根据主键定位分区，不属于任何分区的主键归入默认分区
+        :param refresh: 不使用缓存的分区列表；缓存中没有主键对应的分区时总是重新读取一次
+        """
+        block = int(pk) // ID_BLOCK
+        if block >= 2:
+            try:
+                start = datetime.combine(date.fromordinal(block // 2), datetime.min.time(), dt_timezone.utc)
+            except (ValueError, OverflowError):
+                return self.default
+            table = self.table_name(PERIODS[block % 2], start)
+            for refresh in sorted({refresh, True}):
+                for partition in self.partitions(refresh=refresh):
+                    if partition.table == table:
+                        return partition
+        return self.default
+
+    def is_dropped(self, partition):
+        """重新读取分区列表，确认分区表是否已被（其他进程）删除"""
+        if partition.is_default:
+            return False
+        return all(p.table != partition.table for p in self.partitions(refresh=True))
+
+    def partition_for(self, moment, create=True, refresh=False):
+        """
+        moment 所在的当前周期分区
+        :param create: 分区表不存在时创建，否则返回默认分区
+        :param refresh: 不使用缓存的分区列表
+        """
+        if not self.enabled:
+            return self.default
+        period = self.period
+        table = self.table_name(period, period_start(moment, period))
+        for refresh in sorted({refresh, True}):
+            for partition in self.partitions(refresh=refresh):
+                if partition.table == table:
+                    return partition
+        if not create:
+            return self.default
+        return self.create(period, period_start(moment, period))
+
+    # ---- 建表和删除 ----
+
+    def create(self, period, start):
+        """创建分区表（已存在时直接返回），主键从分区的 first_id 开始"""
+        partition = self._partition(period, start)
+        connection = connections[self.db]
+
+        # 不进入schema_editor的上下文：SQLite在事务中不允许使用schema_editor，只借用它生成DDL
+        editor = connection.schema_editor(collect_sql=True, atomic=False)
+        editor.deferred_sql = []
+        editor.create_model(partition.model)
+        statements = editor.collected_sql + [f'{sql};' for sql in editor.deferred_sql]
+
+        try:
+            with transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    for sql in statements:
+                        cursor.execute(sql)
+                    self._set_first_id(connection, cursor, partition)
+        except DatabaseError:
+            # 其他进程可能已同时创建
+            if partition.table not in connection.introspection.table_names():
+                raise
+        else:
+            logger.info("创建日志分区 %s", partition.table)
+
+        with self._lock:
+            self._refresh()
+        return partition
+
+    def _set_first_id(self, connection, cursor, partition):
+        table = connection.ops.quote_name(partition.table)
+        pk = connection.ops.quote_name(partition.model._meta.pk.column)
+        if connection.vendor == 'sqlite':
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                           [partition.table, partition.first_id - 1])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'ALTER TABLE {table} ALTER COLUMN {pk} RESTART WITH {partition.first_id}')
+        elif connection.vendor == 'mysql':
+            cursor.execute(f'ALTER TABLE {table} AUTO_INCREMENT = {partition.first_id}')
+        else:
+            raise ImproperlyConfigured(f"日志分区不支持 {connection.vendor} 数据库")
+
+    def ensure_upcoming(self, now=None):
+        """提前创建当前和下一周期的分区，避免在请求中建表"""
+        if not self.enabled:
+            return []
+        period = self.period
+        start = period_start(now or datetime.now(dt_timezone.utc), period)
+        return [self.partition_for(moment) for moment in (start, period_end(start, period))]
+
+    def drop(self, partition):
+        """删除整个分区表"""
+        if partition.is_default:
+            raise ValueError("默认分区不能删除")
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(partition.table)}')
+        logger.info("删除日志分区 %s", partition.table)
+        self._unregister(partition)
+        with self._lock:
+            self._refresh()
+
+    def drop_before(self, cutoff, dry_run=False):
+        """
+        删除结束时间不晚于 cutoff 的分区
+        :return: 删除的分区列表
+        """
+        expired = [p for p in self.partitions(refresh=True) if not p.is_default and p.end <= cutoff]
+        if not dry_run:
+            for partition in expired:
+                self.drop(partition)
+        return expired
+
+    def prune_default(self, cutoff, batch_size=1000, dry_run=False):
+        """
+        默认分区中 cutoff 之前的日志只能逐行删除，按主键分批进行
+        :return: 删除的行数
+        """
+        queryset = self.model.objects.filter(**{f'{self.time_field}__lt': cutoff})
+        if dry_run:
+            return queryset.count()
+        deleted = 0
+        while True:
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            deleted += self.model.objects.filter(pk__in=pks)._raw_delete(self.db)
+
+    def oldest(self):
+        """
+        不晚于最早一条日志的时间，没有任何日志时为None
+        分区表取最早分区的起始时间（不扫描分区），默认分区取最早的日志时间
+        """
+        moments = [self.model.objects.aggregate(oldest=models.Min(self.time_field))['oldest']]
+        partitions = [p for p in self.partitions(refresh=True) if not p.is_default]
+        if partitions:
+            moments.append(partitions[-1].start)
+        moments = [moment for moment in moments if moment is not None]
+        return min(moments) if moments else None
+
+    def sync_schema(self):
+        """
+        日志模型增删字段后，把变更同步到已有的分区表
+        :return: 执行的DDL语句
+        """
+        connection = connections[self.db]
+        statements = []
+        for partition in self.partitions(refresh=True):
+            if partition.is_default:
+                continue
+            with connection.cursor() as cursor:
+                columns = {c.name for c in connection.introspection.get_table_description(cursor, partition.table)}
+            editor = connection.schema_editor(collect_sql=True, atomic=False)
+            editor.deferred_sql = []
+            fields = partition.model._meta.local_fields
+            for field in fields:
+                if field.column not in columns:
+                    editor.add_field(partition.model, field)
+            # 新增字段的索引在 deferred_sql 中
+            statements.extend(editor.collected_sql + [f'{sql};' for sql in editor.deferred_sql])
+            for column in columns - {field.column for field in fields}:
+                statements.append(f'ALTER TABLE {connection.ops.quote_name(partition.table)} '
+                                  f'DROP COLUMN {connection.ops.quote_name(column)};')
+
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+        return statements
+
+    # ---- 读写 ----
+
+    def bulk_create(self, objs, batch_size=None):
+        """
+        把日志（日志模型的未保存实例）按时间写入各自的分区，写入后回填主键
+        BufferedLogWriter等写入方使用此方法代替 objects.bulk_create
+        """
+        if not self.enabled:
+            return self.model.objects.bulk_create(objs, batch_size=batch_size)
+
+        groups = {}
+        for obj in objs:
+            moment = getattr(obj, self.time_field)
+            groups.setdefault(period_start(moment, self.period), []).append(obj)
+
+        for start, group in groups.items():
+            try:
+                self._insert(self.partition_for(start), group, batch_size)
+            except DatabaseError:
+                # 缓存的分区表可能已不存在（被其他进程删除或建表的事务已回滚），重新确认后再写一次
+                self._insert(self.partition_for(start, refresh=True), group, batch_size)
+        return objs
+
+    def _insert(self, partition, objs, batch_size):
+        fields = self.model._meta.concrete_fields
+        rows = [partition.model(**{f.attname: getattr(obj, f.attname) for f in fields}) for obj in objs]
+        with transaction.atomic(using=self.db):
+            partition.model.objects.using(self.db).bulk_create(rows, batch_size=batch_size)
+        for obj, row in zip(objs, rows):
+            obj.pk = row.pk
+            obj._state.adding = False
+            obj._state.db = row._state.db
+
+    def query(self, since=None, until=None):
+        """
+        跨分区查询
+        :param since: 起始时间（含），只访问此后的分区
+        :param until: 结束时间（不含）
+        """
+        return PartitionedQuery(self, since, until)
+
+
+class PartitionedQuery:
+    """
+    跨分区的只读查询：先按时间范围裁剪分区，再对每个分区执行相同的过滤
+    接口列表使用键集分页（见 automationapi/pagination.py），需要单个QuerySet的场景使用 union()，
+    统计使用 count()/count_by()，导出使用 iterator()
+    """
+
+    def __init__(self, table, since=None, until=None, operations=()):
+        self.table = table
+        self.since = since
+        self.until = until
+        self._operations = tuple(operations)
+
+    def _chain(self, name, *args, **kwargs):
+        return PartitionedQuery(self.table, self.since, self.until,
+                                self._operations + ((name, args, kwargs),))
+
+    def filter(self, *args, **kwargs):
+        return self._chain('filter', *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._chain('exclude', *args, **kwargs)
+
+    def select_related(self, *fields):
+        return self._chain('select_related', *fields)
+
+    def partitions(self):
+        """
+        时间范围内的分区
+        使用缓存的分区列表（最多 LIST_CACHE_TTL 秒前读取），其中可能有其他进程刚删除的分区，
+        查询这些分区通过 run() 跳过
+        """
+        return [p for p in self.table.partitions() if p.overlaps(self.since, self.until)]
+
+    def run(self, partition, func, default=None):
+        """
+        在单个分区上执行查询 func(queryset)
+        分区表已被删除时重新读取分区列表并返回default，其他数据库错误照常抛出
+        """
+        try:
+            with transaction.atomic(using=self.table.db):
+                return func(self.queryset(partition))
+        except DatabaseError:
+            if self.table.is_dropped(partition):
+                return default
+            raise
+
+    def map(self, func, default=None):
+        """在每个分区上执行 run()，返回各分区的结果"""
+        return [self.run(partition, func, default) for partition in self.partitions()]
+
+    def queryset(self, partition):
+        """单个分区上的QuerySet"""
+        time_field = self.table.time_field
+        queryset = partition.model.objects.using(self.table.db).all()
+        if self.since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gte': self.since})
+        if self.until is not None:
+            queryset = queryset.filter(**{f'{time_field}__lt': self.until})
+        for name, args, kwargs in self._operations:
+            queryset = getattr(queryset, name)(*args, **kwargs)
+        return queryset
+
+    def querysets(self):
+        return [self.queryset(partition) for partition in self.partitions()]
+
+    def union(self, *ordering):
+        """
+        合并为一个QuerySet（UNION ALL），支持排序、切片和count，可直接用于DRF分页
+        合并后不能再filter；结果是第一个分区的模型实例，字段与日志模型相同
+        """
+        ordering = ordering or self.table.model._meta.ordering
+        querysets = self.querysets()
+        if len(querysets) == 1:
+            return querysets[0].order_by(*ordering)
+        first, *rest = [queryset.order_by() for queryset in querysets]
+        return first.union(*rest, all=True).order_by(*ordering)
+
+    def iterator(self, *fields, chunk_size=2000, **expressions):
+        """
+        逐块读取各分区的日志（values()字典，不创建模型实例），用于导出
+        分区按从新到旧的顺序读取（默认分区最后），分区内按时间倒序；
+        PostgreSQL使用服务端游标，每次只取 chunk_size 行，内存占用与日志总量无关
+        :param fields: values()的字段
+        :param expressions: values()的命名表达式，如 endpoint_name=F('endpoint__name')
+        """
+        time_field = self.table.time_field
+        for partition in self.partitions():
+            rows = self.queryset(partition).order_by(f'-{time_field}', '-pk').values(*fields, **expressions)
+            rows = rows.iterator(chunk_size=chunk_size)
+            # 分区表不存在时在读取第一块时出错
+            try:
+                first = next(rows, None)
+            except DatabaseError:
+                if self.table.is_dropped(partition):
+                    continue
+                raise
+            if first is not None:
+                yield first
+                yield from rows
+
+    def get(self, pk):
+        """按主键读取单条日志，直接定位所在分区"""
+        partition = self.table.partition_for_pk(pk)
+        obj = self.run(partition, lambda queryset: queryset.filter(pk=pk).first())
+        if obj is None:
+            raise self.table.model.DoesNotExist(f"{self.table.model._meta.object_name} {pk} 不存在")
+        return obj
+
+    def count(self):
+        return sum(self.map(lambda queryset: queryset.count(), default=0))
+
+    async def acount(self):
+        return await sync_to_async(self.count)()
+
+    def estimate_count(self):
+        """估算的总数，不执行 COUNT(*)（见 automationapi/estimates.py）"""
+        return sum(self.map(estimate_count, default=0))
+
+    def exists(self):
+        return any(self.run(partition, lambda queryset: queryset.exists(), default=False)
+                   for partition in self.partitions())
+
+    def count_by(self, *fields, limit=None):
+        """
+        按字段分组计数并合并各分区的结果
+        :return: [{字段: 值, ..., 'count': 数量}]，按数量从多到少排列
+        """
+        counts = Counter()
+        grouped = self.map(lambda queryset: list(
+            queryset.order_by().values_list(*fields).annotate(count=models.Count('pk'))
+        ), default=[])
+        for rows in grouped:
+            for row in rows:
+                counts[row[:-1]] += row[-1]
+        return [
+            {**dict(zip(fields, key)), 'count': count}
+            for key, count in counts.most_common(limit)
+        ]
+
+
+def partitioned_tables():
+    """所有按时间分区的日志模型"""
+    return list(_partitioned_tables)
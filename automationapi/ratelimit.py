@@ -0,0 +1,332 @@
+"""
+跨worker共享的令牌桶限流
+Graph按租户、Kintone按域名限流，所有worker共享同一个桶，避免多个worker同时触发429。
+桶状态保存在可替换的后端中：
+- local：进程内（单worker或测试时使用）
+- file：共享文件 + fcntl文件锁（同一台主机的多个worker）
+- redis：Redis兼容存储（多台主机），需要安装redis包
+file和redis后端的操作会阻塞（文件锁、网络往返），异步接口在线程池中执行。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .deadline import get_deadline
+from .retry import parse_retry_after
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class RateLimitExceeded(Exception):
+    """令牌不足且需要等待的时间超过上限，请求被主动拒绝"""
+
+    def __init__(self, key, wait):
+        self.key = key
+        self.wait = wait
+        super().__init__(f"出站请求限流（{key}），需等待 {wait:.1f} 秒，超过最长等待时间")
+
+
+def apply_bucket(bucket, now, rate, capacity, mode, arg=0.0):
+    """
+    在桶状态上执行一次操作（各后端共用的算法）
+    :param bucket: 桶状态字典 {'tokens': 令牌数, 'ts': 更新时间}，原地修改
+    :param rate: 每秒补充的令牌数
+    :param capacity: 桶容量（允许的突发请求数）
+    :param mode: take（取一个令牌）、peek（只查看）、block（清空桶并欠下arg秒的令牌）
+    :param arg: take时为最长等待秒数，block时为阻塞秒数
+    :return: (结果, 操作后的令牌数)；take的结果为需要等待的秒数，被拒绝时为None
+    """
+    tokens = bucket.get('tokens', capacity)
+    ts = bucket.get('ts', now)
+    tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+    result = 0.0
+
+    if mode == 'take':
+        wait = max(0.0, (1 - tokens) / rate)
+        if wait > arg:
+            result = None
+        else:
+            # 令牌可以为负数，表示已经被等待中的请求预订
+            tokens -= 1
+            result = wait
+    elif mode == 'block':
+        tokens = min(tokens, -arg * rate)
+
+    bucket['tokens'] = tokens
+    bucket['ts'] = now
+    return result, tokens
+
+
+class LocalBackend:
+    """进程内后端"""
+
+    name = 'local'
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def apply(self, key, rate, capacity, mode, arg=0.0):
+        with self._lock:
+            return apply_bucket(self._buckets.setdefault(key, {}), time.time(), rate, capacity, mode, arg)
+
+
+class FileBackend:
+    """
+    共享文件后端，同一台主机上的所有worker通过文件锁串行更新
+    每个桶记录补满的时间，写回时丢弃已经补满的桶（与不存在的桶等价），文件大小只与活跃的桶数有关
+    """
+
+    name = 'file'
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise ImproperlyConfigured("file限流后端需要fcntl（仅支持类Unix系统）")
+        self.path = path
+
+    def apply(self, key, rate, capacity, mode, arg=0.0):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                raw = f.read()
+                try:
+                    buckets = json.loads(raw) if raw else {}
+                except ValueError:
+                    buckets = {}
+
+                now = time.time()
+                bucket = buckets.setdefault(key, {})
+                result = apply_bucket(bucket, now, rate, capacity, mode, arg)
+                bucket['full'] = now + (capacity - result[1]) / rate
+                buckets = {name: state for name, state in buckets.items()
+                           if name == key or state.get('full', 0) > now}
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(buckets))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisBackend:
+    """Redis兼容存储后端，桶的读写在Lua脚本中原子完成"""
+
+    name = 'redis'
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local mode = ARGV[3]
+local arg = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local result = '0'
+if mode == 'take' then
+    local wait = math.max(0, (1 - tokens) / rate)
+    if wait > arg then
+        result = ''
+    else
+        tokens = tokens - 1
+        result = tostring(wait)
+    end
+elseif mode == 'block' then
+    tokens = math.min(tokens, -arg * rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 60)
+return {result, tostring(tokens)}
+"""
+
+    def __init__(self, url):
+        if redis is None:
+            raise ImproperlyConfigured("redis限流后端需要安装redis包")
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def apply(self, key, rate, capacity, mode, arg=0.0):
+        result, tokens = self.script(
+            keys=[f'ratelimit:{key}'],
+            args=[rate, capacity, mode, arg, time.time()]
+        )
+        result = result.decode() if isinstance(result, bytes) else result
+        return (float(result) if result != '' else None), float(tokens)
+
+
+class RateLimiter:
+    """令牌桶限流器"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def reserve(self, key, rate, capacity, max_wait=None):
+        """
+        预订一个令牌
+        :param key: 桶的键，例如 graph:<tenant_id>
+        :param rate: 每秒补充的令牌数，小于等于0时不限流
+        :param capacity: 桶容量
+        :param max_wait: 最长等待秒数，为None时使用 RATE_LIMIT_MAX_WAIT
+        :return: 发送请求前需要等待的秒数
+        """
+        if rate <= 0:
+            return 0.0
+        if max_wait is None:
+            max_wait = getattr(settings, 'RATE_LIMIT_MAX_WAIT', 10)
+        wait, tokens = self.backend.apply(key, rate, capacity, 'take', max_wait)
+        if wait is None:
+            raise RateLimitExceeded(key, (1 - tokens) / rate)
+        return wait
+
+    def acquire(self, key, rate, capacity, max_wait=None):
+        """预订令牌并等待到可以发送请求"""
+        wait = self.reserve(key, rate, capacity, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, key, rate, capacity, max_wait=None):
+        """acquire的异步版本，预订令牌和等待时都不阻塞事件循环"""
+        wait = await sync_to_async(self.reserve, thread_sensitive=False)(key, rate, capacity, max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def block(self, key, seconds, rate, capacity):
+        """上游返回429时清空桶，让所有worker在seconds秒内都不再发送请求"""
+        if rate > 0 and seconds:
+            self.backend.apply(key, rate, capacity, 'block', seconds)
+
+    async def ablock(self, key, seconds, rate, capacity):
+        """block的异步版本"""
+        if rate > 0 and seconds:
+            await sync_to_async(self.backend.apply, thread_sensitive=False)(key, rate, capacity, 'block', seconds)
+
+    def level(self, key, rate, capacity):
+        """查看桶的当前状态"""
+        if rate <= 0:
+            return {'key': key, 'enabled': False}
+        _, tokens = self.backend.apply(key, rate, capacity, 'peek')
+        return {
+            'key': key,
+            'enabled': True,
+            'tokens': round(tokens, 2),
+            'capacity': capacity,
+            'rate': rate,
+            'fill': round(max(0.0, tokens) / capacity, 3),
+        }
+
+
+_limiter = None
+_limiter_config = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """按 RATE_LIMIT_BACKEND 配置获取进程内共享的限流器"""
+    global _limiter, _limiter_config
+
+    config = (
+        getattr(settings, 'RATE_LIMIT_BACKEND', 'local'),
+        getattr(settings, 'RATE_LIMIT_FILE', None),
+        getattr(settings, 'RATE_LIMIT_REDIS_URL', None),
+    )
+    with _limiter_lock:
+        if _limiter is None or _limiter_config != config:
+            backend_name, path, url = config
+            if backend_name == 'file':
+                backend = FileBackend(path)
+            elif backend_name == 'redis':
+                backend = RedisBackend(url)
+            elif backend_name == 'local':
+                backend = LocalBackend()
+            else:
+                raise ImproperlyConfigured(f"未知的限流后端: {backend_name}")
+            _limiter, _limiter_config = RateLimiter(backend), config
+        return _limiter
+
+
+class RateLimitedMixin:
+    """
+    服务类限流混入类
+    子类设置 RATE_LIMIT_PREFIX、RATE_LIMIT_SETTINGS 并实现 rate_limit_scope()，
+    在每次发送请求前调用 throttle()
+    """
+
+    # 限流桶键的前缀，完整的键为 <前缀>:<范围>
+    RATE_LIMIT_PREFIX = None
+
+    # (每秒请求数的配置名, 突发请求数的配置名)
+    RATE_LIMIT_SETTINGS = (None, None)
+
+    def rate_limit_scope(self):
+        """限流范围（例如租户ID、Kintone子域名）"""
+        raise NotImplementedError
+
+    @classmethod
+    def rate_limit_key(cls, scope):
+        """限流桶的键"""
+        return f"{cls.RATE_LIMIT_PREFIX}:{scope}"
+
+    @classmethod
+    def rate_limit(cls):
+        """:return: (每秒请求数, 桶容量)"""
+        rate_name, burst_name = cls.RATE_LIMIT_SETTINGS
+        rate = getattr(settings, rate_name, 0) if rate_name else 0
+        return rate, getattr(settings, burst_name, 1) if burst_name else 1
+
+    @classmethod
+    def rate_limit_level(cls, scope):
+        """某个范围的桶的当前状态"""
+        return get_rate_limiter().level(cls.rate_limit_key(scope), *cls.rate_limit())
+
+    @staticmethod
+    def rate_limit_max_wait():
+        """令牌不足时最多等待的秒数：RATE_LIMIT_MAX_WAIT，且不超过当前请求剩余的时间预算"""
+        max_wait = getattr(settings, 'RATE_LIMIT_MAX_WAIT', 10)
+        deadline = get_deadline()
+        if deadline is not None:
+            max_wait = min(max_wait, max(0.0, deadline.remaining()))
+        return max_wait
+
+    def throttle(self):
+        """令牌不足时等待，需要等待太久（或超过剩余的时间预算）时抛出RateLimitExceeded"""
+        get_rate_limiter().acquire(self.rate_limit_key(self.rate_limit_scope()), *self.rate_limit(),
+                                   max_wait=self.rate_limit_max_wait())
+
+    async def athrottle(self):
+        """throttle的异步版本"""
+        await get_rate_limiter().aacquire(self.rate_limit_key(self.rate_limit_scope()), *self.rate_limit(),
+                                          max_wait=self.rate_limit_max_wait())
+
+    def throttled(self, response):
+        """上游返回429时按Retry-After阻塞共享的桶，其他worker也会暂停发送"""
+        if response.status_code == 429:
+            seconds = parse_retry_after(response.headers.get('Retry-After'))
+            if seconds:
+                get_rate_limiter().block(self.rate_limit_key(self.rate_limit_scope()), seconds,
+                                         *self.rate_limit())
+
+    async def athrottled(self, response):
+        """throttled的异步版本"""
+        if response.status_code == 429:
+            seconds = parse_retry_after(response.headers.get('Retry-After'))
+            if seconds:
+                await get_rate_limiter().ablock(self.rate_limit_key(self.rate_limit_scope()), seconds,
+                                                *self.rate_limit())
@@ -0,0 +1,41 @@
+"""
+基于 fastjson 的DRF渲染器和解析器
+输出与DRF默认的JSONRenderer/JSONParser一致，未安装orjson时自动使用标准库
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from . import fastjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON渲染器，需要缩进输出（例如可浏览API）时交给DRF默认实现"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = fastjson.dumps(data, default=self.encoder_class().default)
+        # 与DRF一致：转义U+2028/U+2029，避免嵌入JavaScript时出错
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """JSON解析器，未安装orjson或请求体不是UTF-8编码时交给DRF默认实现"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if fastjson.orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return fastjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,164 @@
+"""
+出站请求重试策略
+对429/503/504和网络错误按全抖动指数退避重试，优先遵循服务端返回的Retry-After，
+默认只重试幂等请求，并限制单次调用的总重试时间（不超过入站请求的截止时间）
+"""
+import random
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from django.conf import settings
+
+from .deadline import get_deadline
+
+
+# 默认重试的状态码
+RETRYABLE_STATUS_CODES = (429, 503, 504)
+
+# 幂等的HTTP方法（重复发送不会产生额外副作用）
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# 可以重试的网络错误（连接失败、超时等）
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+
+
+def parse_retry_after(value):
+    """
+    解析Retry-After响应头
+    :param value: 秒数或HTTP日期
+    :return: 需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=dt_timezone.utc)
+    return max(0.0, (retry_at - datetime.now(dt_timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    重试策略，未指定的参数在使用时从settings读取（API_RETRY_*）
+    用法：
+        state = policy.begin(method)
+        for attempt in state:
+            response = send()
+            delay = state.delay_for(response=response)
+            if delay is None:
+                break
+            time.sleep(delay)
+    """
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, max_total=None,
+                 retry_writes=None, status_codes=RETRYABLE_STATUS_CODES):
+        """
+        :param max_attempts: 最多尝试次数（含第一次）
+        :param base_delay: 退避基数（秒）
+        :param max_delay: 单次退避上限（秒）
+        :param max_total: 单次调用从第一次发送起的总时间上限（秒）
+        :param retry_writes: 是否重试非幂等请求（POST等）
+        :param status_codes: 需要重试的状态码
+        """
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_total = max_total
+        self._retry_writes = retry_writes
+        self.status_codes = tuple(status_codes)
+
+    def _setting(self, value, name, default):
+        return value if value is not None else getattr(settings, name, default)
+
+    @property
+    def max_attempts(self):
+        return self._setting(self._max_attempts, 'API_RETRY_MAX_ATTEMPTS', 4)
+
+    @property
+    def base_delay(self):
+        return self._setting(self._base_delay, 'API_RETRY_BASE_DELAY', 0.5)
+
+    @property
+    def max_delay(self):
+        return self._setting(self._max_delay, 'API_RETRY_MAX_DELAY', 30)
+
+    @property
+    def max_total(self):
+        return self._setting(self._max_total, 'API_RETRY_MAX_TOTAL', 60)
+
+    @property
+    def retry_writes(self):
+        return self._setting(self._retry_writes, 'API_RETRY_WRITES', False)
+
+    def backoff(self, attempt):
+        """全抖动指数退避：在 [0, min(max_delay, base_delay * 2^(attempt-1))] 内随机"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def allows(self, method, retry=None):
+        """
+        判断请求是否允许重试
+        :param retry: 调用方显式指定（True允许重试写操作，False禁止重试），None时按方法判断
+        """
+        if retry is not None:
+            return retry
+        return method.upper() in IDEMPOTENT_METHODS or self.retry_writes
+
+    def begin(self, method, retry=None):
+        """开始一次调用的重试流程"""
+        return RetryState(self, self.allows(method, retry))
+
+
+class RetryState:
+    """单次调用的重试状态，迭代时依次产生尝试序号（从1开始）"""
+
+    def __init__(self, policy, enabled):
+        self.policy = policy
+        self.enabled = enabled
+        # 同一次调用的所有尝试共享的关联ID，写入日志的request_id
+        self.request_id = uuid.uuid4().hex
+        self.attempt = 0
+        self.started = time.monotonic()
+
+    def __iter__(self):
+        while True:
+            self.attempt += 1
+            yield self.attempt
+
+    def delay_for(self, response=None, error=None):
+        """
+        判断本次尝试后是否需要重试
+        :param response: 收到的响应
+        :param error: 发送时抛出的异常
+        :return: 重试前需要等待的秒数，不需要重试时返回None
+        """
+        if not self.enabled or self.attempt >= self.policy.max_attempts:
+            return None
+
+        if error is not None:
+            if not isinstance(error, TRANSIENT_ERRORS):
+                return None
+            delay = self.policy.backoff(self.attempt)
+        elif response is not None and response.status_code in self.policy.status_codes:
+            delay = parse_retry_after(response.headers.get('Retry-After'))
+            if delay is None:
+                delay = self.policy.backoff(self.attempt)
+        else:
+            return None
+
+        # 等待后会超过总时间上限或当前请求的截止时间时不再重试
+        if time.monotonic() - self.started + delay > self.policy.max_total:
+            return None
+        deadline = get_deadline()
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
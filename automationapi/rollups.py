@@ -0,0 +1,338 @@
+"""
+调用日志的预聚合汇总（按分钟和小时）
+日志写入后由 BufferedLogWriter 按 (粒度, 时间桶, 维度) 把调用次数、响应时间和响应时间直方图累加到汇总表
+（先以 F() 原子更新计数并锁定该行，再合并直方图），
+统计接口只读取汇总表，不再对原始日志做 COUNT/GROUP BY，耗时与日志量无关：
+- 整小时的部分读取小时汇总，时间范围开头不足一小时的部分读取分钟汇总
+- 分钟汇总保留 ROLLUP_MINUTE_RETENTION_DAYS 天，小时汇总保留 ROLLUP_HOUR_RETENTION_DAYS 天（可以比日志保留得更久）
+响应时间的分位数由各时间桶的直方图合并后计算（见 automationapi/latency.py）。
+启用汇总之前的日志，或写入汇总失败后，用 rebuild_rollups 命令从原始日志重新计算。
+时间桶按UTC划分。
+"""
+import logging
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Floor, Greatest, Ln, Trunc
+
+from .latency import GROWTH, LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+GRAINS = ('minute', 'hour')
+
+_rollup_tables = []
+
+
+def bucket_start(moment, grain):
+    """moment 所在时间桶的起始时间（按UTC划分）"""
+    moment = moment.astimezone(dt_timezone.utc)
+    if grain == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+def resolve(obj, lookup):
+    """按 'endpoint__service' 形式的路径读取实例上的值（外键使用已缓存的关联对象）"""
+    for name in lookup.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+    return obj
+
+
+class UsageRollup(models.Model):
+    """某个时间桶内按维度汇总的调用次数和响应时间（抽象模型，各应用在子类中加上维度字段）"""
+
+    GRAIN_CHOICES = [
+        ('minute', '分钟'),
+        ('hour', '小时'),
+    ]
+
+    grain = models.CharField(max_length=6, choices=GRAIN_CHOICES, verbose_name='粒度')
+    bucket = models.DateTimeField(verbose_name='时间桶', help_text='时间桶的起始时间（UTC）')
+    status = models.CharField(max_length=20, verbose_name='状态')
+    count = models.PositiveBigIntegerField(default=0, verbose_name='调用次数')
+    response_time_sum = models.FloatField(default=0, verbose_name='响应时间合计(秒)')
+    response_time_count = models.PositiveBigIntegerField(default=0, verbose_name='有响应时间的调用次数')
+    response_time_max = models.FloatField(blank=True, null=True, verbose_name='最长响应时间(秒)')
+    latency_histogram = models.JSONField(default=dict, verbose_name='响应时间直方图', help_text='{桶序号: 次数}')
+
+    class Meta:
+        abstract = True
+
+
+class RollupTable:
+    """某个日志模型的汇总表"""
+
+    def __init__(self, model, source, dimensions, value_field='response_time'):
+        """
+        :param model: 汇总模型类（UsageRollup的子类）
+        :param source: 日志的 PartitionedTable，重新计算时从中读取
+        :param dimensions: {汇总表字段: 日志上的查找路径}，例如 {'service': 'endpoint__service'}，status 总是维度之一
+        :param value_field: 日志上的响应时间字段
+        """
+        self.model = model
+        self.source = source
+        self.dimensions = {**dimensions, 'status': 'status'}
+        self.value_field = value_field
+        _rollup_tables.append(self)
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'ROLLUP_ENABLED', True)
+
+    # ---- 写入 ----
+
+    def add(self, objs):
+        """把已写入的日志累加到各粒度的时间桶（BufferedLogWriter 的写入后回调）"""
+        if not self.enabled:
+            return
+        time_field = self.source.time_field
+        deltas = {}
+        for obj in objs:
+            key = tuple(resolve(obj, lookup) for lookup in self.dimensions.values())
+            value = getattr(obj, self.value_field)
+            for grain in GRAINS:
+                bucket_key = (grain, bucket_start(getattr(obj, time_field), grain)) + key
+                delta = deltas.get(bucket_key)
+                if delta is None:
+                    delta = deltas[bucket_key] = Delta()
+                delta.add(value)
+
+        fields = ('grain', 'bucket', *self.dimensions)
+        for key, delta in deltas.items():
+            self._apply(dict(zip(fields, key)), delta)
+
+    def _apply(self, key, delta):
+        """
+        累加一个时间桶，不存在时创建（并发创建冲突时改为累加）
+        计数先以 F() 原子更新，同时锁定该行，再在同一事务中合并直方图
+        """
+        for _ in range(2):
+            with transaction.atomic():
+                pk = self.model.objects.filter(**key).values_list('pk', flat=True).first()
+                if pk is None:
+                    try:
+                        with transaction.atomic():
+                            self.model.objects.create(**key, **delta.fields())
+                        return
+                    except IntegrityError:
+                        continue
+
+                rows = self.model.objects.filter(pk=pk)
+                changes = {
+                    'count': F('count') + delta.count,
+                    'response_time_sum': F('response_time_sum') + delta.value_sum,
+                    'response_time_count': F('response_time_count') + delta.value_count,
+                }
+                if delta.maximum is not None:
+                    changes['response_time_max'] = Greatest(Coalesce(F('response_time_max'), delta.maximum),
+                                                            delta.maximum)
+                rows.update(**changes)
+                if delta.histogram.counts:
+                    histogram = rows.values_list('latency_histogram', flat=True).get()
+                    rows.update(latency_histogram=LatencyHistogram(histogram).merge(delta.histogram).to_json())
+                return
+
+    # ---- 重新计算和清理 ----
+
+    def rebuild(self, since, until=None):
+        """
+        从原始日志重新计算 [since, until) 内的小时和分钟汇总（覆盖已有的汇总行）
+        since 向前取整到小时；分钟汇总只重新计算保留期内的部分
+        :return: 写入的汇总行数
+        """
+        since = bucket_start(since, 'hour')
+        minute_since = max(since, bucket_start(self.minute_cutoff(), 'hour'))
+        written = 0
+        with transaction.atomic():
+            for grain, start in (('hour', since), ('minute', minute_since)):
+                stale = self.model.objects.filter(grain=grain, bucket__gte=start)
+                if until is not None:
+                    stale = stale.filter(bucket__lt=until)
+                stale.delete()
+                rows = self._aggregate(grain, start, until)
+                self.model.objects.bulk_create(rows, batch_size=1000)
+                written += len(rows)
+        return written
+
+    def _aggregate(self, grain, since, until):
+        """按时间桶、维度和直方图的桶分组统计原始日志"""
+        time_field = self.source.time_field
+        lookups = list(self.dimensions.values())
+        latency_bin = Case(
+            When(**{f'{self.value_field}__lt': 0.001}, then=Value(0)),
+            default=Value(1) + Floor(Ln(F(self.value_field) * 1000) / Value(math.log(GROWTH))),
+            output_field=IntegerField(),
+        )
+        totals = {}
+        for queryset in self.source.query(since=since, until=until).querysets():
+            rows = queryset.order_by().annotate(
+                rollup_bucket=Trunc(time_field, grain, tzinfo=dt_timezone.utc),
+                rollup_bin=latency_bin,
+            ).values_list('rollup_bucket', *lookups, 'rollup_bin').annotate(
+                rollup_count=Count('pk'),
+                rollup_sum=Sum(self.value_field),
+                rollup_values=Count(self.value_field),
+                rollup_max=Max(self.value_field),
+            )
+            for *key, index, count, value_sum, value_count, maximum in rows:
+                delta = totals.get(tuple(key))
+                if delta is None:
+                    delta = totals[tuple(key)] = Delta()
+                delta.count += count
+                delta.value_sum += value_sum or 0
+                delta.value_count += value_count
+                if maximum is not None:
+                    delta.maximum = maximum if delta.maximum is None else max(delta.maximum, maximum)
+                if value_count:
+                    delta.histogram.counts[int(index)] += value_count
+
+        fields = ('bucket', *self.dimensions)
+        return [
+            self.model(grain=grain, **dict(zip(fields, key)), **delta.fields())
+            for key, delta in totals.items()
+        ]
+
+    def minute_cutoff(self, now=None):
+        """分钟汇总的保留起点"""
+        now = now or datetime.now(dt_timezone.utc)
+        return now - timedelta(days=getattr(settings, 'ROLLUP_MINUTE_RETENTION_DAYS', 2))
+
+    def prune(self, now=None, dry_run=False):
+        """
+        删除超过保留期的分钟和小时汇总
+        :return: 删除的行数
+        """
+        now = now or datetime.now(dt_timezone.utc)
+        hour_days = getattr(settings, 'ROLLUP_HOUR_RETENTION_DAYS', 400)
+        queryset = self.model.objects.filter(
+            Q(grain='minute', bucket__lt=self.minute_cutoff(now))
+            | Q(grain='hour', bucket__lt=now - timedelta(days=hour_days))
+        )
+        if dry_run:
+            return queryset.count()
+        return queryset.delete()[0]
+
+    # ---- 读取 ----
+
+    def buckets(self, since=None):
+        """
+        覆盖 since 至今的汇总行：整小时读取小时汇总，开头不足一小时的部分读取分钟汇总
+        since 早于分钟汇总的保留期时，开头的小时按整小时计入
+        """
+        queryset = self.model.objects.all()
+        if since is None:
+            return queryset.filter(grain='hour')
+        hour = bucket_start(since, 'hour')
+        if hour < since and since >= self.minute_cutoff():
+            hour += timedelta(hours=1)
+            return queryset.filter(
+                Q(grain='hour', bucket__gte=hour)
+                | Q(grain='minute', bucket__gte=bucket_start(since, 'minute'), bucket__lt=hour)
+            )
+        return queryset.filter(grain='hour', bucket__gte=hour)
+
+    def totals(self, since=None):
+        """
+        :return: {'count': 调用次数, 'avg_response_time': 平均响应时间(秒)或None, 'by_status': {状态: 次数}}
+        """
+        rows = self.buckets(since).order_by().values('status').annotate(
+            total=Sum('count'), value_sum=Sum('response_time_sum'), value_count=Sum('response_time_count')
+        )
+        by_status = {}
+        value_sum = value_count = 0
+        for row in rows:
+            by_status[row['status']] = row['total']
+            value_sum += row['value_sum'] or 0
+            value_count += row['value_count'] or 0
+        return {
+            'count': sum(by_status.values()),
+            'avg_response_time': value_sum / value_count if value_count else None,
+            'by_status': by_status,
+        }
+
+    def count_by(self, *fields, since=None, limit=None):
+        """
+        按字段分组合计调用次数，字段可以跨外键（例如 endpoint__name）
+        :return: [{字段: 值, ..., 'count': 数量}]，按数量从多到少排列
+        """
+        rows = self.buckets(since).order_by().values(*fields).annotate(count=Sum('count')).order_by('-count', *fields)
+        if limit:
+            rows = rows[:limit]
+        return list(rows)
+
+    def latency(self, *fields, since=None, **filters):
+        """
+        按字段分组合并各时间桶的直方图，计算响应时间分位数
+        :param fields: 分组字段（可以跨外键，例如 endpoint__name），为空时合并为一组
+        :param filters: 汇总表上的过滤条件，例如 endpoint_id=1
+        :return: [{字段: 值, ..., 'count', 'p50', 'p90', 'p99', 'max'}]，按调用次数从多到少排列，时间单位为秒
+        """
+        return self._latency(self.buckets(since).filter(**filters), fields)
+
+    def latency_series(self, since, *fields, **filters):
+        """
+        按小时给出响应时间分位数（读取小时汇总）
+        :return: [{'bucket': 小时的起始时间, 字段: 值, ..., 'count', 'p50', 'p90', 'p99', 'max'}]，按时间排列
+        """
+        rows = self.model.objects.filter(grain='hour', bucket__gte=bucket_start(since, 'hour'), **filters)
+        result = self._latency(rows, ('bucket', *fields))
+        return sorted(result, key=lambda row: row['bucket'])
+
+    def _latency(self, rows, fields):
+        groups = {}
+        for *key, histogram, maximum in rows.order_by().values_list(*fields, 'latency_histogram',
+                                                                    'response_time_max'):
+            group = groups.get(tuple(key))
+            if group is None:
+                group = groups[tuple(key)] = [LatencyHistogram(), None]
+            group[0].merge(histogram)
+            if maximum is not None:
+                group[1] = maximum if group[1] is None else max(group[1], maximum)
+
+        result = [
+            {**dict(zip(fields, key)), **histogram.summary(maximum)}
+            for key, (histogram, maximum) in groups.items()
+        ]
+        result.sort(key=lambda row: row['count'], reverse=True)
+        return result
+
+
+class Delta:
+    """一个时间桶尚未写入的增量"""
+
+    def __init__(self):
+        self.count = 0
+        self.value_sum = 0.0
+        self.value_count = 0
+        self.maximum = None
+        self.histogram = LatencyHistogram()
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            return
+        self.value_sum += value
+        self.value_count += 1
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.histogram.add(value)
+
+    def fields(self):
+        """创建汇总行时的字段值"""
+        return {
+            'count': self.count,
+            'response_time_sum': self.value_sum,
+            'response_time_count': self.value_count,
+            'response_time_max': self.maximum,
+            'latency_histogram': self.histogram.to_json(),
+        }
+
+
+def rollup_tables():
+    """所有日志汇总表"""
+    return list(_rollup_tables)
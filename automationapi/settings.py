@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 from decouple import config
 
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'automationapi.deadline.DeadlineMiddleware',
 ]
 
 ROOT_URLCONF = 'automationapi.urls'
@@ -130,6 +132,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework Configuration
 REST_FRAMEWORK = {
+    # 安装orjson时使用orjson编解码（见 automationapi/fastjson.py）
+    'DEFAULT_RENDERER_CLASSES': [
+        'automationapi.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'automationapi.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -150,3 +162,81 @@ CORS_ALLOWED_ORIGINS = [
 MICROSOFT_CLIENT_ID = config('MICROSOFT_CLIENT_ID', default='')
 MICROSOFT_CLIENT_SECRET = config('MICROSOFT_CLIENT_SECRET', default='')
 MICROSOFT_TENANT_ID = config('MICROSOFT_TENANT_ID', default='')
+MICROSOFT_TOKEN_REFRESH_LEASE = config('MICROSOFT_TOKEN_REFRESH_LEASE', default=30, cast=int)  # 令牌刷新租约时长（秒）
+MICROSOFT_TOKEN_PREREFRESH_MARGIN = config('MICROSOFT_TOKEN_PREREFRESH_MARGIN', default=600, cast=int)  # 提前续期秒数
+MICROSOFT_TOKEN_PREREFRESH_JITTER = config('MICROSOFT_TOKEN_PREREFRESH_JITTER', default=120, cast=int)  # 续期随机抖动（秒）
+MICROSOFT_TOKEN_PREREFRESH_RETRY = config('MICROSOFT_TOKEN_PREREFRESH_RETRY', default=30, cast=int)  # 续期失败后重试间隔（秒）
+
+# 出站HTTP连接池配置
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=10, cast=int)  # 每个主机的最大连接数
+HTTP_POOL_IDLE_TIMEOUT = config('HTTP_POOL_IDLE_TIMEOUT', default=60, cast=int)  # Session空闲超时（秒）
+HTTP_ASYNC_MAX_CONNECTIONS = config('HTTP_ASYNC_MAX_CONNECTIONS', default=200, cast=int)  # 异步客户端最大并发连接数
+
+# 出站请求超时配置（秒），出站超时不会超过入站请求的剩余时间
+API_REQUEST_TIMEOUT = config('API_REQUEST_TIMEOUT', default=25, cast=float)  # 入站请求未带 X-Request-Timeout 时的默认时间预算
+API_REQUEST_TIMEOUT_MAX = config('API_REQUEST_TIMEOUT_MAX', default=25, cast=float)  # X-Request-Timeout 允许的最大值
+API_LONG_REQUEST_TIMEOUT = config('API_LONG_REQUEST_TIMEOUT', default=900, cast=float)  # 分块批量写入、导出、批量请求等长时间视图的时间预算，0表示不限
+GRAPH_CONNECT_TIMEOUT = config('GRAPH_CONNECT_TIMEOUT', default=5, cast=float)  # Graph连接超时，可被APIEndpoint覆盖
+GRAPH_READ_TIMEOUT = config('GRAPH_READ_TIMEOUT', default=30, cast=float)  # Graph读取超时，可被APIEndpoint覆盖
+KINTONE_CONNECT_TIMEOUT = config('KINTONE_CONNECT_TIMEOUT', default=5, cast=float)  # Kintone连接超时
+KINTONE_READ_TIMEOUT = config('KINTONE_READ_TIMEOUT', default=30, cast=float)  # Kintone读取超时
+KINTONE_ENDPOINT_READ_TIMEOUTS = config(
+    'KINTONE_ENDPOINT_READ_TIMEOUTS', default='bulkRequest.json=60,records/cursor.json=60',
+    cast=lambda v: {k.strip(): float(t) for k, t in (item.split('=') for item in v.split(',') if item.strip())}
+)  # 按Kintone API端点覆盖读取超时，格式 端点=秒,端点=秒
+KINTONE_LOG_BODY_MAX_SIZES = config(
+    'KINTONE_LOG_BODY_MAX_SIZES', default='',
+    cast=lambda v: {k.strip(): int(n) for k, n in (item.split('=') for item in v.split(',') if item.strip())}
+)  # 按Kintone API端点覆盖 LOG_BODY_MAX_SIZE，格式 端点=字节数,端点=字节数（例如 file.json=0）
+
+# 出站请求重试配置（429/503/504及网络错误）
+API_RETRY_MAX_ATTEMPTS = config('API_RETRY_MAX_ATTEMPTS', default=4, cast=int)  # 最多尝试次数（含第一次）
+API_RETRY_BASE_DELAY = config('API_RETRY_BASE_DELAY', default=0.5, cast=float)  # 指数退避基数（秒）
+API_RETRY_MAX_DELAY = config('API_RETRY_MAX_DELAY', default=30, cast=float)  # 单次退避上限（秒）
+API_RETRY_MAX_TOTAL = config('API_RETRY_MAX_TOTAL', default=60, cast=float)  # 单次调用的总重试时间上限（秒）
+API_RETRY_WRITES = config('API_RETRY_WRITES', default=False, cast=bool)  # 是否默认重试POST等非幂等请求
+
+# 出站请求限流配置（令牌桶，Graph按租户、Kintone按域名，所有worker共享）
+RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', default='file')  # local（进程内）、file（同主机共享文件）或 redis
+RATE_LIMIT_FILE = config('RATE_LIMIT_FILE', default=str(Path(tempfile.gettempdir()) / 'automationapi-ratelimit.json'))  # file后端的状态文件
+RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', default='redis://localhost:6379/0')  # redis后端地址
+RATE_LIMIT_MAX_WAIT = config('RATE_LIMIT_MAX_WAIT', default=10, cast=float)  # 令牌不足时最长等待时间（秒），超过则直接拒绝
+GRAPH_RATE_LIMIT = config('GRAPH_RATE_LIMIT', default=20, cast=float)  # 每个租户每秒请求数，0表示不限流
+GRAPH_RATE_BURST = config('GRAPH_RATE_BURST', default=40, cast=int)  # 每个租户允许的突发请求数
+KINTONE_RATE_LIMIT = config('KINTONE_RATE_LIMIT', default=10, cast=float)  # 每个Kintone域名每秒请求数，0表示不限流
+KINTONE_RATE_BURST = config('KINTONE_RATE_BURST', default=20, cast=int)  # 每个Kintone域名允许的突发请求数
+
+# 出站请求熔断配置（Graph按端点、Kintone按连接和应用，每个worker独立统计）
+CIRCUIT_FAILURE_THRESHOLD = config('CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)  # 连续失败多少次后熔断
+CIRCUIT_RECOVERY_TIMEOUT = config('CIRCUIT_RECOVERY_TIMEOUT', default=30, cast=float)  # 熔断后多少秒放行探测请求
+CIRCUIT_HALF_OPEN_MAX_CALLS = config('CIRCUIT_HALF_OPEN_MAX_CALLS', default=1, cast=int)  # 半开状态同时放行的探测请求数
+CIRCUIT_SLOW_CALL_THRESHOLD = config('CIRCUIT_SLOW_CALL_THRESHOLD', default=10, cast=float)  # 超过多少秒的调用按失败计算
+
+# 调用日志缓冲写入配置（仅在WSGI/ASGI入口启用，测试和管理命令中同步写入）
+LOG_BUFFER_ENABLED = config('LOG_BUFFER_ENABLED', default=True, cast=bool)  # 是否由后台线程批量写入日志
+LOG_BUFFER_MAX_SIZE = config('LOG_BUFFER_MAX_SIZE', default=10000, cast=int)  # 每种日志在内存中最多缓冲的行数
+LOG_BUFFER_BATCH_SIZE = config('LOG_BUFFER_BATCH_SIZE', default=500, cast=int)  # 缓冲达到此行数时立即写入
+LOG_BUFFER_FLUSH_INTERVAL = config('LOG_BUFFER_FLUSH_INTERVAL', default=1.0, cast=float)  # 最长写入间隔（秒）
+LOG_BUFFER_OVERFLOW = config('LOG_BUFFER_OVERFLOW', default='sync')  # 缓冲区已满时：sync（同步写入）、drop_new、drop_oldest
+
+# 调用日志分区存储（见 automationapi/partitions.py）
+LOG_PARTITION_ENABLED = config('LOG_PARTITION_ENABLED', default=True, cast=bool)  # 是否按时间写入分区表（关闭后写入原表）
+LOG_PARTITION_PERIOD = config('LOG_PARTITION_PERIOD', default='month')  # 分区周期：month或week（按UTC划分）
+LOG_RETENTION_DAYS = config('LOG_RETENTION_DAYS', default=90, cast=int)  # prune_logs 保留的天数，0表示不清理
+
+# 调用日志的请求体/响应体（压缩去重存储，见 automationapi/bodystore.py）
+LOG_BODY_MAX_SIZE = config('LOG_BODY_MAX_SIZE', default=65536, cast=int)  # 每份内容最多保存的字节数，0表示不保存
+LOG_BODY_CODEC = config('LOG_BODY_CODEC', default='')  # 压缩方式：zstd、zlib或none，为空时安装了zstandard用zstd，否则用zlib
+
+# 统计接口读取的调用汇总（见 automationapi/rollups.py）
+ROLLUP_ENABLED = config('ROLLUP_ENABLED', default=True, cast=bool)  # 写入日志后是否累加到汇总表
+ROLLUP_MINUTE_RETENTION_DAYS = config('ROLLUP_MINUTE_RETENTION_DAYS', default=2, cast=int)  # 分钟汇总保留的天数
+ROLLUP_HOUR_RETENTION_DAYS = config('ROLLUP_HOUR_RETENTION_DAYS', default=400, cast=int)  # 小时汇总保留的天数
+
+# 使用量计数器（APIEndpoint.total_calls、KintoneApp.total_requests）
+COUNTER_BUFFER_ENABLED = config('COUNTER_BUFFER_ENABLED', default=True, cast=bool)  # 是否在内存中累加后定期写入
+COUNTER_FLUSH_INTERVAL = config('COUNTER_FLUSH_INTERVAL', default=5.0, cast=float)  # 写入间隔（秒）
+
+# Kintone配置
+KINTONE_ASYNC_CONCURRENCY = config('KINTONE_ASYNC_CONCURRENCY', default=10, cast=int)  # 异步客户端每个连接的最大并发请求数
+KINTONE_BULK_PARALLELISM = config('KINTONE_BULK_PARALLELISM', default=4, cast=int)  # 批量写入超过100条时分批并发提交的线程数
@@ -0,0 +1,176 @@
+"""
+流式响应工具
+把记录迭代器编码为NDJSON、CSV或列式NDJSON并逐行输出，导出大量数据时内存占用恒定
+同时支持同步迭代器（WSGI）和异步迭代器（ASGI，避免Django先把同步迭代器读入内存）
+响应体在视图返回、中间件恢复截止时间之后才被迭代，因此每次读取上游数据时都重新进入视图的截止时间
+"""
+import csv
+import io
+import json
+
+from django.http import StreamingHttpResponse
+
+from . import fastjson
+from .deadline import get_deadline, use_deadline
+
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'columnar': 'application/x-ndjson',
+}
+
+# 列式格式每行包含的记录数
+COLUMNAR_BATCH_SIZE = 1000
+
+
+def encode_ndjson(item):
+    """把一条记录编码为一行NDJSON"""
+    return fastjson.dumps(item, default=str) + b'\n'
+
+
+class CSVEncoder:
+    """逐行编码CSV，第一行输出前先输出表头"""
+
+    def __init__(self, columns=None):
+        """
+        :param columns: 列名列表，为None时使用第一行的键
+        """
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = None
+
+    def __call__(self, row):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.buffer, fieldnames=self.columns or list(row.keys()),
+                                         extrasaction='ignore')
+            # 带BOM以便Excel正确识别UTF-8
+            self.buffer.write('\ufeff')
+            self.writer.writeheader()
+        self.writer.writerow({
+            key: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+            for key, value in row.items()
+        })
+        line = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return line
+
+
+class ColumnarEncoder:
+    """
+    按批编码列式NDJSON：第一行是 {"columns": [列名]}，之后每行是一批记录按列转置后的数组，
+    即 [[第1列的值...], [第2列的值...], ...]，列名不随每条记录重复，体积比NDJSON小得多
+    """
+
+    def __init__(self, columns=None):
+        """
+        :param columns: 列名列表，为None时使用第一条记录的键
+        """
+        self.columns = columns
+        self.started = False
+
+    def __call__(self, rows):
+        line = b''
+        if not self.started:
+            self.started = True
+            if self.columns is None:
+                self.columns = list(rows[0].keys()) if rows else []
+            line = fastjson.dumps({'columns': self.columns}) + b'\n'
+        if rows:
+            line += fastjson.dumps([[row.get(column) for row in rows] for column in self.columns],
+                                   default=str) + b'\n'
+        return line
+
+
+def _lines(items, encode):
+    for item in items:
+        yield encode(item)
+
+
+async def _alines(items, encode):
+    async for item in items:
+        yield encode(item)
+
+
+def _batches(items, encode, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield encode(batch)
+            batch = []
+    yield encode(batch)
+
+
+async def _abatches(items, encode, batch_size):
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield encode(batch)
+            batch = []
+    yield encode(batch)
+
+
+def _with_deadline(lines, deadline):
+    """每输出一行前恢复视图的截止时间，上游分页请求仍受其限制"""
+    try:
+        while True:
+            with use_deadline(deadline):
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    return
+            yield line
+    finally:
+        # 客户端中途断开时关闭迭代器，其清理逻辑（如删除游标）同样在截止时间内执行
+        with use_deadline(deadline):
+            lines.close()
+
+
+async def _awith_deadline(lines, deadline):
+    try:
+        while True:
+            with use_deadline(deadline):
+                try:
+                    line = await lines.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield line
+    finally:
+        with use_deadline(deadline):
+            await lines.aclose()
+
+
+def streaming_export(items, export_format='ndjson', filename='export', columns=None, to_row=None,
+                     batch_size=COLUMNAR_BATCH_SIZE):
+    """
+    构造流式导出响应
+    :param items: 记录迭代器或异步迭代器
+    :param export_format: ndjson、csv 或 columnar
+    :param filename: 下载文件名（不含扩展名）
+    :param columns: CSV和列式格式的列名
+    :param to_row: CSV和列式格式下把记录转换为扁平字典的函数
+    :param batch_size: 列式格式每行包含的记录数
+    """
+    is_async = hasattr(items, '__aiter__')
+    if export_format == 'columnar':
+        to_columns = ColumnarEncoder(columns)
+        encode = (lambda rows: to_columns([to_row(row) for row in rows])) if to_row else to_columns
+        lines = (_abatches if is_async else _batches)(items, encode, batch_size)
+    else:
+        if export_format == 'csv':
+            to_csv = CSVEncoder(columns)
+            encode = (lambda item: to_csv(to_row(item))) if to_row else to_csv
+        else:
+            encode = encode_ndjson
+        lines = _alines(items, encode) if is_async else _lines(items, encode)
+    # 在视图内调用时记下截止时间（@long_running 设置的导出预算）
+    lines = (_awith_deadline if is_async else _with_deadline)(lines, get_deadline())
+
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    # 禁止反向代理缓冲，让客户端立即开始接收数据
+    response['X-Accel-Buffering'] = 'no'
+    return response
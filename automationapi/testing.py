@@ -0,0 +1,76 @@
+"""
+测试辅助
+模拟的上游响应和各应用测试共用的数据，字段都有默认值，测试只需传入与默认值不同的字段
+"""
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from requests import HTTPError
+
+from kintone_api.models import KintoneApp, KintoneConnection
+from microsoft_api.models import APIEndpoint, APIToken
+
+
+def fake_response(status_code=200, json_data=None, headers=None):
+    """构造模拟的requests响应"""
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = json_data if json_data is not None else {}
+    response.content = json.dumps(json_data).encode() if json_data is not None else b''
+    response.text = str(json_data or '')
+    if status_code >= 400:
+        response.raise_for_status.side_effect = HTTPError(f'{status_code} Error')
+    else:
+        response.raise_for_status.return_value = None
+    return response
+
+
+def create_user(username='testuser', **fields):
+    return User.objects.create_user(username=username, password='testpass123', **fields)
+
+
+def create_api_token(**fields):
+    """创建Graph的Token，默认带有一小时后过期的访问令牌，调用时不请求OAuth端点"""
+    return APIToken.objects.create(**{
+        'name': '测试Token',
+        'client_id': 'test-id',
+        'client_secret': 'test-secret',
+        'tenant_id': 'test-tenant',
+        'access_token': 'cached-token',
+        'token_expires_at': timezone.now() + timedelta(hours=1),
+        **fields,
+    })
+
+
+def create_endpoint(**fields):
+    return APIEndpoint.objects.create(**{
+        'name': '测试端点',
+        'service': 'teams',
+        'endpoint_url': 'teams/test',
+        'http_method': 'GET',
+        **fields,
+    })
+
+
+def create_connection(**fields):
+    """创建使用API令牌认证的Kintone连接"""
+    return KintoneConnection.objects.create(**{
+        'name': '测试连接',
+        'subdomain': 'example',
+        'auth_type': 'api_token',
+        'api_token': 'test-api-token',
+        **fields,
+    })
+
+
+def create_app(connection=None, **fields):
+    return KintoneApp.objects.create(**{
+        'connection': connection or create_connection(),
+        'app_id': '1',
+        'app_name': '测试应用',
+        **fields,
+    })
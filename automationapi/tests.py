@@ -0,0 +1,417 @@
+"""
+公共组件单元测试
+"""
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import httpx
+import requests
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import fastjson, logbuffer
+from .circuit import CircuitBreaker, CircuitGuard, CircuitOpenError
+from .deadline import (
+    Deadline, DeadlineMiddleware, current_deadline, get_deadline, request_timeout, timeout_phase, use_deadline
+)
+from .http import SessionPool
+from .ratelimit import LocalBackend, FileBackend, RateLimiter, RateLimitExceeded
+from .renderers import FastJSONParser, FastJSONRenderer
+from .retry import RetryPolicy, parse_retry_after
+from .streaming import streaming_export
+
+
+class SessionPoolTest(SimpleTestCase):
+    """出站连接池测试"""
+
+    def test_reuse_session_per_host(self):
+        """测试同一主机复用Session"""
+        pool = SessionPool('test', idle_timeout=60)
+        first = pool.for_url('https://graph.microsoft.com/v1.0/me')
+        second = pool.for_url('https://graph.microsoft.com/v1.0/teams')
+        other = pool.for_url('https://login.microsoftonline.com/tenant/oauth2/v2.0/token')
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        stats = pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['sessions'], 2)
+
+    def test_idle_session_is_recreated(self):
+        """测试空闲超时的Session会被重建"""
+        pool = SessionPool('test', idle_timeout=10)
+        with mock.patch('automationapi.http.time.monotonic', return_value=100.0):
+            first = pool.get('host')
+        with mock.patch('automationapi.http.time.monotonic', return_value=111.0):
+            second = pool.get('host')
+
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()['expired'], 1)
+
+    def test_sessions_dropped_after_fork(self):
+        """测试fork后的子进程不沿用父进程的Session"""
+        pool = SessionPool('test')
+        first = pool.get('host')
+        with mock.patch('automationapi.http.os.getpid', return_value=pool._pid + 1):
+            second = pool.get('host')
+
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()['misses'], 1)
+
+    def test_discard_where(self):
+        """测试按条件关闭Session"""
+        pool = SessionPool('test')
+        pool.get((1, 'a'))
+        pool.get((2, 'b'))
+        pool.discard_where(lambda key: key[0] == 1)
+
+        self.assertEqual(pool.stats()['sessions'], 1)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+
+class RetryPolicyTest(SimpleTestCase):
+    """重试策略测试"""
+
+    def response(self, status_code, retry_after=None):
+        response = mock.Mock(status_code=status_code)
+        response.headers = {'Retry-After': retry_after} if retry_after else {}
+        return response
+
+    def test_parse_retry_after(self):
+        """测试解析秒数和HTTP日期格式的Retry-After"""
+        self.assertEqual(parse_retry_after('7'), 7.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_full_jitter_backoff(self):
+        """测试退避时间在 [0, min(上限, 基数*2^n)] 内"""
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt in range(1, 6):
+            for _ in range(20):
+                self.assertLessEqual(policy.backoff(attempt), min(5, 2 ** (attempt - 1)))
+
+    def test_only_idempotent_by_default(self):
+        """测试默认只重试幂等请求，写操作需要显式开启"""
+        policy = RetryPolicy(retry_writes=False)
+        self.assertTrue(policy.allows('GET'))
+        self.assertTrue(policy.allows('delete'))
+        self.assertFalse(policy.allows('POST'))
+        self.assertTrue(policy.allows('POST', retry=True))
+        self.assertFalse(policy.allows('GET', retry=False))
+        self.assertIsNone(policy.begin('POST').delay_for(response=self.response(503)))
+
+    def test_retry_after_and_limits(self):
+        """测试遵循Retry-After，并受最大次数和总时间限制"""
+        policy = RetryPolicy(max_attempts=2, base_delay=0.1, max_total=10)
+        state = policy.begin('GET')
+
+        attempts = iter(state)
+        next(attempts)
+        self.assertEqual(state.delay_for(response=self.response(429, '3')), 3.0)
+        self.assertIsNone(state.delay_for(response=self.response(400)))
+        self.assertIsNone(state.delay_for(error=ValueError('不可重试')))
+        self.assertIsNotNone(state.delay_for(error=requests.ConnectionError()))
+        # Retry-After超过总时间上限
+        self.assertIsNone(state.delay_for(response=self.response(429, '30')))
+
+        next(attempts)
+        self.assertIsNone(state.delay_for(response=self.response(503)))
+
+
+class RateLimiterTest(SimpleTestCase):
+    """令牌桶限流测试"""
+
+    def test_burst_then_wait(self):
+        """测试突发额度用完后返回需要等待的时间"""
+        limiter = RateLimiter(LocalBackend())
+        with mock.patch('time.time', return_value=1000.0):
+            waits = [limiter.reserve('graph:t1', rate=2, capacity=3, max_wait=10) for _ in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        # 后续请求排队预订令牌
+        self.assertEqual(waits[3:], [0.5, 1.0])
+
+    def test_shed_when_wait_too_long(self):
+        """测试等待时间超过上限时拒绝请求且不占用令牌"""
+        limiter = RateLimiter(LocalBackend())
+        with mock.patch('time.time', return_value=1000.0):
+            limiter.reserve('kintone:a', rate=1, capacity=1, max_wait=0)
+            with self.assertRaises(RateLimitExceeded):
+                limiter.reserve('kintone:a', rate=1, capacity=1, max_wait=0)
+            self.assertEqual(limiter.level('kintone:a', 1, 1)['tokens'], 0)
+            # 不同的键互不影响
+            self.assertEqual(limiter.reserve('kintone:b', rate=1, capacity=1, max_wait=0), 0.0)
+
+    def test_file_backend_shared_between_instances(self):
+        """测试文件后端在多个限流器（模拟多个worker）之间共享状态"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ratelimit.json')
+            first = RateLimiter(FileBackend(path))
+            second = RateLimiter(FileBackend(path))
+            with mock.patch('time.time', return_value=1000.0):
+                first.reserve('graph:t1', rate=1, capacity=2)
+                second.reserve('graph:t1', rate=1, capacity=2)
+                self.assertEqual(first.level('graph:t1', 1, 2)['tokens'], 0)
+                first.block('graph:t1', 5, rate=1, capacity=2)
+                self.assertEqual(second.level('graph:t1', 1, 2)['tokens'], -5)
+
+    def test_file_backend_drops_full_buckets(self):
+        """测试文件后端写回时丢弃已经补满的桶"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ratelimit.json')
+            limiter = RateLimiter(FileBackend(path))
+            with mock.patch('time.time', return_value=1000.0):
+                limiter.reserve('kintone:a', rate=1, capacity=2)
+            with mock.patch('time.time', return_value=1010.0):
+                limiter.reserve('kintone:b', rate=1, capacity=2)
+            with open(path) as f:
+                self.assertEqual(list(json.load(f)), ['kintone:b'])
+
+    def test_async_acquire_off_event_loop(self):
+        """测试异步预订令牌在线程池中访问后端，不阻塞事件循环"""
+        backend = LocalBackend()
+        limiter = RateLimiter(backend)
+        threads = []
+        apply = backend.apply
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            return apply(*args)
+
+        async def acquire():
+            await limiter.aacquire('graph:t1', rate=1, capacity=1)
+            return threading.get_ident()
+
+        with mock.patch.object(backend, 'apply', side_effect=record_thread):
+            loop_thread = asyncio.run(acquire())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    def test_disabled_when_rate_is_zero(self):
+        """测试速率为0时不限流"""
+        limiter = RateLimiter(LocalBackend())
+        self.assertEqual(limiter.reserve('graph:t1', rate=0, capacity=1, max_wait=0), 0.0)
+        self.assertFalse(limiter.level('graph:t1', 0, 1)['enabled'])
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    """熔断器测试"""
+
+    def test_open_after_consecutive_failures(self):
+        """测试连续失败达到阈值后熔断，成功会清零失败计数"""
+        breaker = CircuitBreaker('graph:endpoint:1', failure_threshold=2, recovery_timeout=30)
+        breaker.record_failure()
+        breaker.record_success(0.1)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        self.assertEqual(breaker.snapshot()['rejected'], 1)
+
+    def test_half_open_probe(self):
+        """测试恢复时间后只放行有限的探测请求，探测成功后恢复"""
+        breaker = CircuitBreaker('kintone:connection:1', failure_threshold=1, recovery_timeout=30,
+                                 half_open_max_calls=1)
+        with mock.patch('time.monotonic', return_value=1000.0):
+            breaker.record_failure()
+        with mock.patch('time.monotonic', return_value=1031.0):
+            breaker.before_call()
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+            breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        """测试探测失败时重新熔断"""
+        breaker = CircuitBreaker('kintone:app:1', failure_threshold=3, recovery_timeout=30)
+        with mock.patch('time.monotonic', return_value=1000.0):
+            for _ in range(3):
+                breaker.record_failure()
+        with mock.patch('time.monotonic', return_value=1031.0):
+            breaker.before_call()
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertEqual(breaker.snapshot()['retry_in'], 30)
+
+    def test_slow_calls_count_as_failures(self):
+        """测试超过慢调用阈值的成功响应按失败计算"""
+        breaker = CircuitBreaker('graph:endpoint:2', failure_threshold=2, slow_call_threshold=5)
+        breaker.record_success(6)
+        breaker.record_success(7)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.snapshot()['slow_calls'], 2)
+
+    def test_guard_releases_probe_when_rejected(self):
+        """测试多个熔断器中任一拒绝时，已放行的探测名额被释放"""
+        connection = CircuitBreaker('kintone:connection:2', failure_threshold=1, recovery_timeout=30)
+        app = CircuitBreaker('kintone:app:2', failure_threshold=1, recovery_timeout=30)
+        with mock.patch('time.monotonic', return_value=1000.0):
+            connection.record_failure()
+            app.record_failure()
+        with mock.patch('time.monotonic', return_value=1031.0):
+            app.before_call()
+            with self.assertRaises(CircuitOpenError):
+                CircuitGuard([connection, app]).enter()
+            self.assertEqual(connection.probes, 0)
+
+
+class DeadlineTest(SimpleTestCase):
+    """调用截止时间测试"""
+
+    @override_settings(API_REQUEST_TIMEOUT=60, API_REQUEST_TIMEOUT_MAX=120)
+    def test_middleware_sets_deadline_from_header(self):
+        """测试中间件按请求头设置截止时间，并限制最大值"""
+        budgets = []
+        middleware = DeadlineMiddleware(lambda request: budgets.append(get_deadline().budget))
+        factory = RequestFactory()
+
+        middleware(factory.get('/'))
+        middleware(factory.get('/', HTTP_X_REQUEST_TIMEOUT='5'))
+        middleware(factory.get('/', HTTP_X_REQUEST_TIMEOUT='600'))
+
+        self.assertEqual(budgets, [60, 5, 120])
+        self.assertIsNone(get_deadline())
+
+    def test_timeout_clamped_to_remaining(self):
+        """测试出站超时不超过剩余时间"""
+        self.assertEqual(request_timeout(5, 30), (5, 30))
+        token = current_deadline.set(Deadline(2))
+        try:
+            connect, read = request_timeout(5, 30)
+        finally:
+            current_deadline.reset(token)
+        self.assertLessEqual(connect, 2)
+        self.assertLessEqual(read, 2)
+
+    def test_no_retry_past_deadline(self):
+        """测试退避等待会越过截止时间时不再重试"""
+        state = RetryPolicy(max_attempts=5, base_delay=1, max_total=60).begin('GET')
+        next(iter(state))
+        error = requests.ConnectionError()
+        token = current_deadline.set(Deadline(0.5))
+        try:
+            with mock.patch('random.uniform', return_value=1.0):
+                self.assertIsNone(state.delay_for(error=error))
+        finally:
+            current_deadline.reset(token)
+
+    def test_async_export_keeps_view_deadline(self):
+        """测试异步流式导出在视图返回后迭代时仍使用视图的截止时间"""
+        budgets = []
+
+        async def items():
+            for i in range(3):
+                budgets.append(get_deadline().budget)
+                yield {'n': i}
+
+        async def consume(response):
+            return [line async for line in response.streaming_content]
+
+        with use_deadline(Deadline(600)):
+            response = streaming_export(items())
+        lines = asyncio.run(consume(response))
+
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(budgets, [600] * 3)
+        self.assertIsNone(get_deadline())
+
+    def test_timeout_phase(self):
+        """测试按异常类型判断超时阶段"""
+        self.assertEqual(timeout_phase(requests.ConnectTimeout()), 'connect')
+        self.assertEqual(timeout_phase(requests.ReadTimeout()), 'read')
+        self.assertEqual(timeout_phase(httpx.PoolTimeout('pool')), 'pool')
+        self.assertIsNone(timeout_phase(requests.ConnectionError()))
+
+
+class FastJSONTest(SimpleTestCase):
+    """快速JSON编解码测试"""
+
+    def test_renderer_matches_drf(self):
+        """测试渲染结果与DRF默认渲染器解析后一致，日期时间格式相同"""
+        from datetime import datetime, timezone as dt_timezone
+        from decimal import Decimal
+        from rest_framework.renderers import JSONRenderer
+
+        data = {'名称': '客户\u2028', 'amount': Decimal('1.50'), 1: [1, 2],
+                'at': datetime(2024, 5, 1, 9, 30, 0, 123456, tzinfo=dt_timezone.utc)}
+        fast = FastJSONRenderer().render(data)
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data)))
+        self.assertIn(b'"2024-05-01T09:30:00.123456Z"', fast)
+        self.assertIn(b'\\u2028', fast)
+
+    def test_fallback_for_unsupported_values(self):
+        """测试orjson不支持的值回退到标准库"""
+        self.assertEqual(fastjson.loads(fastjson.dumps({'big': 2 ** 70})), {'big': 2 ** 70})
+
+    def test_parser(self):
+        """测试解析请求体，无效JSON时返回ParseError"""
+        from rest_framework.exceptions import ParseError
+
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"app_id": "1", "名称": "客户"}'.encode())),
+                         {'app_id': '1', '名称': '客户'})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{invalid'))
+
+
+class BufferedLogWriterTest(SimpleTestCase):
+    """日志缓冲写入测试"""
+
+    def make_writer(self, **kwargs):
+        model = mock.Mock()
+        model._meta.model_name = 'testlog'
+        writer = logbuffer.BufferedLogWriter(model, **kwargs)
+        self.addCleanup(logbuffer._writers.remove, writer)
+        return writer, model.objects.bulk_create
+
+    def written(self, bulk_create):
+        return [obj for call in bulk_create.call_args_list for obj in call.args[0]]
+
+    def test_writes_synchronously_until_started(self):
+        """测试未启用缓冲时直接保存"""
+        writer, bulk_create = self.make_writer()
+        row = mock.Mock()
+        writer.write(row)
+        row.save.assert_called_once_with()
+        bulk_create.assert_not_called()
+
+    @mock.patch.object(logbuffer, '_started', True)
+    def test_flush_by_size_and_on_stop(self):
+        """测试达到批大小时由后台线程写入，停止时写完剩余日志"""
+        writer, bulk_create = self.make_writer(batch_size=3, flush_interval=60)
+        rows = [mock.Mock() for _ in range(4)]
+        for row in rows:
+            writer.write(row)
+
+        writer.stop()
+
+        self.assertEqual(self.written(bulk_create), rows)
+        self.assertFalse(any(row.save.called for row in rows))
+        self.assertEqual(writer.stats()['written'], 4)
+
+    @mock.patch.object(logbuffer, '_started', True)
+    def test_overflow_policies(self):
+        """测试缓冲区已满时的三种处理方式"""
+        for overflow, expected_written, expected_saved in [
+            ('drop_new', [0, 1], []),
+            ('drop_oldest', [1, 2], []),
+            ('sync', [0, 1], [2]),
+        ]:
+            writer, bulk_create = self.make_writer(max_size=2, batch_size=10, flush_interval=60,
+                                                   overflow=overflow)
+            rows = [mock.Mock() for _ in range(3)]
+            for row in rows:
+                writer.write(row)
+            writer.stop()
+
+            self.assertEqual(self.written(bulk_create), [rows[i] for i in expected_written], overflow)
+            self.assertEqual([i for i, row in enumerate(rows) if row.save.called], expected_saved, overflow)
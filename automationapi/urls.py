@@ -41,6 +41,19 @@ def api_root(request):
                     'sharepoint_operation': '/api/microsoft/sharepoint_operation/',
                     'list_teams': '/api/microsoft/list_teams/',
                     'list_emails': '/api/microsoft/list_emails/',
+                    'export_items': '/api/microsoft/export_items/',
+                    'batch': '/api/microsoft/batch/',
+                    'pool_stats': '/api/microsoft/pool_stats/',
+                    'rate_limits': '/api/microsoft/rate_limits/',
+                    'circuit_breakers': '/api/microsoft/circuit_breakers/',
+                },
+                'async_operations': {
+                    'send_teams_message': '/api/async/microsoft/send_teams_message/',
+                    'send_email': '/api/async/microsoft/send_email/',
+                    'sharepoint_operation': '/api/async/microsoft/sharepoint_operation/',
+                    'list_teams': '/api/async/microsoft/list_teams/',
+                    'list_emails': '/api/async/microsoft/list_emails/',
+                    'export_items': '/api/async/microsoft/export_items/',
                 }
             },
             'kintone': {
@@ -50,6 +63,7 @@ def api_root(request):
                 'field_mappings': '/api/kintone/field-mappings/',
                 'operations': {
                     'get_records': '/api/kintone/kintone/get_records/',
+                    'export_records': '/api/kintone/kintone/export_records/',
                     'get_record': '/api/kintone/kintone/get_record/',
                     'add_record': '/api/kintone/kintone/add_record/',
                     'add_records': '/api/kintone/kintone/add_records/',
@@ -58,6 +72,23 @@ def api_root(request):
                     'delete_records': '/api/kintone/kintone/delete_records/',
                     'get_app_info': '/api/kintone/kintone/get_app_info/',
                     'get_form_fields': '/api/kintone/kintone/get_form_fields/',
+                    'bulk_request': '/api/kintone/kintone/bulk_request/',
+                    'pool_stats': '/api/kintone/kintone/pool_stats/',
+                    'rate_limits': '/api/kintone/kintone/rate_limits/',
+                    'circuit_breakers': '/api/kintone/kintone/circuit_breakers/',
+                },
+                'async_operations': {
+                    'get_records': '/api/kintone/async/kintone/get_records/',
+                    'export_records': '/api/kintone/async/kintone/export_records/',
+                    'get_record': '/api/kintone/async/kintone/get_record/',
+                    'add_record': '/api/kintone/async/kintone/add_record/',
+                    'add_records': '/api/kintone/async/kintone/add_records/',
+                    'update_record': '/api/kintone/async/kintone/update_record/',
+                    'update_records': '/api/kintone/async/kintone/update_records/',
+                    'delete_records': '/api/kintone/async/kintone/delete_records/',
+                    'get_app_info': '/api/kintone/async/kintone/get_app_info/',
+                    'get_form_fields': '/api/kintone/async/kintone/get_form_fields/',
+                    'bulk_request': '/api/kintone/async/kintone/bulk_request/',
                 }
             }
         }
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automationapi.settings')
 
 application = get_wsgi_application()
+
+# 启用调用日志和使用量计数器的后台写入，进程退出时写完剩余数据
+from automationapi.counters import start_counters  # noqa: E402
+from automationapi.logbuffer import start_log_writers  # noqa: E402
+
+start_log_writers()
+start_counters()
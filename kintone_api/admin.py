@@ -3,7 +3,10 @@ Kintone Admin后台配置
 """
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import KintoneConnection, KintoneApp, KintoneRequestLog, KintoneFieldMapping
+from automationapi.admin import PartitionedLogAdmin, RequestMethodListFilter
+from .models import (
+    KintoneConnection, KintoneApp, KintoneRequestLog, KintoneFieldMapping, request_log_bodies, request_log_partitions
+)
 
 
 @admin.register(KintoneConnection)
@@ -44,10 +47,10 @@ class KintoneAppAdmin(admin.ModelAdmin):
     """Kintone应用管理"""
     
     list_display = ['app_name', 'app_id', 'connection', 'is_active', 
-                   'total_requests', 'last_accessed']
+                   'total_requests_display', 'last_accessed_display']
     list_filter = ['connection', 'is_active', 'created_at']
     search_fields = ['app_name', 'app_id', 'description']
-    readonly_fields = ['total_requests', 'last_accessed', 'created_at', 'updated_at']
+    readonly_fields = ['total_requests_display', 'last_accessed_display', 'created_at', 'updated_at']
     
     fieldsets = (
         ('基本信息', {
@@ -57,7 +60,7 @@ class KintoneAppAdmin(admin.ModelAdmin):
             'fields': ('description',)
         }),
         ('统计信息', {
-            'fields': ('total_requests', 'last_accessed'),
+            'fields': ('total_requests_display', 'last_accessed_display'),
             'classes': ('collapse',)
         }),
         ('时间戳', {
@@ -65,35 +68,48 @@ class KintoneAppAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def total_requests_display(self, obj):
+        """总请求次数（包含尚未写入数据库的增量）"""
+        return obj.current_total_requests
+    total_requests_display.short_description = '总请求次数'
+    total_requests_display.admin_order_field = 'total_requests'
+    
+    def last_accessed_display(self, obj):
+        """最后访问时间（包含尚未写入数据库的请求）"""
+        return obj.current_last_accessed
+    last_accessed_display.short_description = '最后访问时间'
+    last_accessed_display.admin_order_field = 'last_accessed'
 
 
 @admin.register(KintoneRequestLog)
-class KintoneRequestLogAdmin(admin.ModelAdmin):
-    """Kintone请求日志管理"""
+class KintoneRequestLogAdmin(PartitionedLogAdmin):
+    """Kintone请求日志管理（按分区浏览）"""
     
+    partitions = request_log_partitions
+    bodies = request_log_bodies
     list_display = ['app', 'action_badge', 'status_badge', 'request_method', 
                    'status_code', 'response_time', 'user', 'created_at']
-    list_filter = ['status', 'action', 'request_method', 'created_at']
-    search_fields = ['request_url', 'error_message', 'app__app_name']
+    list_select_related = ['app', 'user']
+    list_defer = PartitionedLogAdmin.list_defer + ('request_params',)
+    list_filter = ['status', 'action', RequestMethodListFilter, 'app', 'timeout_phase']
     readonly_fields = ['connection', 'app', 'action', 'request_url', 
-                      'request_method', 'request_params', 'request_body',
-                      'status_code', 'response_body', 'response_time',
-                      'status', 'error_message', 'user', 'created_at']
-    
-    date_hierarchy = 'created_at'
+                      'request_method', 'request_params', 'request_body_display',
+                      'status_code', 'response_body_display', 'response_time',
+                      'status', 'error_message', 'timeout_phase', 'request_id', 'attempt', 'user', 'created_at']
     
     fieldsets = (
         ('基本信息', {
-            'fields': ('connection', 'app', 'action', 'status', 'user', 'created_at')
+            'fields': ('connection', 'app', 'action', 'status', 'request_id', 'attempt', 'user', 'created_at')
         }),
         ('请求信息', {
-            'fields': ('request_method', 'request_url', 'request_params', 'request_body')
+            'fields': ('request_method', 'request_url', 'request_params', 'request_body_display')
         }),
         ('响应信息', {
-            'fields': ('status_code', 'response_body', 'response_time')
+            'fields': ('status_code', 'response_body_display', 'response_time')
         }),
         ('错误信息', {
-            'fields': ('error_message',),
+            'fields': ('error_message', 'timeout_phase'),
             'classes': ('collapse',)
         }),
     )
@@ -103,9 +119,11 @@ class KintoneRequestLogAdmin(admin.ModelAdmin):
         colors = {
             'get_records': 'blue',
             'get_record': 'blue',
+            'export_records': 'blue',
             'add_record': 'green',
             'update_record': 'orange',
             'delete_records': 'red',
+            'bulk_request': 'teal',
             'get_app_info': 'purple',
             'get_form_fields': 'purple',
         }
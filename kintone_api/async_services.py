@@ -0,0 +1,170 @@
+"""
+Kintone API异步服务类
+基于httpx的异步Kintone客户端，每个KintoneConnection的并发请求数由信号量限制
+"""
+import asyncio
+import weakref
+from collections import namedtuple
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from automationapi.deadline import DeadlineExceeded, check_deadline, httpx_timeout
+from automationapi.fastjson import response_json
+from automationapi.http import get_async_client
+from .services import KintoneService, collect_batch_results
+
+
+# 应用配置的延迟查询条件，在make_request中于线程里解析，避免在事件循环中访问数据库
+AppLookup = namedtuple('AppLookup', ['app_id'])
+
+# 事件循环 -> {connection_id: Semaphore}
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_connection_semaphore(connection_id):
+    """获取当前事件循环中某个连接的并发信号量"""
+    loop = asyncio.get_running_loop()
+    per_loop = _semaphores.setdefault(loop, {})
+    semaphore = per_loop.get(connection_id)
+    if semaphore is None:
+        semaphore = per_loop[connection_id] = asyncio.Semaphore(
+            getattr(settings, 'KINTONE_ASYNC_CONCURRENCY', 10)
+        )
+    return semaphore
+
+
+class AsyncKintoneService(KintoneService):
+    """
+    Kintone API异步服务类
+    覆盖所有涉及网络和数据库的方法，get_records、add_records 等业务方法
+    会返回 make_request 的协程，因此可以直接 await
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @classmethod
+    async def create(cls, connection_id=None):
+        """
+        创建服务实例
+        :param connection_id: KintoneConnection的ID，如果为None则使用第一个活跃的连接
+        """
+        connection = await sync_to_async(KintoneService.load_connection)(connection_id)
+        return cls(connection)
+
+    def find_app(self, app_id):
+        return AppLookup(app_id)
+
+    async def resolve_app(self, app_obj):
+        """把延迟查询条件解析为KintoneApp对象"""
+        if isinstance(app_obj, AppLookup):
+            return await sync_to_async(KintoneService.find_app)(self, app_obj.app_id)
+        return app_obj
+
+    async def make_request(self, method, endpoint, app_id=None, params=None, data=None,
+                           action='other', app_obj=None, user=None, retry=None, files=None):
+        """
+        异步发送API请求
+        参数与 KintoneService.make_request 相同
+        """
+        url = self.build_url(endpoint, app_id)
+        headers = self.get_headers()
+        if files is not None:
+            headers.pop('Content-Type', None)
+        app_obj = await self.resolve_app(app_obj)
+        retry_state = self.retry_policy.begin(method, retry)
+        guard = self.circuit_guard(app_obj)
+
+        for attempt in retry_state:
+            await self.athrottle()
+
+            async with get_connection_semaphore(self.connection.pk):
+                try:
+                    check_deadline()
+                except DeadlineExceeded as e:
+                    await sync_to_async(self.log_error)(action, method, url, params, data, e, app_obj, user,
+                                                        retry_state.request_id, attempt)
+                    raise
+                # 在信号量内检查，排队等待的时间不计入慢调用
+                guard.enter()
+                start_time = datetime.now()
+
+                try:
+                    response = await get_async_client().request(
+                        method,
+                        url,
+                        headers=headers,
+                        params=params,
+                        json=data,
+                        files=files,
+                        timeout=httpx_timeout(*self.get_timeout(endpoint))
+                    )
+                except Exception as e:
+                    guard.failure()
+                    await sync_to_async(self.log_error)(action, method, url, params, data, e, app_obj, user,
+                                                        retry_state.request_id, attempt)
+                    delay = retry_state.delay_for(error=e)
+                    if delay is None:
+                        raise
+                    response = None
+
+                if response is not None:
+                    response_time = (datetime.now() - start_time).total_seconds()
+                    guard.record(response.status_code)
+
+                    await sync_to_async(self.log_response)(
+                        action, method, url, params, data, response, response_time, app_obj, user,
+                        retry_state.request_id, attempt
+                    )
+                    await self.athrottled(response)
+
+                    delay = retry_state.delay_for(response=response)
+
+            # 退避等待时释放信号量
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+
+            # 响应已由 log_response 记录（状态为failed），不再另记一条错误日志
+            response.raise_for_status()
+            return response_json(response, empty={})
+
+    async def iter_records(self, app_id, query=None, fields=None, size=None, user=None):
+        """
+        通过游标API逐页读取记录的异步生成器
+        参数与 KintoneService.iter_records 相同
+        """
+        app_obj = await self.resolve_app(self.find_app(app_id))
+        cursor_id = (await self.create_cursor(app_id, query, fields, size, app_obj, user))['id']
+        exhausted = False
+
+        try:
+            while not exhausted:
+                page = await self.make_request(
+                    'GET',
+                    'records/cursor.json',
+                    params={'id': cursor_id},
+                    action='export_records',
+                    app_obj=app_obj,
+                    user=user
+                )
+                exhausted = not page.get('next')
+                for record in page.get('records', []):
+                    yield record
+        finally:
+            if not exhausted:
+                try:
+                    await self.delete_cursor(cursor_id, app_obj, user)
+                except Exception:
+                    pass
+
+    async def dispatch(self, calls, merge):
+        """
+        并发执行多个请求，并发数由连接信号量（KINTONE_ASYNC_CONCURRENCY）限制
+        参数与 KintoneService.dispatch 相同
+        """
+        outcomes = await asyncio.gather(*(call() for call in calls), return_exceptions=True)
+        return merge(collect_batch_results(outcomes, merge))
+
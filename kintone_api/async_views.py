@@ -0,0 +1,244 @@
+"""
+Kintone API异步视图
+与 KintoneAPIViewSet 的操作一一对应，通过ASGI运行时单个worker可同时保持大量Kintone请求
+"""
+from automationapi.async_api import async_api_view, api_response, exception_response
+from automationapi.deadline import long_running
+from automationapi.streaming import streaming_export
+
+from .serializers import (
+    KintoneGetRecordsSerializer, KintoneGetRecordSerializer, KintoneExportRecordsSerializer,
+    KintoneAddRecordSerializer, KintoneAddRecordsSerializer,
+    KintoneUpdateRecordSerializer, KintoneUpdateRecordsSerializer,
+    KintoneDeleteRecordsSerializer, KintoneGetAppInfoSerializer,
+    KintoneGetFormFieldsSerializer, KintoneBulkRequestSerializer
+)
+from .async_services import AsyncKintoneService
+from .services import KintoneService, KintoneBulkWriteError, flatten_record
+
+
+async def _execute(request, serializer_class, operation, message, status=200):
+    """
+    校验参数、创建服务并执行操作
+    :param operation: 接收 (service, validated_data) 并返回协程的函数
+    :param message: 成功提示，可以是接收validated_data的函数
+    """
+    serializer = serializer_class(data=request.data)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+
+    data = serializer.validated_data
+
+    try:
+        service = await AsyncKintoneService.create(connection_id=data.get('connection_id'))
+        result = await operation(service, data)
+
+        return api_response({
+            'status': 'success',
+            'message': message(data) if callable(message) else message,
+            'data': result
+        }, status=status)
+
+    except KintoneBulkWriteError as e:
+        # 分批写入部分失败，与同步视图相同：部分提交返回207，全部失败返回409
+        return api_response({
+            'status': 'partial' if e.committed else 'error',
+            'message': str(e),
+            'data': e.to_dict(KintoneService.write_batch_size(data.get('atomic', False)))
+        }, status=207 if e.committed else 409)
+
+    except Exception as e:
+        return exception_response(e)
+
+
+@async_api_view(['POST'])
+async def get_records(request):
+    """获取记录列表"""
+    return await _execute(
+        request, KintoneGetRecordsSerializer,
+        lambda service, data: service.get_records(
+            app_id=data['app_id'],
+            query=data.get('query'),
+            fields=data.get('fields'),
+            total_count=data.get('total_count', False),
+            user=request.user
+        ),
+        '记录获取成功'
+    )
+
+
+@async_api_view(['POST'])
+@long_running
+async def export_records(request):
+    """通过游标API流式导出记录（NDJSON/CSV）"""
+    serializer = KintoneExportRecordsSerializer(data=request.data)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+
+    data = serializer.validated_data
+
+    try:
+        service = await AsyncKintoneService.create(connection_id=data.get('connection_id'))
+        records = service.iter_records(
+            app_id=data['app_id'],
+            query=data.get('query'),
+            fields=data.get('fields'),
+            size=data.get('size'),
+            user=request.user
+        )
+        # 先读取第一页，游标创建失败时仍可返回400
+        try:
+            first = [await records.__anext__()]
+        except StopAsyncIteration:
+            first = []
+
+    except Exception as e:
+        return exception_response(e)
+
+    async def all_records():
+        for record in first:
+            yield record
+        async for record in records:
+            yield record
+
+    return streaming_export(
+        all_records(),
+        export_format=data['format'],
+        filename=f"kintone_app_{data['app_id']}",
+        columns=data.get('fields'),
+        to_row=flatten_record
+    )
+
+
+@async_api_view(['POST'])
+async def get_record(request):
+    """获取单条记录"""
+    return await _execute(
+        request, KintoneGetRecordSerializer,
+        lambda service, data: service.get_record(
+            app_id=data['app_id'],
+            record_id=data['record_id'],
+            user=request.user
+        ),
+        '记录获取成功'
+    )
+
+
+@async_api_view(['POST'])
+async def add_record(request):
+    """添加记录"""
+    return await _execute(
+        request, KintoneAddRecordSerializer,
+        lambda service, data: service.add_record(
+            app_id=data['app_id'],
+            record_data=data['record_data'],
+            user=request.user
+        ),
+        '记录添加成功',
+        status=201
+    )
+
+
+@async_api_view(['POST'])
+@long_running
+async def add_records(request):
+    """批量添加记录"""
+    return await _execute(
+        request, KintoneAddRecordsSerializer,
+        lambda service, data: service.add_records(
+            app_id=data['app_id'],
+            records_data=data['records_data'],
+            atomic=data['atomic'],
+            user=request.user
+        ),
+        lambda data: f'成功添加 {len(data["records_data"])} 条记录',
+        status=201
+    )
+
+
+@async_api_view(['POST'])
+async def update_record(request):
+    """更新记录"""
+    return await _execute(
+        request, KintoneUpdateRecordSerializer,
+        lambda service, data: service.update_record(
+            app_id=data['app_id'],
+            record_id=data['record_id'],
+            record_data=data['record_data'],
+            revision=data.get('revision'),
+            user=request.user
+        ),
+        '记录更新成功'
+    )
+
+
+@async_api_view(['POST'])
+@long_running
+async def update_records(request):
+    """批量更新记录"""
+    return await _execute(
+        request, KintoneUpdateRecordsSerializer,
+        lambda service, data: service.update_records(
+            app_id=data['app_id'],
+            records_data=data['records_data'],
+            atomic=data['atomic'],
+            user=request.user
+        ),
+        lambda data: f'成功更新 {len(data["records_data"])} 条记录'
+    )
+
+
+@async_api_view(['POST'])
+@long_running
+async def delete_records(request):
+    """删除记录"""
+    return await _execute(
+        request, KintoneDeleteRecordsSerializer,
+        lambda service, data: service.delete_records(
+            app_id=data['app_id'],
+            record_ids=data['record_ids'],
+            atomic=data['atomic'],
+            user=request.user
+        ),
+        lambda data: f'成功删除 {len(data["record_ids"])} 条记录'
+    )
+
+
+@async_api_view(['POST'])
+async def get_app_info(request):
+    """获取应用信息"""
+    return await _execute(
+        request, KintoneGetAppInfoSerializer,
+        lambda service, data: service.get_app_info(
+            app_id=data['app_id'],
+            user=request.user
+        ),
+        '应用信息获取成功'
+    )
+
+
+@async_api_view(['POST'])
+async def get_form_fields(request):
+    """获取表单字段"""
+    return await _execute(
+        request, KintoneGetFormFieldsSerializer,
+        lambda service, data: service.get_form_fields(
+            app_id=data['app_id'],
+            user=request.user
+        ),
+        '表单字段获取成功'
+    )
+
+
+@async_api_view(['POST'])
+@long_running
+async def bulk_request(request):
+    """批量事务"""
+    return await _execute(
+        request, KintoneBulkRequestSerializer,
+        lambda service, data: service.bulk_request(
+            requests_data=data['requests'],
+            user=request.user
+        ),
+        lambda data: f'成功执行 {len(data["requests"])} 个操作'
+    )
@@ -0,0 +1,79 @@
+"""
+JSON编解码基准测试
+用模拟的Kintone记录页对比标准库与 automationapi.fastjson（orjson）的解析和渲染耗时
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from automationapi import fastjson
+from automationapi.renderers import FastJSONRenderer
+
+
+def build_records(count):
+    """生成Kintone records.json格式的记录"""
+    return {
+        'records': [
+            {
+                '$id': {'type': '__ID__', 'value': str(i)},
+                '$revision': {'type': '__REVISION__', 'value': '3'},
+                '客户名称': {'type': 'SINGLE_LINE_TEXT', 'value': f'客户{i} 株式会社'},
+                '金额': {'type': 'NUMBER', 'value': str(i * 1234)},
+                '备注': {'type': 'MULTI_LINE_TEXT', 'value': '这是一段较长的备注文本。' * 8},
+                '标签': {'type': 'CHECK_BOX', 'value': ['重要', '跟进', 'VIP']},
+                '更新时间': {'type': 'UPDATED_TIME', 'value': '2024-05-01T09:30:00Z'},
+                '明细': {'type': 'SUBTABLE', 'value': [
+                    {'id': str(i * 10 + n), 'value': {
+                        '商品': {'type': 'SINGLE_LINE_TEXT', 'value': f'商品{n}'},
+                        '数量': {'type': 'NUMBER', 'value': str(n)},
+                    }} for n in range(5)
+                ]},
+            }
+            for i in range(count)
+        ],
+        'totalCount': str(count),
+    }
+
+
+def best_of(func, repeat):
+    """多次执行取最短耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = '对比标准库与orjson在大页Kintone记录上的JSON解析和渲染耗时'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=5000, help='每页记录数')
+        parser.add_argument('--repeat', type=int, default=5, help='每项重复次数（取最短耗时）')
+    
+    def handle(self, *args, **options):
+        data = build_records(options['records'])
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        repeat = options['repeat']
+        
+        self.stdout.write(
+            f"记录数 {options['records']}，响应体 {len(payload) / 1024 / 1024:.1f} MB，"
+            f"orjson {'已安装' if fastjson.orjson is not None else '未安装（使用标准库）'}"
+        )
+        
+        cases = [
+            ('解析上游响应', lambda: json.loads(payload), lambda: fastjson.loads(payload)),
+            ('DRF渲染', lambda: JSONRenderer().render(data), lambda: FastJSONRenderer().render(data)),
+        ]
+        
+        for name, baseline, fast in cases:
+            baseline_time = best_of(baseline, repeat)
+            fast_time = best_of(fast, repeat)
+            self.stdout.write(
+                f"{name}: 标准库 {baseline_time * 1000:.1f} ms，fastjson {fast_time * 1000:.1f} ms，"
+                f"提速 {baseline_time / fast_time:.1f}x"
+            )
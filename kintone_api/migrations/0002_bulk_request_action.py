@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kintone_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kintonerequestlog',
+            name='action',
+            field=models.CharField(choices=[('get_records', '获取记录'), ('get_record', '获取单条记录'), ('add_record', '添加记录'), ('update_record', '更新记录'), ('delete_records', '删除记录'), ('bulk_request', '批量事务'), ('get_app_info', '获取应用信息'), ('get_form_fields', '获取表单字段'), ('upload_file', '上传文件'), ('download_file', '下载文件'), ('other', '其他')], max_length=50, verbose_name='操作类型'),
+        ),
+    ]
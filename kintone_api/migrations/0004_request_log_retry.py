@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kintone_api', '0003_export_records_action'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kintonerequestlog',
+            name='attempt',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='尝试次数'),
+        ),
+        migrations.AddField(
+            model_name='kintonerequestlog',
+            name='request_id',
+            field=models.CharField(blank=True, db_index=True, max_length=32, null=True, verbose_name='调用ID'),
+        ),
+    ]
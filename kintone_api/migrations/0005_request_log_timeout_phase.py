@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kintone_api', '0004_request_log_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kintonerequestlog',
+            name='timeout_phase',
+            field=models.CharField(blank=True, choices=[('connect', '连接'), ('read', '读取'), ('write', '发送'), ('pool', '等待连接池'), ('deadline', '超过截止时间')], max_length=10, null=True, verbose_name='超时阶段'),
+        ),
+    ]
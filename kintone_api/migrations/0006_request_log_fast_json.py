@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:25
+
+import automationapi.fastjson
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kintone_api', '0005_request_log_timeout_phase'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kintonerequestlog',
+            name='request_params',
+            field=models.JSONField(blank=True, encoder=automationapi.fastjson.FastJSONEncoder, null=True, verbose_name='请求参数'),
+        ),
+    ]
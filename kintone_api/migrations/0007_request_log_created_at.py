@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kintone_api', '0006_request_log_fast_json'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kintonerequestlog',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='调用时间'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kintone_api', '0008_request_log_bodies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KintoneRequestRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grain', models.CharField(choices=[('minute', '分钟'), ('hour', '小时')], max_length=6, verbose_name='粒度')),
+                ('bucket', models.DateTimeField(help_text='时间桶的起始时间（UTC）', verbose_name='时间桶')),
+                ('status', models.CharField(max_length=20, verbose_name='状态')),
+                ('count', models.PositiveBigIntegerField(default=0, verbose_name='调用次数')),
+                ('response_time_sum', models.FloatField(default=0, verbose_name='响应时间合计(秒)')),
+                ('response_time_count', models.PositiveBigIntegerField(default=0, verbose_name='有响应时间的调用次数')),
+                ('action', models.CharField(choices=[('get_records', '获取记录'), ('export_records', '导出记录'), ('get_record', '获取单条记录'), ('add_record', '添加记录'), ('update_record', '更新记录'), ('delete_records', '删除记录'), ('bulk_request', '批量事务'), ('get_app_info', '获取应用信息'), ('get_form_fields', '获取表单字段'), ('upload_file', '上传文件'), ('download_file', '下载文件'), ('other', '其他')], max_length=50, verbose_name='操作类型')),
+                ('app', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='request_rollups', to='kintone_api.kintoneapp', verbose_name='应用')),
+                ('connection', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='request_rollups', to='kintone_api.kintoneconnection', verbose_name='连接')),
+            ],
+            options={
+                'verbose_name': 'Kintone请求汇总',
+                'verbose_name_plural': 'Kintone请求汇总',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='kintonerequestrollup',
+            constraint=models.UniqueConstraint(fields=('grain', 'bucket', 'connection', 'app', 'action', 'status'), name='kintonerequestrollup_unique_bucket'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from automationapi.bodystore import BodyStore, LogBody
+from automationapi.counters import BufferedCounter
+from automationapi.fastjson import FastJSONEncoder
+from automationapi.partitions import PartitionedTable
+from automationapi.rollups import RollupTable, UsageRollup
 
 
 class KintoneConnection(models.Model):
@@ -80,6 +85,20 @@ class KintoneApp(models.Model):
     
     def __str__(self):
         return f"{self.app_name} (ID: {self.app_id})"
+    
+    @property
+    def current_total_requests(self):
+        """总请求次数（包含本进程尚未写入数据库的增量）"""
+        return app_request_counter.current(self)[0]
+    
+    @property
+    def current_last_accessed(self):
+        """最后访问时间（包含本进程尚未写入数据库的请求）"""
+        return app_request_counter.current(self)[1]
+
+
+# 应用请求统计的计数器（见 automationapi/counters.py）
+app_request_counter = BufferedCounter(KintoneApp, 'total_requests', 'last_accessed')
 
 
 class KintoneRequestLog(models.Model):
@@ -91,12 +110,22 @@ class KintoneRequestLog(models.Model):
         ('error', '错误'),
     ]
     
+    TIMEOUT_PHASE_CHOICES = [
+        ('connect', '连接'),
+        ('read', '读取'),
+        ('write', '发送'),
+        ('pool', '等待连接池'),
+        ('deadline', '超过截止时间'),
+    ]
+    
     ACTION_CHOICES = [
         ('get_records', '获取记录'),
+        ('export_records', '导出记录'),
         ('get_record', '获取单条记录'),
         ('add_record', '添加记录'),
         ('update_record', '更新记录'),
         ('delete_records', '删除记录'),
+        ('bulk_request', '批量事务'),
         ('get_app_info', '获取应用信息'),
         ('get_form_fields', '获取表单字段'),
         ('upload_file', '上传文件'),
@@ -112,23 +141,36 @@ class KintoneRequestLog(models.Model):
     # 请求信息
     action = models.CharField(max_length=50, choices=ACTION_CHOICES, verbose_name='操作类型')
     request_url = models.TextField(verbose_name='请求URL')
+    request_path = models.CharField(max_length=255, blank=True, default='', db_index=True, verbose_name='请求路径',
+                                    help_text='URL的路径部分，Admin按前缀搜索')
     request_method = models.CharField(max_length=10, verbose_name='请求方法')
-    request_params = models.JSONField(blank=True, null=True, verbose_name='请求参数')
-    request_body = models.TextField(blank=True, null=True, verbose_name='请求体')
+    request_params = models.JSONField(blank=True, null=True, encoder=FastJSONEncoder, verbose_name='请求参数')
+    request_body = models.TextField(blank=True, null=True, verbose_name='请求体', help_text='旧日志，新日志保存在内容存储中')
+    request_body_digest = models.CharField(max_length=64, blank=True, null=True, verbose_name='请求体摘要')
     
     # 响应信息
     status_code = models.IntegerField(blank=True, null=True, verbose_name='状态码')
-    response_body = models.TextField(blank=True, null=True, verbose_name='响应体')
+    response_body = models.TextField(blank=True, null=True, verbose_name='响应体', help_text='旧日志，新日志保存在内容存储中')
+    response_body_digest = models.CharField(max_length=64, blank=True, null=True, verbose_name='响应体摘要')
     response_time = models.FloatField(blank=True, null=True, verbose_name='响应时间(秒)')
     
     # 状态
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name='状态')
     error_message = models.TextField(blank=True, null=True, verbose_name='错误信息')
     
+    # 重试（同一次调用的各次尝试共享request_id）
+    request_id = models.CharField(max_length=32, blank=True, null=True, db_index=True, verbose_name='调用ID')
+    attempt = models.PositiveSmallIntegerField(default=1, verbose_name='尝试次数')
+    
+    # 超时（发生在哪个阶段）
+    timeout_phase = models.CharField(max_length=10, choices=TIMEOUT_PHASE_CHOICES, blank=True, null=True,
+                                     verbose_name='超时阶段')
+    
     # 用户和时间
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, 
                             blank=True, verbose_name='调用用户')
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='调用时间', db_index=True)
+    # 日志可能缓冲后批量写入，调用时间在创建实例时确定
+    created_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='调用时间', db_index=True)
     
     class Meta:
         verbose_name = 'Kintone请求日志'
@@ -145,6 +187,49 @@ class KintoneRequestLog(models.Model):
         return f"{app_name} - {self.get_action_display()} - {self.status} ({self.created_at.strftime('%Y-%m-%d %H:%M:%S')})"
 
 
+# 请求日志按时间分区存储，原表作为默认分区（见 automationapi/partitions.py）
+request_log_partitions = PartitionedTable(KintoneRequestLog)
+
+
+class KintoneLogBody(LogBody):
+    """Kintone请求日志的请求体/响应体（压缩后按摘要去重保存）"""
+    
+    class Meta:
+        verbose_name = 'Kintone日志内容'
+        verbose_name_plural = 'Kintone日志内容'
+
+
+# 日志行只保存摘要，内容压缩去重后保存在 KintoneLogBody（见 automationapi/bodystore.py）
+request_log_bodies = BodyStore(KintoneLogBody, partitions=request_log_partitions)
+
+
+class KintoneRequestRollup(UsageRollup):
+    """Kintone请求日志按分钟/小时、连接、应用、操作类型和状态的汇总"""
+    
+    connection = models.ForeignKey(KintoneConnection, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='request_rollups', verbose_name='连接')
+    app = models.ForeignKey(KintoneApp, on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='request_rollups', verbose_name='应用')
+    action = models.CharField(max_length=50, choices=KintoneRequestLog.ACTION_CHOICES, verbose_name='操作类型')
+    
+    class Meta:
+        verbose_name = 'Kintone请求汇总'
+        verbose_name_plural = 'Kintone请求汇总'
+        # 连接或应用为空的行不受唯一约束限制，并发创建出的重复行在统计时合并
+        constraints = [
+            models.UniqueConstraint(fields=['grain', 'bucket', 'connection', 'app', 'action', 'status'],
+                                    name='kintonerequestrollup_unique_bucket'),
+        ]
+
+
+# 统计接口读取的预聚合汇总，由日志写入器更新（见 automationapi/rollups.py）
+request_rollups = RollupTable(KintoneRequestRollup, request_log_partitions, {
+    'connection_id': 'connection_id',
+    'app_id': 'app_id',
+    'action': 'action',
+})
+
+
 class KintoneFieldMapping(models.Model):
     """Kintone字段映射配置"""
     
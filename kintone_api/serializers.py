@@ -2,7 +2,7 @@
 Kintone API序列化器
 """
 from rest_framework import serializers
-from .models import KintoneConnection, KintoneApp, KintoneRequestLog, KintoneFieldMapping
+from .models import KintoneConnection, KintoneApp, KintoneRequestLog, KintoneFieldMapping, request_log_bodies
 
 
 class KintoneConnectionSerializer(serializers.ModelSerializer):
@@ -38,6 +38,8 @@ class KintoneAppSerializer(serializers.ModelSerializer):
     """Kintone应用序列化器"""
     
     connection_name = serializers.CharField(source='connection.name', read_only=True)
+    total_requests = serializers.IntegerField(source='current_total_requests', read_only=True)
+    last_accessed = serializers.DateTimeField(source='current_last_accessed', read_only=True)
     
     class Meta:
         model = KintoneApp
@@ -46,7 +48,6 @@ class KintoneAppSerializer(serializers.ModelSerializer):
             'description', 'total_requests', 'last_accessed', 'is_active',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['total_requests', 'last_accessed']
 
 
 class KintoneRequestLogSerializer(serializers.ModelSerializer):
@@ -64,7 +65,7 @@ class KintoneRequestLogSerializer(serializers.ModelSerializer):
             'id', 'connection', 'connection_name', 'app', 'app_name',
             'action', 'action_display', 'request_method', 'request_url',
             'status_code', 'response_time', 'status', 'status_display',
-            'error_message', 'user', 'username', 'created_at'
+            'error_message', 'timeout_phase', 'request_id', 'attempt', 'user', 'username', 'created_at'
         ]
 
 
@@ -75,9 +76,34 @@ class KintoneRequestLogDetailSerializer(serializers.ModelSerializer):
     app_name = serializers.CharField(source='app.app_name', read_only=True)
     username = serializers.CharField(source='user.username', read_only=True)
     
+    # 内容按摘要保存在内容存储中，序列化时才取出并解压；旧日志直接保存在日志行中
+    request_body = serializers.SerializerMethodField()
+    response_body = serializers.SerializerMethodField()
+    
     class Meta:
         model = KintoneRequestLog
         fields = '__all__'
+    
+    def get_request_body(self, obj):
+        return request_log_bodies.get(obj.request_body_digest) if obj.request_body_digest else obj.request_body
+    
+    def get_response_body(self, obj):
+        return request_log_bodies.get(obj.response_body_digest) if obj.response_body_digest else obj.response_body
+
+
+class KintoneRequestLogExportSerializer(serializers.Serializer):
+    """流式导出Kintone请求日志（过滤参数与日志列表相同）"""
+    
+    FORMAT_CHOICES = [
+        ('ndjson', 'NDJSON'),
+        ('csv', 'CSV'),
+        ('columnar', '列式NDJSON'),
+    ]
+    
+    # 查询参数 format 被DRF用于选择渲染器，因此使用 export_format
+    export_format = serializers.ChoiceField(choices=FORMAT_CHOICES, default='ndjson', help_text='导出格式')
+    chunk_size = serializers.IntegerField(default=2000, min_value=100, max_value=10000,
+                                          help_text='每次从数据库读取的行数，列式格式每行的记录数')
 
 
 class KintoneFieldMappingSerializer(serializers.ModelSerializer):
@@ -107,6 +133,26 @@ class KintoneGetRecordsSerializer(serializers.Serializer):
     total_count = serializers.BooleanField(default=False, help_text='是否获取总数')
 
 
+class KintoneExportRecordsSerializer(serializers.Serializer):
+    """流式导出记录"""
+    
+    FORMAT_CHOICES = [
+        ('ndjson', 'NDJSON'),
+        ('csv', 'CSV'),
+    ]
+    
+    connection_id = serializers.IntegerField(required=False, help_text='连接ID')
+    app_id = serializers.CharField(help_text='应用ID')
+    query = serializers.CharField(required=False, allow_blank=True, help_text='查询条件（不能包含limit和offset）')
+    fields = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        help_text='要获取的字段列表，CSV按此顺序输出列'
+    )
+    format = serializers.ChoiceField(choices=FORMAT_CHOICES, default='ndjson', help_text='导出格式')
+    size = serializers.IntegerField(required=False, min_value=1, max_value=500, help_text='每页记录数')
+
+
 class KintoneGetRecordSerializer(serializers.Serializer):
     """获取单条记录"""
     
@@ -132,6 +178,10 @@ class KintoneAddRecordsSerializer(serializers.Serializer):
         child=serializers.JSONField(),
         help_text='记录数据列表'
     )
+    atomic = serializers.BooleanField(
+        default=False,
+        help_text='是否通过bulkRequest提交（每2000条为一个事务）'
+    )
 
 
 class KintoneUpdateRecordSerializer(serializers.Serializer):
@@ -153,6 +203,10 @@ class KintoneUpdateRecordsSerializer(serializers.Serializer):
         child=serializers.JSONField(),
         help_text='记录数据列表，每个包含id和record'
     )
+    atomic = serializers.BooleanField(
+        default=False,
+        help_text='是否通过bulkRequest提交（每2000条为一个事务）'
+    )
 
 
 class KintoneDeleteRecordsSerializer(serializers.Serializer):
@@ -164,6 +218,10 @@ class KintoneDeleteRecordsSerializer(serializers.Serializer):
         child=serializers.CharField(),
         help_text='记录ID列表'
     )
+    atomic = serializers.BooleanField(
+        default=False,
+        help_text='是否通过bulkRequest提交（每2000条为一个事务）'
+    )
 
 
 class KintoneGetAppInfoSerializer(serializers.Serializer):
@@ -179,3 +237,29 @@ class KintoneGetFormFieldsSerializer(serializers.Serializer):
     connection_id = serializers.IntegerField(required=False, help_text='连接ID')
     app_id = serializers.CharField(help_text='应用ID')
 
+
+
+class KintoneBulkOperationSerializer(serializers.Serializer):
+    """bulkRequest中的单个操作"""
+    
+    METHOD_CHOICES = [
+        ('POST', '添加'),
+        ('PUT', '更新'),
+        ('DELETE', '删除'),
+    ]
+    
+    method = serializers.ChoiceField(choices=METHOD_CHOICES)
+    api = serializers.CharField(help_text='API端点，例如 records.json、record.json')
+    payload = serializers.JSONField(help_text='操作参数，需包含app')
+
+
+class KintoneBulkRequestSerializer(serializers.Serializer):
+    """批量事务（bulkRequest）"""
+    
+    connection_id = serializers.IntegerField(required=False, help_text='连接ID')
+    requests = serializers.ListField(
+        child=KintoneBulkOperationSerializer(),
+        min_length=1,
+        max_length=20,
+        help_text='操作列表（最多20个，可跨应用）'
+    )
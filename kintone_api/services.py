@@ -2,28 +2,188 @@
 Kintone API服务类
 处理与Kintone API的交互
 """
-import requests
 import base64
+import contextvars
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from django.utils import timezone
-from .models import KintoneConnection, KintoneApp, KintoneRequestLog
+from functools import partial
+from django.conf import settings
+from django.db import connection as db_connection
+from automationapi.circuit import CircuitGuard, circuit_breakers
+from automationapi.deadline import DeadlineExceeded, check_deadline, request_timeout, timeout_phase
+from automationapi.fastjson import response_json
+from automationapi.http import SessionPool, url_path
+from automationapi.logbuffer import BufferedLogWriter
+from automationapi.ratelimit import RateLimitedMixin
+from automationapi.retry import RetryPolicy
+from .models import (
+    KintoneConnection, KintoneApp, KintoneRequestLog, app_request_counter, request_log_bodies, request_log_partitions,
+    request_rollups,
+)
 
 
-class KintoneService:
+# 按KintoneConnection区分的连接池，连接配置修改或停用时由signals清理
+kintone_session_pool = SessionPool('kintone')
+
+# 请求日志的缓冲写入器（见 automationapi/logbuffer.py），写入后累加到汇总表
+request_log_writer = BufferedLogWriter(
+    KintoneRequestLog, storage=request_log_partitions, after_write=[request_rollups.add]
+)
+
+
+class KintoneBulkWriteError(Exception):
+    """分批写入时部分批次失败，成功的批次已经提交"""
+
+    def __init__(self, errors, results, merged=None):
+        """
+        :param errors: [(批次序号, 异常)]，序号从0开始
+        :param results: 按批次顺序排列的结果，失败批次为None
+        :param merged: 成功批次按顺序合并后的结果（ids、revisions等），调用方据此得知哪些记录已经提交
+        """
+        self.errors = errors
+        self.results = results
+        self.merged = merged
+        failed = '、'.join(str(index + 1) for index, _ in errors)
+        super().__init__(
+            f"共{len(results)}批中第{failed}批写入失败（成功{len(results) - len(errors)}批）: {errors[0][1]}"
+        )
+
+    @property
+    def committed(self):
+        """已经提交的批次数"""
+        return len(self.results) - len(self.errors)
+
+    def to_dict(self, batch_size):
+        """
+        返回给客户端的部分结果
+        :param batch_size: 每批的记录数，用于换算失败批次对应的输入下标范围 [start, stop)
+        """
+        return {
+            'results': self.merged,
+            'errors': [
+                {'batch': index, 'start': index * batch_size, 'stop': (index + 1) * batch_size, 'message': str(error)}
+                for index, error in self.errors
+            ],
+        }
+
+
+def collect_batch_results(outcomes, merge=None):
+    """
+    检查各批次的执行结果
+    :param outcomes: 按批次顺序排列的结果或异常
+    :param merge: 合并结果的函数，存在失败批次时用于合并已成功批次的结果
+    :return: 结果列表，存在失败批次时抛出 KintoneBulkWriteError
+    """
+    errors = [(index, outcome) for index, outcome in enumerate(outcomes) if isinstance(outcome, Exception)]
+    if errors:
+        results = [None if isinstance(outcome, Exception) else outcome for outcome in outcomes]
+        merged = merge([result for result in results if result is not None]) if merge else None
+        raise KintoneBulkWriteError(errors, results, merged)
+    return list(outcomes)
+
+
+def merge_record_results(results):
+    """按顺序合并各批次的响应，列表字段（ids、revisions、records）依次拼接"""
+    merged = {}
+    for result in results:
+        for key, value in (result or {}).items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            else:
+                merged.setdefault(key, value)
+    return merged
+
+
+def flatten_record(record):
+    """把Kintone记录 {字段代码: {'type': ..., 'value': ...}} 转换为 {字段代码: 值}"""
+    return {
+        code: field.get('value') if isinstance(field, dict) else field
+        for code, field in record.items()
+    }
+
+
+class KintoneService(RateLimitedMixin):
     """Kintone API服务基础类"""
     
+    session_pool = kintone_session_pool
+    
+    # 429/503/504及网络错误的重试策略
+    retry_policy = RetryPolicy()
+    
+    # 按域名限流（所有worker共享）
+    RATE_LIMIT_PREFIX = 'kintone'
+    RATE_LIMIT_SETTINGS = ('KINTONE_RATE_LIMIT', 'KINTONE_RATE_BURST')
+    
+    # bulkRequest.json 单次最多包含的操作数
+    BULK_REQUEST_LIMIT = 20
+    
+    # records.json 单次最多写入的记录数
+    RECORDS_LIMIT = 100
+    
+    # 游标API每页读取的记录数（最多500）
+    CURSOR_PAGE_SIZE = 500
+    
     def __init__(self, connection_id=None):
         """
         初始化服务
         :param connection_id: KintoneConnection的ID，如果为None则使用第一个活跃的连接
         """
+        self.connection = self.load_connection(connection_id)
+    
+    @staticmethod
+    def load_connection(connection_id=None):
+        """加载KintoneConnection，如果connection_id为None则使用第一个活跃的连接"""
         if connection_id:
-            self.connection = KintoneConnection.objects.get(id=connection_id, is_active=True)
+            connection = KintoneConnection.objects.get(id=connection_id, is_active=True)
         else:
-            self.connection = KintoneConnection.objects.filter(is_active=True).first()
+            connection = KintoneConnection.objects.filter(is_active=True).first()
         
-        if not self.connection:
+        if not connection:
             raise ValueError("没有可用的Kintone连接")
+        return connection
+    
+    def find_app(self, app_id):
+        """查找当前连接下的应用配置（用于日志和统计）"""
+        return KintoneApp.objects.filter(
+            connection=self.connection, 
+            app_id=app_id
+        ).first()
+    
+    def rate_limit_scope(self):
+        """Kintone按域名限流"""
+        return self.connection.subdomain
+    
+    def circuit_guard(self, app_obj=None):
+        """
+        按连接和应用熔断：整个域名不可用时连接级熔断，单个应用持续失败时只熔断该应用
+        :param app_obj: KintoneApp对象
+        """
+        keys = [f"kintone:connection:{self.connection.pk}"]
+        if app_obj is not None:
+            keys.append(f"kintone:app:{app_obj.pk}")
+        return CircuitGuard([circuit_breakers.get(key) for key in keys])
+    
+    def get_timeout(self, endpoint):
+        """
+        出站请求的 (连接超时, 读取超时)，KINTONE_ENDPOINT_READ_TIMEOUTS 中的端点配置优先，
+        且不超过当前请求的剩余时间
+        :param endpoint: API端点，例如 'records.json'
+        """
+        read = getattr(settings, 'KINTONE_ENDPOINT_READ_TIMEOUTS', {}).get(
+            endpoint, getattr(settings, 'KINTONE_READ_TIMEOUT', 30)
+        )
+        return request_timeout(getattr(settings, 'KINTONE_CONNECT_TIMEOUT', 5), read)
+    
+    def get_log_body_max_size(self, url):
+        """
+        请求日志中请求体/响应体最多保存的字节数，KINTONE_LOG_BODY_MAX_SIZES 中的端点配置优先
+        :param url: 请求URL，端点取 /v1/ 之后的路径
+        :return: 字节数，None表示使用 LOG_BODY_MAX_SIZE
+        """
+        endpoint = url.split('?', 1)[0].partition('/v1/')[2]
+        return getattr(settings, 'KINTONE_LOG_BODY_MAX_SIZES', {}).get(endpoint)
     
     def get_headers(self):
         """获取请求头"""
@@ -42,6 +202,16 @@ class KintoneService:
         
         return headers
     
+    def get_session(self):
+        """
+        获取当前连接的复用Session
+        连接池键包含连接ID、基础URL和认证信息指纹，认证信息变更后自动使用新Session
+        """
+        auth_headers = {k: v for k, v in self.get_headers().items() if k != 'Content-Type'}
+        fingerprint = hashlib.sha256(repr(sorted(auth_headers.items())).encode()).hexdigest()[:12]
+        key = (self.connection.pk, self.connection.base_url, fingerprint)
+        return self.session_pool.get(key, headers=auth_headers)
+    
     def build_url(self, endpoint, app_id=None, guest_space_id=None):
         """
         构建API URL
@@ -49,19 +219,22 @@ class KintoneService:
         :param app_id: 应用ID
         :param guest_space_id: 来宾空间ID（可选）
         """
-        base_url = self.connection.base_url
-        
+        return f"{self.connection.base_url}{self.build_path(endpoint, guest_space_id)}"
+    
+    def build_path(self, endpoint, guest_space_id=None):
+        """
+        构建API路径（不含域名），bulkRequest中的子请求使用此路径
+        :param endpoint: API端点，例如 'records.json'
+        :param guest_space_id: 来宾空间ID（可选）
+        """
         # 使用来宾空间
         if guest_space_id or (self.connection.use_guest_space and self.connection.guest_space_id):
             space_id = guest_space_id or self.connection.guest_space_id
-            url = f"{base_url}/k/guest/{space_id}/v1/{endpoint}"
-        else:
-            url = f"{base_url}/k/v1/{endpoint}"
-        
-        return url
+            return f"/k/guest/{space_id}/v1/{endpoint}"
+        return f"/k/v1/{endpoint}"
     
     def make_request(self, method, endpoint, app_id=None, params=None, data=None, 
-                    action='other', app_obj=None, user=None):
+                    action='other', app_obj=None, user=None, retry=None, files=None):
         """
         发送API请求
         :param method: HTTP方法
@@ -72,68 +245,123 @@ class KintoneService:
         :param action: 操作类型（用于日志）
         :param app_obj: KintoneApp对象
         :param user: 调用用户
+        :param retry: 是否重试，None时只重试幂等请求（见 retry_policy）
+        :param files: multipart上传的文件 {字段名: (文件名, 内容)}，不记录到日志
         :return: 响应数据
+        :raises CircuitOpenError: 连接或应用已熔断，请求没有发出
+        :raises DeadlineExceeded: 当前请求的时间预算已用完，请求没有发出
         """
         url = self.build_url(endpoint, app_id)
         headers = self.get_headers()
+        if files is not None:
+            # multipart/form-data 的Content-Type由requests生成
+            headers.pop('Content-Type', None)
+        retry_state = self.retry_policy.begin(method, retry)
+        guard = self.circuit_guard(app_obj)
         
-        start_time = datetime.now()
-        
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                params=params,
-                json=data
-            )
+        for attempt in retry_state:
+            self.throttle()
+            try:
+                check_deadline()
+            except DeadlineExceeded as e:
+                self.log_error(action, method, url, params, data, e, app_obj, user,
+                               retry_state.request_id, attempt)
+                raise
+            guard.enter()
+            
+            start_time = datetime.now()
+            
+            try:
+                response = self.get_session().request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    params=params,
+                    json=data,
+                    files=files,
+                    timeout=self.get_timeout(endpoint)
+                )
+            except Exception as e:
+                guard.failure()
+                # 记录错误日志
+                self.log_error(action, method, url, params, data, e, app_obj, user,
+                               retry_state.request_id, attempt)
+                delay = retry_state.delay_for(error=e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
             
             end_time = datetime.now()
             response_time = (end_time - start_time).total_seconds()
+            guard.record(response.status_code)
             
             # 记录日志
-            status = 'success' if response.status_code < 400 else 'failed'
+            self.log_response(action, method, url, params, data, response, response_time, app_obj, user,
+                              retry_state.request_id, attempt)
+            self.throttled(response)
             
-            KintoneRequestLog.objects.create(
-                connection=self.connection,
-                app=app_obj,
-                action=action,
-                request_url=url,
-                request_method=method,
-                request_params=params,
-                request_body=str(data) if data else None,
-                status_code=response.status_code,
-                response_body=response.text[:5000],  # 限制长度
-                response_time=response_time,
-                status=status,
-                error_message=response.text if status == 'failed' else None,
-                user=user
-            )
-            
-            # 更新应用统计
-            if app_obj:
-                app_obj.total_requests += 1
-                app_obj.last_accessed = timezone.now()
-                app_obj.save()
+            delay = retry_state.delay_for(response=response)
+            if delay is not None:
+                time.sleep(delay)
+                continue
             
+            # 响应已由 log_response 记录（状态为failed），不再另记一条错误日志
             response.raise_for_status()
-            return response.json() if response.content else {}
-            
-        except Exception as e:
-            # 记录错误日志
-            KintoneRequestLog.objects.create(
-                connection=self.connection,
-                app=app_obj,
-                action=action,
-                request_url=url,
-                request_method=method,
-                request_params=params,
-                request_body=str(data) if data else None,
-                status='error',
-                error_message=str(e),
-                user=user
-            )
-            raise
+            return response_json(response, empty={})
+    
+    def log_response(self, action, method, url, params, data, response, response_time, app_obj=None, user=None,
+                     request_id=None, attempt=1):
+        """
+        记录收到响应的请求日志并更新应用统计
+        :param request_id: 同一次调用各次尝试共享的关联ID
+        :param attempt: 第几次尝试
+        """
+        status = 'success' if response.status_code < 400 else 'failed'
+        max_size = self.get_log_body_max_size(url)
+        
+        request_log_writer.write(KintoneRequestLog(
+            connection=self.connection,
+            app=app_obj,
+            action=action,
+            request_url=url,
+            request_path=url_path(url),
+            request_method=method,
+            request_params=params,
+            request_body_digest=request_log_bodies.put(data, max_size),
+            status_code=response.status_code,
+            response_body_digest=request_log_bodies.put(response.text, max_size),
+            response_time=response_time,
+            status=status,
+            error_message=response.text[:1000] if status == 'failed' else None,  # 完整内容见响应体
+            request_id=request_id,
+            attempt=attempt,
+            user=user
+        ))
+        
+        # 更新应用统计（内存中累加，定期原子写入）
+        if app_obj:
+            app_request_counter.incr(app_obj.pk)
+    
+    def log_error(self, action, method, url, params, data, error, app_obj=None, user=None,
+                  request_id=None, attempt=1):
+        """记录请求异常日志"""
+        request_log_writer.write(KintoneRequestLog(
+            connection=self.connection,
+            app=app_obj,
+            action=action,
+            request_url=url,
+            request_path=url_path(url),
+            request_method=method,
+            request_params=params,
+            request_body_digest=request_log_bodies.put(data, self.get_log_body_max_size(url)),
+            status='error',
+            error_message=str(error),
+            request_id=request_id,
+            attempt=attempt,
+            timeout_phase=timeout_phase(error),
+            user=user
+        ))
     
     def get_records(self, app_id, query=None, fields=None, total_count=False, user=None):
         """
@@ -153,10 +381,7 @@ class KintoneService:
         if total_count:
             params['totalCount'] = 'true'
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
+        app_obj = self.find_app(app_id)
         
         return self.make_request(
             'GET', 
@@ -168,6 +393,80 @@ class KintoneService:
             user=user
         )
     
+    def create_cursor(self, app_id, query=None, fields=None, size=None, app_obj=None, user=None):
+        """
+        创建记录游标
+        :param app_id: 应用ID
+        :param query: 查询条件（Kintone查询语法，不能包含limit和offset）
+        :param fields: 要获取的字段列表
+        :param size: 每页记录数（最多500）
+        :return: 包含游标id和totalCount的响应
+        """
+        data = {
+            'app': app_id,
+            'size': size or self.CURSOR_PAGE_SIZE
+        }
+        
+        if query:
+            data['query'] = query
+        if fields:
+            data['fields'] = fields
+        
+        return self.make_request(
+            'POST',
+            'records/cursor.json',
+            app_id=app_id,
+            data=data,
+            action='export_records',
+            app_obj=app_obj,
+            user=user
+        )
+    
+    def delete_cursor(self, cursor_id, app_obj=None, user=None):
+        """删除记录游标（未读取完时释放服务端资源）"""
+        return self.make_request(
+            'DELETE',
+            'records/cursor.json',
+            data={'id': cursor_id},
+            action='export_records',
+            app_obj=app_obj,
+            user=user
+        )
+    
+    def iter_records(self, app_id, query=None, fields=None, size=None, user=None):
+        """
+        通过游标API逐页读取记录的生成器，不受offset最多10000条的限制，内存中只保留一页
+        提前结束迭代（break、异常、生成器被关闭）时自动删除游标
+        :param app_id: 应用ID
+        :param query: 查询条件（Kintone查询语法，不能包含limit和offset）
+        :param fields: 要获取的字段列表
+        :param size: 每页记录数（最多500）
+        :param user: 调用用户
+        """
+        app_obj = self.find_app(app_id)
+        cursor_id = self.create_cursor(app_id, query, fields, size, app_obj, user)['id']
+        exhausted = False
+        
+        try:
+            while not exhausted:
+                page = self.make_request(
+                    'GET',
+                    'records/cursor.json',
+                    params={'id': cursor_id},
+                    action='export_records',
+                    app_obj=app_obj,
+                    user=user
+                )
+                # 最后一页读取后Kintone会自动删除游标
+                exhausted = not page.get('next')
+                yield from page.get('records', [])
+        finally:
+            if not exhausted:
+                try:
+                    self.delete_cursor(cursor_id, app_obj, user)
+                except Exception:
+                    pass
+    
     def get_record(self, app_id, record_id, user=None):
         """
         获取单条记录
@@ -180,10 +479,7 @@ class KintoneService:
             'id': record_id
         }
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
+        app_obj = self.find_app(app_id)
         
         return self.make_request(
             'GET',
@@ -207,10 +503,7 @@ class KintoneService:
             'record': record_data
         }
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
+        app_obj = self.find_app(app_id)
         
         return self.make_request(
             'POST',
@@ -222,32 +515,16 @@ class KintoneService:
             user=user
         )
     
-    def add_records(self, app_id, records_data, user=None):
+    def add_records(self, app_id, records_data, user=None, atomic=False):
         """
         批量添加记录
+        超过100条时自动分批并发提交，返回的ids和revisions与输入顺序一致
         :param app_id: 应用ID
         :param records_data: 记录数据列表
         :param user: 调用用户
+        :param atomic: 是否通过bulkRequest提交，每2000条为一个事务
         """
-        data = {
-            'app': app_id,
-            'records': records_data
-        }
-        
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
-        
-        return self.make_request(
-            'POST',
-            'records.json',
-            app_id=app_id,
-            data=data,
-            action='add_record',
-            app_obj=app_obj,
-            user=user
-        )
+        return self.write_records('POST', app_id, 'records', records_data, 'add_record', user, atomic)
     
     def update_record(self, app_id, record_id, record_data, revision=None, user=None):
         """
@@ -267,10 +544,7 @@ class KintoneService:
         if revision:
             data['revision'] = revision
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
+        app_obj = self.find_app(app_id)
         
         return self.make_request(
             'PUT',
@@ -282,57 +556,134 @@ class KintoneService:
             user=user
         )
     
-    def update_records(self, app_id, records_data, user=None):
+    def update_records(self, app_id, records_data, user=None, atomic=False):
         """
         批量更新记录
+        超过100条时自动分批并发提交，返回的records与输入顺序一致
         :param app_id: 应用ID
         :param records_data: 记录数据列表，每个包含id和record
         :param user: 调用用户
+        :param atomic: 是否通过bulkRequest提交，每2000条为一个事务
         """
-        data = {
-            'app': app_id,
-            'records': records_data
-        }
-        
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
-        
-        return self.make_request(
-            'PUT',
-            'records.json',
-            app_id=app_id,
-            data=data,
-            action='update_record',
-            app_obj=app_obj,
-            user=user
-        )
+        return self.write_records('PUT', app_id, 'records', records_data, 'update_record', user, atomic)
     
-    def delete_records(self, app_id, record_ids, user=None):
+    def delete_records(self, app_id, record_ids, user=None, atomic=False):
         """
         删除记录
+        超过100条时自动分批并发提交
         :param app_id: 应用ID
         :param record_ids: 记录ID列表
         :param user: 调用用户
+        :param atomic: 是否通过bulkRequest提交，每2000条为一个事务
         """
+        return self.write_records('DELETE', app_id, 'ids', record_ids, 'delete_records', user, atomic)
+    
+    def write_records(self, method, app_id, key, items, action, user=None, atomic=False):
+        """
+        分批写入记录，每批最多RECORDS_LIMIT条
+        非事务模式下各批独立提交，部分失败时抛出 KintoneBulkWriteError；
+        事务模式下每BULK_REQUEST_LIMIT批合并为一个bulkRequest，组内全部成功或全部回滚
+        :param method: HTTP方法（POST/PUT/DELETE）
+        :param app_id: 应用ID
+        :param key: 请求体中列表字段名（records 或 ids）
+        :param items: 记录数据或记录ID列表
+        :param action: 操作类型（用于日志）
+        :param user: 调用用户
+        :param atomic: 是否通过bulkRequest提交
+        :return: 按输入顺序合并后的结果
+        """
+        pages = [items[i:i + self.RECORDS_LIMIT] for i in range(0, len(items), self.RECORDS_LIMIT)] or [items]
+        
+        if atomic:
+            calls = [
+                partial(self.bulk_request, [
+                    {'method': method, 'api': 'records.json', 'payload': {'app': app_id, key: page}}
+                    for page in pages[i:i + self.BULK_REQUEST_LIMIT]
+                ], user=user)
+                for i in range(0, len(pages), self.BULK_REQUEST_LIMIT)
+            ]
+            
+            def merge(results):
+                return merge_record_results(r for result in results for r in result.get('results', []))
+        else:
+            app_obj = self.find_app(app_id)
+            calls = [
+                partial(self.make_request, method, 'records.json', app_id=app_id,
+                        data={'app': app_id, key: page}, action=action, app_obj=app_obj, user=user)
+                for page in pages
+            ]
+            merge = merge_record_results
+        
+        return self.dispatch(calls, merge)
+    
+    @classmethod
+    def write_batch_size(cls, atomic=False):
+        """write_records 每批（事务模式下为每个bulkRequest）包含的记录数"""
+        return cls.RECORDS_LIMIT * cls.BULK_REQUEST_LIMIT if atomic else cls.RECORDS_LIMIT
+    
+    def dispatch(self, calls, merge):
+        """
+        并发执行多个请求，并发数由 KINTONE_BULK_PARALLELISM 控制
+        :param calls: 无参数的请求函数列表
+        :param merge: 接收按调用顺序排列的结果列表并返回最终结果的函数
+        """
+        parallelism = min(getattr(settings, 'KINTONE_BULK_PARALLELISM', 4), len(calls))
+        
+        if parallelism <= 1:
+            outcomes = [self._call(call) for call in calls]
+        else:
+            # 每个任务复制当前上下文，使工作线程沿用入站请求的截止时间
+            with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='kintone-bulk') as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._call_in_worker, call)
+                    for call in calls
+                ]
+                outcomes = [future.result() for future in futures]
+        
+        return merge(collect_batch_results(outcomes, merge))
+    
+    @staticmethod
+    def _call(call):
+        """执行请求，失败时返回异常而不是抛出，以便其他批次继续执行"""
+        try:
+            return call()
+        except Exception as e:
+            return e
+    
+    @classmethod
+    def _call_in_worker(cls, call):
+        """在线程池中执行请求，结束后关闭该线程的数据库连接"""
+        try:
+            return cls._call(call)
+        finally:
+            db_connection.close()
+    
+    def bulk_request(self, requests_data, user=None):
+        """
+        在一次bulkRequest.json调用中执行多个添加/更新/删除操作（可跨应用）
+        所有操作在Kintone端作为一个事务执行，任一失败则全部回滚
+        :param requests_data: 操作列表，每项包含 method、api（例如 'records.json'）和 payload
+        :param user: 调用用户
+        """
+        if len(requests_data) > self.BULK_REQUEST_LIMIT:
+            raise ValueError(f"bulkRequest最多包含{self.BULK_REQUEST_LIMIT}个操作")
+        
         data = {
-            'app': app_id,
-            'ids': record_ids
+            'requests': [
+                {
+                    'method': item['method'],
+                    'api': item['api'] if item['api'].startswith('/k/') else self.build_path(item['api']),
+                    'payload': item['payload'],
+                }
+                for item in requests_data
+            ]
         }
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
-        
         return self.make_request(
-            'DELETE',
-            'records.json',
-            app_id=app_id,
+            'POST',
+            'bulkRequest.json',
             data=data,
-            action='delete_records',
-            app_obj=app_obj,
+            action='bulk_request',
             user=user
         )
     
@@ -344,10 +695,7 @@ class KintoneService:
         """
         params = {'id': app_id}
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
+        app_obj = self.find_app(app_id)
         
         return self.make_request(
             'GET',
@@ -367,10 +715,7 @@ class KintoneService:
         """
         params = {'app': app_id}
         
-        app_obj = KintoneApp.objects.filter(
-            connection=self.connection, 
-            app_id=app_id
-        ).first()
+        app_obj = self.find_app(app_id)
         
         return self.make_request(
             'GET',
@@ -389,51 +734,12 @@ class KintoneService:
         :param file_name: 文件名
         :param user: 调用用户
         """
-        url = self.build_url('file.json')
-        headers = self.get_headers()
-        # 文件上传需要multipart/form-data
-        headers.pop('Content-Type', None)
-        
-        files = {'file': (file_name, file_data)}
-        
-        start_time = datetime.now()
-        
-        try:
-            response = requests.post(
-                url,
-                headers=headers,
-                files=files
-            )
-            
-            end_time = datetime.now()
-            response_time = (end_time - start_time).total_seconds()
-            
-            status = 'success' if response.status_code < 400 else 'failed'
-            
-            KintoneRequestLog.objects.create(
-                connection=self.connection,
-                action='upload_file',
-                request_url=url,
-                request_method='POST',
-                status_code=response.status_code,
-                response_body=response.text[:5000],
-                response_time=response_time,
-                status=status,
-                user=user
-            )
-            
-            response.raise_for_status()
-            return response.json()
-            
-        except Exception as e:
-            KintoneRequestLog.objects.create(
-                connection=self.connection,
-                action='upload_file',
-                request_url=url,
-                request_method='POST',
-                status='error',
-                error_message=str(e),
-                user=user
-            )
-            raise
-
+        # 上传只返回临时的fileKey，重试不会产生重复数据
+        return self.make_request(
+            'POST',
+            'file.json',
+            files={'file': (file_name, file_data)},
+            action='upload_file',
+            user=user,
+            retry=True
+        )
@@ -0,0 +1,15 @@
+"""
+Kintone模型信号处理
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import KintoneConnection
+from .services import kintone_session_pool
+
+
+@receiver(post_save, sender=KintoneConnection)
+@receiver(post_delete, sender=KintoneConnection)
+def discard_connection_sessions(sender, instance, **kwargs):
+    """连接配置修改、停用或删除后，关闭该连接下的所有复用Session"""
+    kintone_session_pool.discard_where(lambda key: key[0] == instance.pk)
@@ -1,3 +1,710 @@
-from django.test import TestCase
+"""
+单元测试
+"""
+import asyncio
+import json
+import random
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from automationapi.circuit import CircuitOpenError, circuit_breakers
+from automationapi.deadline import Deadline, current_deadline, get_deadline
+from automationapi.ratelimit import RateLimitExceeded
+from automationapi.testing import create_app, create_connection, create_user, fake_response
+
+from .models import KintoneRequestLog, KintoneRequestRollup, request_log_bodies, request_log_partitions
+from .services import KintoneService, KintoneBulkWriteError, kintone_session_pool
+from .async_services import AsyncKintoneService
+
+
+class KintoneServiceTest(TestCase):
+    """Kintone服务层测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection()
+        self.app = create_app(self.connection)
+        kintone_session_pool.close_all()
+    
+    def test_requests_reuse_pooled_session(self):
+        """测试同一连接的请求复用Session"""
+        service = KintoneService(connection_id=self.connection.id)
+        hits = kintone_session_pool.stats()['hits']
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={'records': []})):
+            service.get_records('1', user=self.user)
+            service.get_records('1', user=self.user)
+        
+        stats = kintone_session_pool.stats()
+        self.assertEqual(stats['sessions'], 1)
+        self.assertEqual(stats['hits'] - hits, 1)
+        self.assertEqual(request_log_partitions.query().filter(action='get_records').count(), 2)
+    
+    @override_settings(KINTONE_LOG_BODY_MAX_SIZES={'records.json': 0})
+    def test_log_bodies_per_endpoint_cap(self):
+        """测试请求日志的请求体/响应体按摘要保存，KINTONE_LOG_BODY_MAX_SIZES 可按端点关闭"""
+        service = KintoneService(connection_id=self.connection.id)
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={'id': '1'})):
+            service.add_record('1', {'title': {'value': '标题'}}, user=self.user)
+            service.get_records('1', user=self.user)
+        
+        added = request_log_partitions.query().filter(action='add_record').union()[0]
+        self.assertEqual(json.loads(request_log_bodies.get(added.request_body_digest)),
+                         {'app': '1', 'record': {'title': {'value': '标题'}}})
+        self.assertEqual(request_log_bodies.get(added.response_body_digest), str({'id': '1'}))
+        listed = request_log_partitions.query().filter(action='get_records').union()[0]
+        self.assertIsNone(listed.response_body_digest)
+    
+    def test_statistics_from_rollups(self):
+        """测试请求统计和响应时间分位数读取写入日志时累加的汇总"""
+        service = KintoneService(connection_id=self.connection.id)
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={'records': []})):
+            service.get_records('1', user=self.user)
+            service.get_records('1', user=self.user)
+        
+        self.assertEqual(KintoneRequestRollup.objects.get(grain='hour').count, 2)
+        self.client.force_login(self.user)
+        response = self.client.get('/api/kintone/logs/statistics/', {'days': 1})
+        self.assertEqual(response.data['total_requests'], 2)
+        self.assertEqual(response.data['by_action'], [{'action': 'get_records', 'count': 2}])
+        self.assertEqual(response.data['by_app'], [{'app__app_name': '测试应用', 'count': 2}])
+        
+        response = self.client.get('/api/kintone/apps/latency/', {'days': 1})
+        self.assertEqual([(row['app__app_name'], row['action'], row['count']) for row in response.data],
+                         [('测试应用', 'get_records', 2)])
+        self.assertLessEqual(response.data[0]['p50'], response.data[0]['max'])
+        response = self.client.get(f'/api/kintone/apps/{self.app.pk}/latency/', {'action': 'get_records'})
+        self.assertEqual(response.data['by_action'][0]['count'], 2)
+        self.assertEqual(len(response.data['hourly']), 1)
+        
+        # 应用统计的请求次数同样从汇总表读取，不查询日志分区
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/kintone/apps/statistics/')
+        self.assertFalse([q['sql'] for q in queries if 'kintonerequestlog' in q['sql'].lower()])
+        self.assertEqual([(row['connection__name'], row['total_apps'], row['total_requests']) for row in response.data],
+                         [('测试连接', 1, 2)])
+    
+    def test_log_list_cursor_pagination(self):
+        """测试请求日志列表按游标翻页，page 参数仍按页码分页"""
+        service = KintoneService(connection_id=self.connection.id)
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={'records': []})):
+            for _ in range(3):
+                service.get_records('1', user=self.user)
+        
+        self.client.force_login(self.user)
+        response = self.client.get('/api/kintone/logs/', {'page_size': 2, 'action': 'get_records'})
+        first = [row['id'] for row in response.data['results']]
+        self.assertEqual(len(first), 2)
+        response = self.client.get(response.data['next'])
+        second = [row['id'] for row in response.data['results']]
+        self.assertEqual(len(second), 1)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(first + second, sorted(first + second, reverse=True))
+        
+        response = self.client.get('/api/kintone/logs/', {'page': 1})
+        self.assertEqual(response.data['count'], 3)
+    
+    def test_log_export_columnar(self):
+        """测试请求日志按过滤条件导出为列式格式"""
+        service = KintoneService(connection_id=self.connection.id)
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={'records': []})):
+            service.get_records('1', user=self.user)
+            service.get_app_info('1', user=self.user)
+        
+        self.client.force_login(self.user)
+        response = self.client.get('/api/kintone/logs/export/', {'export_format': 'columnar', 'action': 'get_records'})
+        self.assertTrue(response.streaming)
+        header, batch = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        columns = dict(zip(header['columns'], batch))
+        self.assertEqual(columns['action'], ['get_records'])
+        self.assertEqual(columns['app_name'], ['测试应用'])
+    
+    def test_upload_file_uses_request_pipeline(self):
+        """测试文件上传经过重试和熔断，以multipart发送且记录每次尝试"""
+        service = KintoneService(connection_id=self.connection.id)
+        responses = [fake_response(503), fake_response(json_data={'fileKey': 'key-1'})]
+        
+        with mock.patch('time.sleep'), mock.patch('requests.Session.request', side_effect=responses) as request:
+            result = service.upload_file(b'data', 'a.txt', user=self.user)
+        
+        self.assertEqual(result, {'fileKey': 'key-1'})
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request.call_args.kwargs['files'], {'file': ('a.txt', b'data')})
+        self.assertNotIn('Content-Type', request.call_args.kwargs['headers'])
+        self.assertEqual(request_log_partitions.query().filter(action='upload_file').count(), 2)
+    
+    def test_session_discarded_when_connection_changes(self):
+        """测试连接配置修改后关闭旧Session"""
+        service = KintoneService(connection_id=self.connection.id)
+        first = service.get_session()
+        
+        self.connection.api_token = 'rotated-token'
+        self.connection.save()
+        
+        self.assertEqual(kintone_session_pool.stats()['sessions'], 0)
+        second = KintoneService(connection_id=self.connection.id).get_session()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.headers['X-Cybozu-API-Token'], 'rotated-token')
+
+
+class AsyncKintoneServiceTest(TestCase):
+    """异步Kintone服务测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection()
+        self.app = create_app(self.connection)
+    
+    def kintone_response(self, json_data):
+        request = httpx.Request('GET', 'https://example.cybozu.com/k/v1/records.json')
+        return httpx.Response(200, json=json_data, request=request)
+    
+    async def test_concurrency_bounded_per_connection(self):
+        """测试同一连接的并发请求数受信号量限制"""
+        service = await AsyncKintoneService.create(connection_id=self.connection.id)
+        in_flight = 0
+        peak = 0
+        
+        async def slow_request(*args, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return self.kintone_response({'records': []})
+        
+        with self.settings(KINTONE_ASYNC_CONCURRENCY=2), \
+                mock.patch('httpx.AsyncClient.request', side_effect=slow_request):
+            results = await asyncio.gather(*[service.get_records('1') for _ in range(6)])
+        
+        self.assertEqual(len(results), 6)
+        self.assertEqual(peak, 2)
+        self.assertEqual(await request_log_partitions.query().filter(app=self.app).acount(), 6)
+    
+    def test_async_view(self):
+        """测试异步视图"""
+        self.client.force_login(self.user)
+        
+        with mock.patch('httpx.AsyncClient.request', new_callable=mock.AsyncMock,
+                        return_value=self.kintone_response({'records': [], 'totalCount': None})):
+            response = self.client.post(
+                '/api/kintone/async/kintone/get_records/',
+                {'connection_id': self.connection.id, 'app_id': '1'},
+                content_type='application/json'
+            )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['records'], [])
+
+
+class KintoneBulkRequestTest(TestCase):
+    """bulkRequest批量事务测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection(use_guest_space=True, guest_space_id='5')
+    
+    def test_bulk_request_single_call(self):
+        """测试多个跨应用操作合并为一次请求并只记录一条日志"""
+        service = KintoneService(connection_id=self.connection.id)
+        operations = [
+            {'method': 'POST', 'api': 'record.json', 'payload': {'app': 1, 'record': {}}},
+            {'method': 'PUT', 'api': 'records.json', 'payload': {'app': 2, 'records': []}},
+            {'method': 'DELETE', 'api': '/k/v1/records.json', 'payload': {'app': 3, 'ids': [1]}},
+        ]
+        
+        with mock.patch('requests.Session.request',
+                        return_value=fake_response(json_data={'results': [{}, {}, {}]})) as request:
+            result = service.bulk_request(operations, user=self.user)
+        
+        self.assertEqual(len(result['results']), 3)
+        self.assertEqual(request.call_count, 1)
+        self.assertTrue(request.call_args.kwargs['url'].endswith('/k/guest/5/v1/bulkRequest.json'))
+        apis = [item['api'] for item in request.call_args.kwargs['json']['requests']]
+        self.assertEqual(apis, ['/k/guest/5/v1/record.json', '/k/guest/5/v1/records.json', '/k/v1/records.json'])
+        self.assertEqual(request_log_partitions.query().filter(action='bulk_request').count(), 1)
+    
+    def test_bulk_request_limit(self):
+        """测试超过20个操作时拒绝"""
+        self.client.force_login(self.user)
+        operations = [{'method': 'POST', 'api': 'record.json', 'payload': {'app': 1}}] * 21
+        
+        response = self.client.post('/api/kintone/kintone/bulk_request/', {
+            'connection_id': self.connection.id,
+            'requests': operations
+        }, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 400)
+
+
+
+def echo_ids(method, url, **kwargs):
+    """按请求中的记录返回ids（以记录中的n字段作为ID）"""
+    records = kwargs['json']['records']
+    return fake_response(json_data={
+        'ids': [str(r['n']) for r in records],
+        'revisions': ['1'] * len(records)
+    })
+
+
+class KintoneChunkedWriteTest(TestCase):
+    """批量写入自动分批测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection()
+        self.records = [{'n': i} for i in range(250)]
+    
+    @override_settings(KINTONE_BULK_PARALLELISM=1)
+    def test_add_records_chunked_in_order(self):
+        """测试超过100条时按100条分批，结果按输入顺序合并"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with mock.patch('requests.Session.request', side_effect=echo_ids) as request:
+            result = service.add_records('1', self.records, user=self.user)
+        
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual([len(c.kwargs['json']['records']) for c in request.call_args_list], [100, 100, 50])
+        self.assertEqual(result['ids'], [str(i) for i in range(250)])
+        self.assertEqual(len(result['revisions']), 250)
+        self.assertEqual(request_log_partitions.query().filter(action='add_record').count(), 3)
+    
+    @override_settings(KINTONE_BULK_PARALLELISM=1, API_REQUEST_TIMEOUT=0.05)
+    def test_multi_page_write_uses_long_budget(self):
+        """测试分块批量写入的接口使用长时间预算，总耗时超过默认预算也不会中途停止"""
+        def slow_echo_ids(method, url, **kwargs):
+            time.sleep(0.03)
+            return echo_ids(method, url, **kwargs)
+        
+        self.client.force_login(self.user)
+        with mock.patch('requests.Session.request', side_effect=slow_echo_ids) as request:
+            response = self.client.post('/api/kintone/kintone/add_records/', {
+                'connection_id': self.connection.id,
+                'app_id': '1',
+                'records_data': self.records,
+            }, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(len(response.json()['data']['ids']), 250)
+    
+    @override_settings(KINTONE_BULK_PARALLELISM=4)
+    def test_parallel_dispatch_keeps_input_order(self):
+        """测试并发提交时各批完成顺序不同也按输入顺序合并"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        def make_request(method, endpoint, app_id=None, data=None, **kwargs):
+            time.sleep(random.uniform(0, 0.02))
+            return {'records': [{'id': str(r['n']), 'revision': '2'} for r in data['records']]}
+        
+        with mock.patch.object(service, 'make_request', side_effect=make_request):
+            result = service.update_records('1', [{'n': i} for i in range(1000)])
+        
+        self.assertEqual([r['id'] for r in result['records']], [str(i) for i in range(1000)])
+    
+    @override_settings(KINTONE_BULK_PARALLELISM=1)
+    def test_partial_failure_reports_failed_chunks(self):
+        """测试部分批次失败时其余批次仍然提交，并报告失败批次"""
+        service = KintoneService(connection_id=self.connection.id)
+        responses = [fake_response(json_data={}), fake_response(500, {}), fake_response(json_data={})]
+        
+        with mock.patch('requests.Session.request', side_effect=responses) as request:
+            with self.assertRaises(KintoneBulkWriteError) as ctx:
+                service.delete_records('1', list(range(250)))
+        
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual([index for index, _ in ctx.exception.errors], [1])
+        self.assertEqual(ctx.exception.results, [{}, None, {}])
+    
+    @override_settings(KINTONE_BULK_PARALLELISM=1)
+    def test_partial_failure_view_returns_committed_results(self):
+        """测试接口在部分批次失败时返回207、已提交的结果和失败批次，全部失败时返回409"""
+        calls = []
+        
+        def fail_second(method, url, **kwargs):
+            calls.append(url)
+            return fake_response(500, {}) if len(calls) == 2 else echo_ids(method, url, **kwargs)
+        
+        self.client.force_login(self.user)
+        with mock.patch('requests.Session.request', side_effect=fail_second):
+            response = self.client.post('/api/kintone/kintone/add_records/', {
+                'connection_id': self.connection.id,
+                'app_id': '1',
+                'records_data': self.records,
+            }, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual(body['status'], 'partial')
+        self.assertEqual(body['data']['results']['ids'], [str(i) for i in range(100)] + [str(i) for i in range(200, 250)])
+        self.assertEqual([(e['batch'], e['start'], e['stop']) for e in body['data']['errors']], [(1, 100, 200)])
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(500, {})):
+            response = self.client.post('/api/kintone/kintone/delete_records/', {
+                'connection_id': self.connection.id,
+                'app_id': '1',
+                'record_ids': list(range(1, 251)),
+            }, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(response.json()['data']['errors']), 3)
+    
+    @override_settings(KINTONE_BULK_PARALLELISM=1)
+    def test_atomic_uses_bulk_request_groups(self):
+        """测试事务模式下每2000条合并为一个bulkRequest"""
+        service = KintoneService(connection_id=self.connection.id)
+        records = [{'n': i} for i in range(2500)]
+        
+        def bulk(method, url, **kwargs):
+            return fake_response(json_data={'results': [
+                {'ids': [str(r['n']) for r in item['payload']['records']]}
+                for item in kwargs['json']['requests']
+            ]})
+        
+        with mock.patch('requests.Session.request', side_effect=bulk) as request:
+            result = service.add_records('1', records, atomic=True)
+        
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual([len(c.kwargs['json']['requests']) for c in request.call_args_list], [20, 5])
+        self.assertEqual(result['ids'], [str(i) for i in range(2500)])
+    
+    async def test_async_chunked_write(self):
+        """测试异步服务分批写入"""
+        service = AsyncKintoneService(self.connection)
+        
+        async def request(method, url, **kwargs):
+            await asyncio.sleep(random.uniform(0, 0.01))
+            records = kwargs['json']['records']
+            return httpx.Response(200, json={'ids': [str(r['n']) for r in records]},
+                                  request=httpx.Request(method, url))
+        
+        with mock.patch('httpx.AsyncClient.request', side_effect=request):
+            result = await service.add_records('1', self.records)
+        
+        self.assertEqual(result['ids'], [str(i) for i in range(250)])
+
+
+class KintoneCursorExportTest(TestCase):
+    """游标API流式导出测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection()
+        self.pages = [
+            {'records': [{'名称': {'type': 'SINGLE_LINE_TEXT', 'value': f'客户{i}'},
+                          '标签': {'type': 'CHECK_BOX', 'value': ['a', 'b']}} for i in range(2)], 'next': True},
+            {'records': [{'名称': {'type': 'SINGLE_LINE_TEXT', 'value': '客户2'},
+                          '标签': {'type': 'CHECK_BOX', 'value': []}}], 'next': False},
+        ]
+    
+    def cursor_api(self):
+        """模拟游标API：创建游标后按顺序返回各页"""
+        pages = iter(self.pages)
+        
+        def request(method, url, **kwargs):
+            if method == 'POST':
+                return fake_response(json_data={'id': 'cursor-1', 'totalCount': '3'})
+            if method == 'GET':
+                return fake_response(json_data=next(pages))
+            return fake_response(json_data={})
+        
+        return mock.patch('requests.Session.request', side_effect=request)
+    
+    def test_iter_records_follows_cursor(self):
+        """测试逐页读取直到最后一页，读完后不再删除游标"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with self.cursor_api() as request:
+            records = list(service.iter_records('1', query='状态 in ("完成")', size=2))
+        
+        self.assertEqual([r['名称']['value'] for r in records], ['客户0', '客户1', '客户2'])
+        self.assertEqual([c.kwargs['method'] for c in request.call_args_list], ['POST', 'GET', 'GET'])
+        self.assertEqual(request.call_args_list[0].kwargs['json']['size'], 2)
+        self.assertEqual(request.call_args_list[1].kwargs['params'], {'id': 'cursor-1'})
+    
+    def test_early_exit_deletes_cursor(self):
+        """测试提前结束迭代时删除游标"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with self.cursor_api() as request:
+            records = service.iter_records('1')
+            next(records)
+            records.close()
+        
+        self.assertEqual(request.call_args.kwargs['method'], 'DELETE')
+        self.assertEqual(request.call_args.kwargs['json'], {'id': 'cursor-1'})
+    
+    def test_export_csv_streams(self):
+        """测试导出接口以CSV流式输出"""
+        self.client.force_login(self.user)
+        
+        with self.cursor_api():
+            response = self.client.post('/api/kintone/kintone/export_records/', {
+                'connection_id': self.connection.id,
+                'app_id': '1',
+                'format': 'csv'
+            }, content_type='application/json')
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode('utf-8-sig')
+        
+        lines = content.splitlines()
+        self.assertEqual(lines[0], '名称,标签')
+        self.assertEqual(lines[1], '客户0,"[""a"", ""b""]"')
+        self.assertEqual(len(lines), 4)
+    
+    @override_settings(API_LONG_REQUEST_TIMEOUT=600)
+    def test_export_pages_keep_view_deadline(self):
+        """测试中间件恢复截止时间后，流式输出中读取的每一页仍受导出的时间预算限制"""
+        budgets = []
+        self.client.force_login(self.user)
+        
+        with self.cursor_api() as request:
+            cursor_request = request.side_effect
+            
+            def record_deadline(method, url, **kwargs):
+                deadline = get_deadline()
+                budgets.append(deadline and deadline.budget)
+                return cursor_request(method, url, **kwargs)
+            
+            request.side_effect = record_deadline
+            response = self.client.post('/api/kintone/kintone/export_records/', {
+                'connection_id': self.connection.id,
+                'app_id': '1'
+            }, content_type='application/json')
+            self.assertIsNone(get_deadline())
+            b''.join(response.streaming_content)
+        
+        self.assertEqual(len(budgets), 3)
+        self.assertEqual(budgets, [600] * 3)
+    
+    def test_export_error_before_streaming(self):
+        """测试游标创建失败时返回400"""
+        self.client.force_login(self.user)
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(400, {'message': 'query错误'})):
+            response = self.client.post('/api/kintone/kintone/export_records/', {
+                'connection_id': self.connection.id,
+                'app_id': '1'
+            }, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 400)
+
+
+
+class KintoneRetryTest(TestCase):
+    """Kintone请求重试测试"""
+    
+    def setUp(self):
+        self.connection = create_connection()
+    
+    @override_settings(API_RETRY_MAX_ATTEMPTS=3)
+    def test_transient_errors_retried_until_limit(self):
+        """测试网络错误和503按次数上限重试"""
+        from requests import ConnectionError
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with mock.patch('requests.Session.request',
+                        side_effect=[ConnectionError('reset'), fake_response(503, {}), fake_response(503, {})]) as request, \
+                mock.patch('time.sleep'):
+            with self.assertRaises(Exception):
+                service.get_records('1')
+        
+        self.assertEqual(request.call_count, 3)
+        logs = request_log_partitions.query().union('id')
+        self.assertEqual(len({log.request_id for log in logs}), 1)
+        self.assertEqual([(log.attempt, log.status) for log in logs],
+                         [(1, 'error'), (2, 'failed'), (3, 'failed')])
+    
+    def test_write_retry_opt_in(self):
+        """测试写操作显式开启后重试"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with mock.patch('requests.Session.request',
+                        side_effect=[fake_response(429, {}), fake_response(json_data={'id': '1'})]) as request, \
+                mock.patch('time.sleep'):
+            result = service.make_request('POST', 'record.json', data={'app': 1}, action='add_record', retry=True)
+        
+        self.assertEqual(result, {'id': '1'})
+        self.assertEqual(request.call_count, 2)
+
+
+
+class KintoneRateLimitTest(TestCase):
+    """Kintone限流测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection(subdomain='ratelimited')
+    
+    @override_settings(RATE_LIMIT_BACKEND='local', KINTONE_RATE_LIMIT=1, KINTONE_RATE_BURST=1, RATE_LIMIT_MAX_WAIT=0)
+    def test_shed_when_bucket_empty(self):
+        """测试令牌桶为空时直接拒绝，不发送请求"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={})) as request:
+            service.get_app_info('1')
+            with self.assertRaises(RateLimitExceeded):
+                service.get_app_info('1')
+        
+        self.assertEqual(request.call_count, 1)
+        
+        # 接口返回429和需要等待的秒数，与参数错误的400区分开
+        self.client.force_login(self.user)
+        response = self.client.post('/api/kintone/kintone/get_app_info/',
+                                    {'connection_id': self.connection.id, 'app_id': '1'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+    
+    @override_settings(RATE_LIMIT_BACKEND='local', KINTONE_RATE_LIMIT=0.1, KINTONE_RATE_BURST=1, RATE_LIMIT_MAX_WAIT=10)
+    def test_wait_bounded_by_deadline(self):
+        """测试等待令牌的时间不超过当前请求剩余的时间预算"""
+        service = KintoneService(connection_id=create_connection(subdomain='deadline').id)
+        
+        token = current_deadline.set(Deadline(1))
+        try:
+            with mock.patch('requests.Session.request', return_value=fake_response(json_data={})) as request, \
+                    mock.patch('time.sleep') as sleep:
+                service.get_app_info('1')
+                with self.assertRaises(RateLimitExceeded):
+                    service.get_app_info('1')
+        finally:
+            current_deadline.reset(token)
+        
+        self.assertEqual(request.call_count, 1)
+        sleep.assert_not_called()
+    
+    @override_settings(RATE_LIMIT_BACKEND='local', KINTONE_RATE_LIMIT=5, KINTONE_RATE_BURST=10)
+    def test_rate_limits_visible(self):
+        """测试查看各域名的限流令牌桶"""
+        self.client.force_login(self.user)
+        
+        response = self.client.get('/api/kintone/kintone/rate_limits/')
+        
+        self.assertEqual(response.status_code, 200)
+        level = response.json()['data'][0]
+        self.assertEqual(level['key'], 'kintone:ratelimited')
+        self.assertEqual(level['capacity'], 10)
+
+
+
+class KintoneCircuitBreakerTest(TestCase):
+    """Kintone熔断测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.connection = create_connection(subdomain='unstable')
+        self.app = create_app(self.connection)
+        circuit_breakers.clear()
+    
+    def tearDown(self):
+        circuit_breakers.clear()
+    
+    @override_settings(RATE_LIMIT_BACKEND='local', CIRCUIT_FAILURE_THRESHOLD=2, API_RETRY_MAX_ATTEMPTS=1)
+    def test_fast_fail_while_open(self):
+        """测试连续5xx后熔断，之后的请求不再发出也不写日志"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(500)) as request:
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    service.get_records('1')
+            logs = request_log_partitions.query().count()
+            with self.assertRaises(CircuitOpenError):
+                service.get_records('1')
+        
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request_log_partitions.query().count(), logs)
+        
+        self.client.force_login(self.user)
+        response = self.client.get('/api/kintone/kintone/circuit_breakers/')
+        states = {b['key']: b['state'] for b in response.json()['data']}
+        self.assertEqual(states, {
+            f'kintone:connection:{self.connection.pk}': 'open',
+            f'kintone:app:{self.app.pk}': 'open',
+        })
+        
+        # 熔断时接口返回503和Retry-After，与参数错误的400区分开
+        for url in ('/api/kintone/kintone/get_records/', '/api/kintone/async/kintone/get_records/'):
+            response = self.client.post(url, {'connection_id': self.connection.id, 'app_id': '1'},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 503, url)
+            self.assertGreaterEqual(int(response['Retry-After']), 1)
+    
+    @override_settings(RATE_LIMIT_BACKEND='local', CIRCUIT_FAILURE_THRESHOLD=1)
+    def test_client_errors_do_not_trip(self):
+        """测试4xx说明上游可用，不会触发熔断"""
+        service = KintoneService(connection_id=self.connection.id)
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(400)):
+            for _ in range(3):
+                with self.assertRaises(Exception):
+                    service.get_records('1')
+        
+        self.assertEqual(circuit_breakers.get(f'kintone:connection:{self.connection.pk}').state, 'closed')
+
+
+class KintoneRequestLogAdminTest(TestCase):
+    """请求日志Admin按分区浏览测试"""
+    
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.client.force_login(self.admin)
+        self.app = create_app()
+    
+    def test_changelist_and_detail(self):
+        """测试列表默认显示最新分区，可切换到默认分区，详情页按主键定位分区"""
+        log = KintoneRequestLog(app=self.app, action='get_records', request_url='records.json',
+                                request_method='GET', status='success',
+                                response_body_digest=request_log_bodies.put('{"records":[]}'))
+        request_log_partitions.bulk_create([log])
+        legacy = KintoneRequestLog.objects.create(app=self.app, action='add_record', request_url='record.json',
+                                                  request_method='POST', status='error')
+        
+        url = '/admin/kintone_api/kintonerequestlog/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [log.pk])
+        
+        response = self.client.get(url, {'partition': 'default'})
+        self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [legacy.pk])
+        
+        response = self.client.get(f'{url}{log.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'records.json')
+        self.assertContains(response, '{&quot;records&quot;:[]}')
+    
+    def test_changelist_without_scans(self):
+        """测试列表按日期下钻、请求方法过滤和路径前缀搜索"""
+        now = timezone.now()
+        get_log, add_log = logs = [
+            KintoneRequestLog(app=self.app, action='get_records', request_method='GET', status='success',
+                              request_url='https://example.cybozu.com/k/v1/records.json',
+                              request_path='/k/v1/records.json', created_at=now),
+            KintoneRequestLog(app=self.app, action='add_record', request_method='POST', status='success',
+                              request_url='https://example.cybozu.com/k/v1/record.json',
+                              request_path='/k/v1/record.json', created_at=now),
+        ]
+        request_log_partitions.bulk_create(logs)
+        today = timezone.localdate().isoformat()
+        
+        url = '/admin/kintone_api/kintonerequestlog/'
+        response = self.client.get(url)
+        date_filter = next(spec for spec in response.context['cl'].filter_specs if spec.parameter_name == 'date')
+        self.assertIn(today, dict(date_filter.lookup_choices))
+        
+        response = self.client.get(url, {'date': today})
+        self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [add_log.pk, get_log.pk])
+        response = self.client.get(url, {'request_method': 'POST'})
+        self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [add_log.pk])
+        response = self.client.get(url, {'q': '/k/v1/records'})
+        self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [get_log.pk])
+        
+        self.assertEqual(self.client.get(url, {'date': 'yesterday'}).status_code, 302)
@@ -3,7 +3,7 @@ Kintone API应用的URL配置
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'connections', views.KintoneConnectionViewSet, basename='kintone-connection')
@@ -12,7 +12,23 @@ router.register(r'logs', views.KintoneRequestLogViewSet, basename='kintone-log')
 router.register(r'field-mappings', views.KintoneFieldMappingViewSet, basename='kintone-fieldmapping')
 router.register(r'kintone', views.KintoneAPIViewSet, basename='kintone-api')
 
+# 异步操作接口（需通过ASGI部署才能发挥并发优势）
+async_urlpatterns = [
+    path('get_records/', async_views.get_records, name='kintone-async-get-records'),
+    path('export_records/', async_views.export_records, name='kintone-async-export-records'),
+    path('get_record/', async_views.get_record, name='kintone-async-get-record'),
+    path('add_record/', async_views.add_record, name='kintone-async-add-record'),
+    path('add_records/', async_views.add_records, name='kintone-async-add-records'),
+    path('update_record/', async_views.update_record, name='kintone-async-update-record'),
+    path('update_records/', async_views.update_records, name='kintone-async-update-records'),
+    path('delete_records/', async_views.delete_records, name='kintone-async-delete-records'),
+    path('get_app_info/', async_views.get_app_info, name='kintone-async-get-app-info'),
+    path('get_form_fields/', async_views.get_form_fields, name='kintone-async-get-form-fields'),
+    path('bulk_request/', async_views.bulk_request, name='kintone-async-bulk-request'),
+]
+
 urlpatterns = [
+    path('async/kintone/', include(async_urlpatterns)),
     path('', include(router.urls)),
 ]
 
@@ -1,26 +1,48 @@
 """
 Kintone API视图
 """
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count, Q
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from datetime import timedelta
+from itertools import chain
 
-from .models import KintoneConnection, KintoneApp, KintoneRequestLog, KintoneFieldMapping
+from .models import (
+    KintoneConnection, KintoneApp, KintoneRequestLog, KintoneFieldMapping, request_log_partitions, request_rollups
+)
 from .serializers import (
     KintoneConnectionSerializer, KintoneConnectionListSerializer,
     KintoneAppSerializer, KintoneRequestLogSerializer, KintoneRequestLogDetailSerializer,
     KintoneFieldMappingSerializer,
-    KintoneGetRecordsSerializer, KintoneGetRecordSerializer,
+    KintoneGetRecordsSerializer, KintoneGetRecordSerializer, KintoneExportRecordsSerializer,
     KintoneAddRecordSerializer, KintoneAddRecordsSerializer,
     KintoneUpdateRecordSerializer, KintoneUpdateRecordsSerializer,
     KintoneDeleteRecordsSerializer, KintoneGetAppInfoSerializer,
-    KintoneGetFormFieldsSerializer
+    KintoneGetFormFieldsSerializer, KintoneBulkRequestSerializer, KintoneRequestLogExportSerializer
 )
-from .services import KintoneService
+from automationapi.circuit import circuit_breakers
+from automationapi.pagination import PartitionedCursorPagination
+from automationapi.deadline import long_running
+from automationapi.errors import exception_response
+from automationapi.streaming import streaming_export
+from .services import KintoneService, KintoneBulkWriteError, kintone_session_pool, flatten_record
+
+
+def bulk_write_error_response(error, atomic):
+    """
+    分批写入部分失败时的响应
+    部分批次已提交时返回207，全部失败时返回409；data 中包含已提交批次合并后的结果和失败批次的范围
+    """
+    return Response({
+        'status': 'partial' if error.committed else 'error',
+        'message': str(error),
+        'data': error.to_dict(KintoneService.write_batch_size(atomic))
+    }, status=status.HTTP_207_MULTI_STATUS if error.committed else status.HTTP_409_CONFLICT)
 
 
 class KintoneConnectionViewSet(viewsets.ModelViewSet):
@@ -58,70 +80,145 @@ class KintoneAppViewSet(viewsets.ModelViewSet):
         stats = KintoneApp.objects.values('connection__name').annotate(
             total_apps=Count('id'),
             active_apps=Count('id', filter=Q(is_active=True)),
-            total_requests=Count('logs')
         )
-        return Response(stats)
+        # 请求次数读取小时汇总（包括失败和未收到响应的请求），不扫描日志分区
+        requests = {row['connection__name']: row['count'] for row in request_rollups.count_by('connection__name')}
+        return Response([
+            {**row, 'total_requests': requests.get(row['connection__name'], 0)} for row in stats
+        ])
+    
+    @action(detail=False, methods=['get'])
+    def latency(self, request):
+        """各应用各操作类型响应时间的分位数（秒），合并汇总表中的直方图计算，不扫描日志"""
+        days = int(request.query_params.get('days', 7))
+        date_from = timezone.now() - timedelta(days=days)
+        return Response(request_rollups.latency('app', 'app__app_name', 'action', since=date_from))
+    
+    @action(detail=True, methods=['get'], url_path='latency', url_name='latency-detail')
+    def latency_detail(self, request, pk=None):
+        """单个应用各操作类型响应时间的分位数（秒），以及按小时的变化（可用action参数只看某个操作类型）"""
+        app = self.get_object()
+        days = int(request.query_params.get('days', 7))
+        date_from = timezone.now() - timedelta(days=days)
+        filters = {'app': app}
+        action_filter = request.query_params.get('action', None)
+        if action_filter:
+            filters['action'] = action_filter
+        
+        return Response({
+            'app': app.pk,
+            'by_action': request_rollups.latency('action', since=date_from, **filters),
+            'hourly': request_rollups.latency_series(date_from, **filters),
+        })
 
 
 class KintoneRequestLogViewSet(viewsets.ReadOnlyModelViewSet):
-    """Kintone请求日志（只读）"""
+    """Kintone请求日志（只读，按时间分区存储）"""
     
-    queryset = KintoneRequestLog.objects.select_related(
-        'connection', 'app', 'user'
-    ).all()
+    queryset = KintoneRequestLog.objects.none()
     permission_classes = [IsAuthenticated]
+    pagination_class = PartitionedCursorPagination
+    # 导出的列，app_name 取自应用表
+    export_fields = [
+        'id', 'created_at', 'connection', 'app', 'action', 'user', 'request_method', 'request_url',
+        'status_code', 'response_time', 'status', 'error_message', 'timeout_phase',
+        'request_id', 'attempt', 'request_body_digest', 'response_body_digest',
+    ]
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return KintoneRequestLogDetailSerializer
         return KintoneRequestLogSerializer
     
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        
+    def get_partitioned_query(self):
+        """按过滤参数构造跨分区查询，指定days时只访问相关的分区"""
         # 过滤参数
         app_id = self.request.query_params.get('app', None)
         action = self.request.query_params.get('action', None)
         status_filter = self.request.query_params.get('status', None)
         days = self.request.query_params.get('days', None)
+        request_id = self.request.query_params.get('request_id', None)
+        
+        date_from = timezone.now() - timedelta(days=int(days)) if days else None
+        query = request_log_partitions.query(since=date_from).select_related('connection', 'app', 'user')
         
         if app_id:
-            queryset = queryset.filter(app_id=app_id)
+            query = query.filter(app_id=app_id)
         
         if action:
-            queryset = queryset.filter(action=action)
+            query = query.filter(action=action)
         
         if status_filter:
-            queryset = queryset.filter(status=status_filter)
+            query = query.filter(status=status_filter)
         
-        if days:
-            date_from = timezone.now() - timedelta(days=int(days))
-            queryset = queryset.filter(created_at__gte=date_from)
+        # 同一次调用的所有重试尝试
+        if request_id:
+            query = query.filter(request_id=request_id)
         
-        return queryset
+        return query
+    
+    def get_queryset(self):
+        return self.get_partitioned_query().union()
+    
+    def list(self, request, *args, **kwargs):
+        """按 (created_at, id) 键集分页，带 page 参数时按页码分页"""
+        page = self.paginator.paginate_partitioned(self.get_partitioned_query(), request, self)
+        if page is None:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer(page, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+    
+    def get_object(self):
+        """按主键直接定位日志所在的分区"""
+        try:
+            obj = self.get_partitioned_query().get(pk=self.kwargs['pk'])
+        except (ObjectDoesNotExist, ValueError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """获取使用统计"""
+        """获取使用统计（读取预聚合汇总，不扫描日志）"""
         days = int(request.query_params.get('days', 7))
         date_from = timezone.now() - timedelta(days=days)
         
-        logs = KintoneRequestLog.objects.filter(created_at__gte=date_from)
+        totals = request_rollups.totals(since=date_from)
+        by_status = totals['by_status']
         
         stats = {
-            'total_requests': logs.count(),
-            'success_requests': logs.filter(status='success').count(),
-            'failed_requests': logs.filter(status='failed').count(),
-            'error_requests': logs.filter(status='error').count(),
-            'by_action': list(logs.values('action').annotate(
-                count=Count('id')
-            ).order_by('-count')),
-            'by_app': list(logs.values('app__app_name').annotate(
-                count=Count('id')
-            ).order_by('-count')[:10]),
+            'total_requests': totals['count'],
+            'success_requests': by_status.get('success', 0),
+            'failed_requests': by_status.get('failed', 0),
+            'error_requests': by_status.get('error', 0),
+            'avg_response_time': totals['avg_response_time'],
+            'by_action': request_rollups.count_by('action', since=date_from),
+            'by_app': request_rollups.count_by('app__app_name', since=date_from, limit=10),
         }
         
         return Response(stats)
+    
+    @action(detail=False, methods=['get'])
+    @long_running
+    def export(self, request):
+        """
+        流式导出日志（过滤参数与列表相同），逐块读取values()字典，不创建模型实例
+        export_format 为 ndjson、csv 或 columnar，chunk_size 为每次从数据库读取的行数
+        """
+        serializer = KintoneRequestLogExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        rows = self.get_partitioned_query().iterator(
+            *self.export_fields, chunk_size=data['chunk_size'], app_name=F('app__app_name')
+        )
+        return streaming_export(
+            rows,
+            export_format=data['export_format'],
+            filename='kintone_request_logs',
+            columns=self.export_fields + ['app_name'],
+            batch_size=data['chunk_size']
+        )
 
 
 class KintoneFieldMappingViewSet(viewsets.ModelViewSet):
@@ -171,10 +268,44 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
+    
+    @action(detail=False, methods=['post'])
+    @long_running
+    def export_records(self, request):
+        """通过游标API流式导出记录（NDJSON/CSV），不受10000条限制"""
+        serializer = KintoneExportRecordsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        data = serializer.validated_data
+        connection_id = data.get('connection_id')
+        
+        try:
+            service = KintoneService(connection_id=connection_id)
+            
+            records = service.iter_records(
+                app_id=data['app_id'],
+                query=data.get('query'),
+                fields=data.get('fields'),
+                size=data.get('size'),
+                user=request.user
+            )
+            # 先读取第一页，游标创建失败时仍可返回400
+            first = next(records, None)
+            
+        except Exception as e:
+            return exception_response(e)
+        
+        if first is not None:
+            records = chain([first], records)
+        
+        return streaming_export(
+            records,
+            export_format=data['format'],
+            filename=f"kintone_app_{data['app_id']}",
+            columns=data.get('fields'),
+            to_row=flatten_record
+        )
     
     @action(detail=False, methods=['post'])
     def get_record(self, request):
@@ -201,10 +332,7 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
     def add_record(self, request):
@@ -231,12 +359,10 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_201_CREATED)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
+    @long_running
     def add_records(self, request):
         """批量添加记录"""
         serializer = KintoneAddRecordsSerializer(data=request.data)
@@ -251,6 +377,7 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             result = service.add_records(
                 app_id=data['app_id'],
                 records_data=data['records_data'],
+                atomic=data['atomic'],
                 user=request.user
             )
             
@@ -260,11 +387,11 @@ class KintoneAPIViewSet(viewsets.ViewSet):
                 'data': result
             }, status=status.HTTP_201_CREATED)
             
+        except KintoneBulkWriteError as e:
+            return bulk_write_error_response(e, data['atomic'])
+            
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
     def update_record(self, request):
@@ -293,12 +420,10 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
+    @long_running
     def update_records(self, request):
         """批量更新记录"""
         serializer = KintoneUpdateRecordsSerializer(data=request.data)
@@ -313,6 +438,7 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             result = service.update_records(
                 app_id=data['app_id'],
                 records_data=data['records_data'],
+                atomic=data['atomic'],
                 user=request.user
             )
             
@@ -322,13 +448,14 @@ class KintoneAPIViewSet(viewsets.ViewSet):
                 'data': result
             }, status=status.HTTP_200_OK)
             
+        except KintoneBulkWriteError as e:
+            return bulk_write_error_response(e, data['atomic'])
+            
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
+    @long_running
     def delete_records(self, request):
         """删除记录"""
         serializer = KintoneDeleteRecordsSerializer(data=request.data)
@@ -343,6 +470,7 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             result = service.delete_records(
                 app_id=data['app_id'],
                 record_ids=data['record_ids'],
+                atomic=data['atomic'],
                 user=request.user
             )
             
@@ -352,11 +480,11 @@ class KintoneAPIViewSet(viewsets.ViewSet):
                 'data': result
             }, status=status.HTTP_200_OK)
             
+        except KintoneBulkWriteError as e:
+            return bulk_write_error_response(e, data['atomic'])
+            
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
     def get_app_info(self, request):
@@ -382,10 +510,7 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
     def get_form_fields(self, request):
@@ -411,7 +536,55 @@ class KintoneAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
+            return exception_response(e)
+    
+    @action(detail=False, methods=['post'])
+    @long_running
+    def bulk_request(self, request):
+        """批量事务：一次请求执行多个添加/更新/删除操作"""
+        serializer = KintoneBulkRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        data = serializer.validated_data
+        connection_id = data.get('connection_id')
+        
+        try:
+            service = KintoneService(connection_id=connection_id)
+            
+            result = service.bulk_request(
+                requests_data=data['requests'],
+                user=request.user
+            )
+            
             return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+                'status': 'success',
+                'message': f'成功执行 {len(data["requests"])} 个操作',
+                'data': result
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return exception_response(e)
+    
+    @action(detail=False, methods=['get'])
+    def pool_stats(self, request):
+        """查看当前进程的Kintone连接池统计"""
+        return Response(kintone_session_pool.stats())
+    
+    @action(detail=False, methods=['get'])
+    def rate_limits(self, request):
+        """查看各Kintone域名限流令牌桶的当前状态（所有worker共享）"""
+        subdomains = KintoneConnection.objects.filter(is_active=True).order_by('subdomain') \
+            .values_list('subdomain', flat=True).distinct()
+        
+        return Response({
+            'status': 'success',
+            'data': [KintoneService.rate_limit_level(subdomain) for subdomain in subdomains]
+        })
+    
+    @action(detail=False, methods=['get'])
+    def circuit_breakers(self, request):
+        """查看当前进程中各连接和应用熔断器的状态（closed/open/half_open）"""
+        return Response({
+            'status': 'success',
+            'data': circuit_breakers.snapshot('kintone:')
+        })
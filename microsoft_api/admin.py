@@ -3,7 +3,10 @@ Admin后台配置
 """
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import APIToken, APIEndpoint, APIUsageLog, TeamsMessage, EmailTemplate
+from automationapi.admin import PartitionedLogAdmin, RequestMethodListFilter
+from .models import (
+    APIToken, APIEndpoint, APIUsageLog, TeamsMessage, EmailTemplate, usage_log_bodies, usage_log_partitions
+)
 
 
 @admin.register(APIToken)
@@ -13,7 +16,7 @@ class APITokenAdmin(admin.ModelAdmin):
     list_display = ['name', 'is_active', 'token_status', 'created_at', 'updated_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'client_id', 'tenant_id']
-    readonly_fields = ['access_token', 'token_expires_at', 'created_at', 'updated_at', 'created_by']
+    readonly_fields = ['access_token', 'token_expires_at', 'refresh_lease_until', 'created_at', 'updated_at', 'created_by']
     
     fieldsets = (
         ('基本信息', {
@@ -23,7 +26,7 @@ class APITokenAdmin(admin.ModelAdmin):
             'fields': ('client_id', 'client_secret', 'tenant_id')
         }),
         ('Token缓存（系统管理）', {
-            'fields': ('access_token', 'token_expires_at'),
+            'fields': ('access_token', 'token_expires_at', 'refresh_lease_until'),
             'classes': ('collapse',)
         }),
         ('元数据', {
@@ -49,10 +52,10 @@ class APITokenAdmin(admin.ModelAdmin):
 class APIEndpointAdmin(admin.ModelAdmin):
     """API端点管理"""
     
-    list_display = ['name', 'service', 'http_method', 'is_active', 'total_calls', 'last_called']
+    list_display = ['name', 'service', 'http_method', 'is_active', 'total_calls_display', 'last_called_display']
     list_filter = ['service', 'http_method', 'is_active']
     search_fields = ['name', 'endpoint_url', 'description']
-    readonly_fields = ['total_calls', 'last_called', 'created_at', 'updated_at']
+    readonly_fields = ['total_calls_display', 'last_called_display', 'created_at', 'updated_at']
     
     fieldsets = (
         ('基本信息', {
@@ -61,8 +64,16 @@ class APIEndpointAdmin(admin.ModelAdmin):
         ('端点配置', {
             'fields': ('endpoint_url', 'http_method', 'requires_body', 'description')
         }),
+        ('超时', {
+            'fields': ('connect_timeout', 'read_timeout'),
+            'classes': ('collapse',)
+        }),
+        ('日志', {
+            'fields': ('log_body_max_size',),
+            'classes': ('collapse',)
+        }),
         ('统计信息', {
-            'fields': ('total_calls', 'last_called'),
+            'fields': ('total_calls_display', 'last_called_display'),
             'classes': ('collapse',)
         }),
         ('时间戳', {
@@ -70,35 +81,48 @@ class APIEndpointAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def total_calls_display(self, obj):
+        """总调用次数（包含尚未写入数据库的增量）"""
+        return obj.current_total_calls
+    total_calls_display.short_description = '总调用次数'
+    total_calls_display.admin_order_field = 'total_calls'
+    
+    def last_called_display(self, obj):
+        """最后调用时间（包含尚未写入数据库的调用）"""
+        return obj.current_last_called
+    last_called_display.short_description = '最后调用时间'
+    last_called_display.admin_order_field = 'last_called'
 
 
 @admin.register(APIUsageLog)
-class APIUsageLogAdmin(admin.ModelAdmin):
-    """API使用日志管理"""
+class APIUsageLogAdmin(PartitionedLogAdmin):
+    """API使用日志管理（按分区浏览）"""
     
+    partitions = usage_log_partitions
+    bodies = usage_log_bodies
     list_display = ['endpoint', 'status_badge', 'request_method', 'status_code', 
                    'response_time', 'user', 'created_at']
-    list_filter = ['status', 'request_method', 'endpoint__service', 'created_at']
-    search_fields = ['endpoint__name', 'request_url', 'error_message']
+    list_select_related = ['endpoint', 'user']
+    list_defer = PartitionedLogAdmin.list_defer + ('request_headers',)
+    list_filter = ['status', RequestMethodListFilter, 'endpoint', 'endpoint__service', 'timeout_phase']
     readonly_fields = ['endpoint', 'token', 'request_method', 'request_url', 
-                      'request_body', 'request_headers', 'status_code', 
-                      'response_body', 'response_time', 'status', 
-                      'error_message', 'user', 'created_at']
-    
-    date_hierarchy = 'created_at'
+                      'request_body_display', 'request_headers', 'status_code', 
+                      'response_body_display', 'response_time', 'status', 
+                      'error_message', 'timeout_phase', 'request_id', 'attempt', 'user', 'created_at']
     
     fieldsets = (
         ('基本信息', {
-            'fields': ('endpoint', 'token', 'user', 'status', 'created_at')
+            'fields': ('endpoint', 'token', 'user', 'status', 'request_id', 'attempt', 'created_at')
         }),
         ('请求信息', {
-            'fields': ('request_method', 'request_url', 'request_body', 'request_headers')
+            'fields': ('request_method', 'request_url', 'request_body_display', 'request_headers')
         }),
         ('响应信息', {
-            'fields': ('status_code', 'response_body', 'response_time')
+            'fields': ('status_code', 'response_body_display', 'response_time')
         }),
         ('错误信息', {
-            'fields': ('error_message',),
+            'fields': ('error_message', 'timeout_phase'),
             'classes': ('collapse',)
         }),
     )
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MicrosoftApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'microsoft_api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,174 @@
+"""
+微软API异步服务类
+基于httpx的异步Microsoft Graph客户端，请求构造逻辑复用同步服务类
+"""
+import asyncio
+from collections import namedtuple
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+
+from automationapi.deadline import DeadlineExceeded, check_deadline, httpx_timeout
+from automationapi.fastjson import response_json
+from automationapi.http import get_async_client
+from .services import MicrosoftGraphService, TeamsService, OutlookService, SharePointService
+from .tokens import token_cache
+
+
+# 日志端点的延迟查询条件，在make_request中于线程里解析，避免在事件循环中访问数据库
+LogEndpointLookup = namedtuple('LogEndpointLookup', ['service', 'keyword'])
+
+
+class AsyncGraphMixin:
+    """
+    异步Graph服务混入类
+    覆盖所有涉及网络和数据库的方法，同步服务类中的业务方法（如 send_channel_message）
+    会返回 make_request 的协程，因此可以直接 await
+    """
+
+    def __init__(self, api_token):
+        self.api_token = api_token
+
+    @classmethod
+    async def create(cls, token_id=None):
+        """
+        创建服务实例
+        :param token_id: APIToken的ID，如果为None则使用第一个活跃的token
+        """
+        api_token = await sync_to_async(MicrosoftGraphService.load_token)(token_id)
+        return cls(api_token)
+
+    def find_log_endpoint(self, service, keyword):
+        return LogEndpointLookup(service, keyword)
+
+    async def resolve_log_endpoint(self, log_endpoint):
+        """把延迟查询条件解析为APIEndpoint对象"""
+        if isinstance(log_endpoint, LogEndpointLookup):
+            return await sync_to_async(MicrosoftGraphService.find_log_endpoint)(self, *log_endpoint)
+        return log_endpoint
+
+    async def get_access_token(self):
+        """获取访问令牌，缓存命中时不离开事件循环"""
+        access_token = token_cache.peek(self.api_token.pk, self.api_token.updated_at)
+        if access_token:
+            return access_token
+        return await sync_to_async(token_cache.refresh)(self.api_token, self.fetch_access_token)
+
+    async def get_headers(self):
+        """获取请求头"""
+        return {
+            'Authorization': f'Bearer {await self.get_access_token()}',
+            'Content-Type': 'application/json'
+        }
+
+    async def make_request(self, method, endpoint, data=None, params=None, log_endpoint=None, user=None,
+                           retry=None, content=None, content_type=None):
+        """
+        异步发送API请求
+        参数与 MicrosoftGraphService.make_request 相同
+        """
+        url = self.build_url(endpoint)
+        log_endpoint = await self.resolve_log_endpoint(log_endpoint)
+        retry_state = self.retry_policy.begin(method, retry)
+        guard = self.circuit_guard(log_endpoint)
+
+        for attempt in retry_state:
+            headers = await self.get_headers()
+            if content_type:
+                headers['Content-Type'] = content_type
+            await self.athrottle()
+            try:
+                check_deadline()
+            except DeadlineExceeded as e:
+                await sync_to_async(self.log_error)(log_endpoint, method, url, data, e, user,
+                                                    retry_state.request_id, attempt)
+                raise
+            guard.enter()
+
+            start_time = datetime.now()
+
+            try:
+                response = await get_async_client().request(
+                    method,
+                    url,
+                    headers=headers,
+                    json=data,
+                    content=content,
+                    params=params,
+                    timeout=httpx_timeout(*self.get_timeout(log_endpoint))
+                )
+            except Exception as e:
+                guard.failure()
+                await sync_to_async(self.log_error)(log_endpoint, method, url, data, e, user,
+                                                    retry_state.request_id, attempt)
+                delay = retry_state.delay_for(error=e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+
+            response_time = (datetime.now() - start_time).total_seconds()
+            guard.record(response.status_code)
+
+            await sync_to_async(self.log_response)(log_endpoint, method, url, data, response, response_time, user,
+                                                   retry_state.request_id, attempt)
+            await self.athrottled(response)
+
+            delay = retry_state.delay_for(response=response)
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+
+            # 响应已由 log_response 记录（状态为failed），不再另记一条错误日志
+            response.raise_for_status()
+            return response_json(response)
+
+    async def iter_pages(self, endpoint, params=None, log_endpoint=None, user=None, prefetch=False):
+        """
+        按 @odata.nextLink 逐页读取列表的异步生成器
+        参数与 MicrosoftGraphService.iter_pages 相同，预取通过事件循环中的任务完成
+        """
+        log_endpoint = await self.resolve_log_endpoint(log_endpoint)
+        page = await self.make_request('GET', endpoint, params=params, log_endpoint=log_endpoint, user=user)
+        task = None
+
+        try:
+            while page is not None:
+                next_link = page.get('@odata.nextLink')
+                if next_link and prefetch:
+                    task = asyncio.ensure_future(
+                        self.make_request('GET', next_link, log_endpoint=log_endpoint, user=user)
+                    )
+                yield page
+                if task is not None:
+                    page, task = await task, None
+                elif next_link:
+                    page = await self.make_request('GET', next_link, log_endpoint=log_endpoint, user=user)
+                else:
+                    page = None
+        finally:
+            # 提前结束迭代时取消尚未完成的预取
+            if task is not None:
+                task.cancel()
+
+    async def iter_items(self, endpoint, params=None, log_endpoint=None, user=None, prefetch=False):
+        """逐条读取列表的异步生成器，参数与 iter_pages 相同"""
+        async for page in self.iter_pages(endpoint, params, log_endpoint, user, prefetch):
+            for item in page.get('value', []):
+                yield item
+
+
+class AsyncMicrosoftGraphService(AsyncGraphMixin, MicrosoftGraphService):
+    """Microsoft Graph API异步基础服务类"""
+
+
+class AsyncTeamsService(AsyncGraphMixin, TeamsService):
+    """Microsoft Teams异步服务"""
+
+
+class AsyncOutlookService(AsyncGraphMixin, OutlookService):
+    """Outlook邮件异步服务"""
+
+
+class AsyncSharePointService(AsyncGraphMixin, SharePointService):
+    """SharePoint异步服务"""
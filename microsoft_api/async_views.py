@@ -0,0 +1,198 @@
+"""
+微软API异步视图
+与 MicrosoftAPIViewSet 的操作一一对应，通过ASGI运行时单个worker可同时保持大量Graph请求
+"""
+from automationapi.async_api import async_api_view, api_response, exception_response
+from automationapi.deadline import long_running
+from automationapi.streaming import streaming_export
+
+from .serializers import (
+    SendTeamsMessageSerializer, SendEmailSerializer, SharePointOperationSerializer, GraphExportSerializer
+)
+from .async_services import AsyncTeamsService, AsyncOutlookService, AsyncSharePointService
+
+
+# 流式导出的数据源 -> (服务类, 迭代方法, 传给迭代方法的参数)
+EXPORT_SOURCES = {
+    'teams': (AsyncTeamsService, 'iter_teams', ()),
+    'messages': (AsyncOutlookService, 'iter_messages', ('folder',)),
+    'site_lists': (AsyncSharePointService, 'iter_site_lists', ('site_id',)),
+    'list_items': (AsyncSharePointService, 'iter_list_items', ('site_id', 'list_id')),
+}
+
+
+@async_api_view(['POST'])
+async def send_teams_message(request):
+    """发送Teams消息"""
+    serializer = SendTeamsMessageSerializer(data=request.data)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+
+    data = serializer.validated_data
+
+    try:
+        service = await AsyncTeamsService.create(token_id=data.get('token_id'))
+
+        if data['message_type'] == 'channel':
+            result = await service.send_channel_message(
+                team_id=data['team_id'],
+                channel_id=data['channel_id'],
+                message=data['message'],
+                user=request.user
+            )
+        else:  # chat
+            result = await service.send_chat_message(
+                chat_id=data['chat_id'],
+                message=data['message'],
+                user=request.user
+            )
+
+        return api_response({
+            'status': 'success',
+            'message': 'Teams消息发送成功',
+            'data': result
+        })
+
+    except Exception as e:
+        return exception_response(e)
+
+
+@async_api_view(['POST'])
+async def send_email(request):
+    """发送邮件"""
+    serializer = SendEmailSerializer(data=request.data)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+
+    data = serializer.validated_data
+
+    try:
+        service = await AsyncOutlookService.create(token_id=data.get('token_id'))
+
+        result = await service.send_email(
+            to_recipients=data['to_recipients'],
+            subject=data['subject'],
+            body=data['body'],
+            cc_recipients=data.get('cc_recipients'),
+            is_html=data.get('is_html', True),
+            user=request.user
+        )
+
+        return api_response({
+            'status': 'success',
+            'message': '邮件发送成功',
+            'data': result
+        })
+
+    except Exception as e:
+        return exception_response(e)
+
+
+@async_api_view(['POST'])
+async def sharepoint_operation(request):
+    """SharePoint操作"""
+    serializer = SharePointOperationSerializer(data=request.data)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+
+    data = serializer.validated_data
+
+    try:
+        service = await AsyncSharePointService.create(token_id=data.get('token_id'))
+
+        operation = data['operation']
+        site_id = data['site_id']
+
+        if operation == 'get_site':
+            result = await service.get_site(site_id, user=request.user)
+        elif operation == 'list_lists':
+            result = await service.list_site_lists(site_id, user=request.user)
+        elif operation == 'get_items':
+            list_id = data.get('list_id')
+            if not list_id:
+                raise ValueError("获取列表项需要提供list_id")
+            result = await service.get_list_items(site_id, list_id, user=request.user)
+        else:
+            raise ValueError(f"不支持的操作: {operation}")
+
+        return api_response({
+            'status': 'success',
+            'message': 'SharePoint操作成功',
+            'data': result
+        })
+
+    except Exception as e:
+        return exception_response(e)
+
+
+@async_api_view(['GET'])
+async def list_teams(request):
+    """列出Teams团队"""
+    try:
+        service = await AsyncTeamsService.create(token_id=request.data.get('token_id'))
+        result = await service.list_teams(user=request.user)
+
+        return api_response({
+            'status': 'success',
+            'data': result
+        })
+
+    except Exception as e:
+        return exception_response(e)
+
+
+@async_api_view(['GET'])
+async def list_emails(request):
+    """列出邮件"""
+    folder = request.data.get('folder', 'inbox')
+
+    try:
+        top = int(request.data.get('top', 10))
+        service = await AsyncOutlookService.create(token_id=request.data.get('token_id'))
+        result = await service.list_messages(folder=folder, top=top, user=request.user)
+
+        return api_response({
+            'status': 'success',
+            'data': result
+        })
+
+    except Exception as e:
+        return exception_response(e)
+
+
+@async_api_view(['POST'])
+@long_running
+async def export_items(request):
+    """流式导出Graph列表的所有数据（NDJSON/CSV）"""
+    serializer = GraphExportSerializer(data=request.data)
+    if not serializer.is_valid():
+        return api_response(serializer.errors, status=400)
+
+    data = serializer.validated_data
+
+    try:
+        service_class, method_name, arg_names = EXPORT_SOURCES[data['source']]
+        service = await service_class.create(token_id=data.get('token_id'))
+
+        items = getattr(service, method_name)(
+            *[data[name] for name in arg_names],
+            page_size=data.get('page_size'),
+            prefetch=data['prefetch'],
+            user=request.user
+        )
+        # 先读取第一页，请求失败时仍可返回400
+        try:
+            first = [await items.__anext__()]
+        except StopAsyncIteration:
+            first = []
+
+    except Exception as e:
+        return exception_response(e)
+
+    async def all_items():
+        for item in first:
+            yield item
+        async for item in items:
+            yield item
+
+    return streaming_export(all_items(), export_format=data['format'], filename=f"graph_{data['source']}")
@@ -0,0 +1,266 @@
+"""
+Microsoft Graph JSON批量请求（$batch）
+在批量上下文中调用服务方法只登记请求，退出上下文时按每批最多20个子请求合并发送，
+响应按子请求ID拆分回各自的调用方，并分别记录 APIUsageLog。
+子请求各自没有响应时间（日志中为空，不计入响应时间统计）；被限流的子请求按 Retry-After 等待后重新发送
+"""
+import json
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from requests.structures import CaseInsensitiveDict
+
+# 需要重新发送的子请求状态码：429的请求没有执行，写操作也可以重发；503按重试策略判断
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class GraphBatchError(Exception):
+    """批量请求中单个子请求失败"""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        super().__init__(f"子请求失败 ({status_code}): {body}")
+
+
+class BatchResult:
+    """批量请求中单个子请求的结果占位，批量提交后通过 result() 取值"""
+
+    def __init__(self, request_id):
+        self.id = request_id
+        self.done = False
+        self.status_code = None
+        self._value = None
+        self._error = None
+
+    def set_result(self, status_code, value):
+        self.done = True
+        self.status_code = status_code
+        self._value = value
+
+    def set_error(self, error, status_code=None):
+        self.done = True
+        self.status_code = status_code
+        self._error = error
+
+    def result(self):
+        """返回子请求的响应数据，子请求失败时抛出异常"""
+        if not self.done:
+            raise RuntimeError("批量请求尚未提交")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class BatchSubResponse:
+    """把$batch中的单个响应包装成与requests响应相同的接口，供日志方法使用"""
+
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.text = json.dumps(body, ensure_ascii=False) if body is not None else ''
+        self.content = self.text.encode()
+
+    def json(self):
+        return self.body
+
+
+class GraphBatch:
+    """
+    Graph批量请求
+    用法：
+        with GraphBatch(teams_service, outlook_service) as batch:
+            first = teams_service.send_channel_message(...)
+            with batch.after(first):
+                second = outlook_service.send_email(...)
+        first.result(), second.result()
+    """
+
+    MAX_REQUESTS = 20
+
+    def __init__(self, service, *services):
+        """
+        :param service: 负责发送$batch请求的服务实例（使用其Token）
+        :param services: 其他加入同一批量的服务实例
+        """
+        self.service = service
+        self.services = (service,) + services
+        self.items = []
+        self._depends_on = ()
+
+    def __enter__(self):
+        for service in self.services:
+            service._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for service in self.services:
+            service._batch = None
+        if exc_type is None:
+            self.execute()
+        return False
+
+    @contextmanager
+    def after(self, *results):
+        """在此上下文中登记的请求依赖给定请求（dependsOn），依赖失败时不会执行"""
+        previous = self._depends_on
+        self._depends_on = previous + tuple(results)
+        try:
+            yield
+        finally:
+            self._depends_on = previous
+
+    def add(self, method, endpoint, data=None, params=None, log_endpoint=None, user=None, depends_on=(),
+            retry=None):
+        """
+        登记子请求
+        :param retry: 返回503时是否重新发送，None时只重发幂等请求（429总是重新发送）
+        :return: BatchResult
+        """
+        retry_state = self.service.retry_policy.begin(method, retry=True)
+        result = BatchResult(str(len(self.items) + 1))
+        url = '/' + endpoint.lstrip('/')
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        self.items.append({
+            'result': result,
+            'method': method,
+            'url': url,
+            'data': data,
+            'log_endpoint': log_endpoint,
+            'user': user,
+            'depends_on': [r for r in tuple(depends_on) + self._depends_on if not r.done],
+            'retry_state': retry_state,
+            'attempts': iter(retry_state),
+            'retry_unavailable': self.service.retry_policy.allows(method, retry),
+        })
+        return result
+
+    def _groups(self):
+        """按dependsOn把子请求分组，有依赖关系的请求必须在同一批中"""
+        parent = {item['result'].id: item['result'].id for item in self.items}
+
+        def find(request_id):
+            while parent[request_id] != request_id:
+                parent[request_id] = parent[parent[request_id]]
+                request_id = parent[request_id]
+            return request_id
+
+        for item in self.items:
+            for dependency in item['depends_on']:
+                if dependency.id in parent:
+                    parent[find(item['result'].id)] = find(dependency.id)
+
+        groups = {}
+        for item in self.items:
+            groups.setdefault(find(item['result'].id), []).append(item)
+        return list(groups.values())
+
+    def chunks(self):
+        """把子请求打包成每批不超过MAX_REQUESTS个的批次"""
+        chunks = []
+        current = []
+        for group in self._groups():
+            if len(group) > self.MAX_REQUESTS:
+                raise ValueError(f"相互依赖的子请求超过{self.MAX_REQUESTS}个，无法放入同一批量请求")
+            if len(current) + len(group) > self.MAX_REQUESTS:
+                chunks.append(current)
+                current = []
+            current.extend(group)
+        if current:
+            chunks.append(current)
+        # 批内保持登记顺序
+        return [sorted(chunk, key=lambda item: int(item['result'].id)) for chunk in chunks]
+
+    def execute(self):
+        """发送所有登记的子请求"""
+        for chunk in self.chunks():
+            while chunk:
+                chunk = self._execute_chunk(chunk)
+        self.items = []
+
+    def _execute_chunk(self, chunk):
+        """
+        发送一批子请求
+        :return: 需要重新发送的子请求（已按 Retry-After 等待）
+        """
+        sub_requests = []
+        for item in chunk:
+            next(item['attempts'])
+            request = {
+                'id': item['result'].id,
+                'method': item['method'],
+                'url': item['url'],
+            }
+            if item['data'] is not None:
+                request['body'] = item['data']
+                request['headers'] = {'Content-Type': 'application/json'}
+            depends_on = [r.id for r in item['depends_on'] if not r.done]
+            if depends_on:
+                request['dependsOn'] = depends_on
+            sub_requests.append(request)
+
+        try:
+            payload = self.service.make_request('POST', '$batch', data={'requests': sub_requests})
+        except Exception as e:
+            for item in chunk:
+                item['result'].set_error(e)
+                self._log_error(item, e)
+            return []
+
+        responses = {r['id']: r for r in (payload or {}).get('responses', [])}
+        retries = []
+        delays = []
+        for item in chunk:
+            result = item['result']
+            sub = responses.get(result.id)
+            if sub is None:
+                result.set_error(Exception("批量响应中缺少该子请求的结果"))
+                continue
+
+            response = BatchSubResponse(sub.get('status'), sub.get('body'), sub.get('headers'))
+            # $batch的往返时间属于整批请求，子请求的响应时间记为空，不计入响应时间直方图
+            state = item['retry_state']
+            self.service.log_response(item['log_endpoint'], item['method'], self._full_url(item),
+                                      item['data'], response, None, item['user'], state.request_id, state.attempt)
+            self.service.throttled(response)
+
+            delay = self._retry_delay(item, response, retries)
+            if delay is not None:
+                retries.append(item)
+                delays.append(delay)
+            elif response.status_code < 400:
+                result.set_result(response.status_code, response.body)
+            else:
+                result.set_error(GraphBatchError(response.status_code, response.body), response.status_code)
+
+        if retries:
+            time.sleep(max(delays))
+        return retries
+
+    def _retry_delay(self, item, response, retries):
+        """
+        判断子请求是否需要重新发送
+        :param retries: 本批中已决定重新发送的子请求（依赖它们而返回424的子请求随之重发）
+        :return: 重新发送前需要等待的秒数，不需要重新发送时返回None
+        """
+        if response.status_code == 424:
+            retrying = {r['result'] for r in retries}
+            if any(dependency in retrying for dependency in item['depends_on']):
+                return 0
+            return None
+        if response.status_code not in THROTTLED_STATUS_CODES:
+            return None
+        if response.status_code != 429 and not item['retry_unavailable']:
+            return None
+        return item['retry_state'].delay_for(response=response)
+
+    def _log_error(self, item, error):
+        state = item['retry_state']
+        self.service.log_error(item['log_endpoint'], item['method'], self._full_url(item),
+                               item['data'], error, item['user'], state.request_id, state.attempt)
+
+    def _full_url(self, item):
+        return f"{self.service.BASE_URL}{item['url']}"
@@ -0,0 +1,65 @@
+"""
+按保留期清理调用日志（API使用日志和Kintone请求日志）、不再被日志引用的请求体/响应体和过期的汇总
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from automationapi.bodystore import body_stores
+from automationapi.partitions import partitioned_tables
+from automationapi.rollups import rollup_tables
+
+
+class Command(BaseCommand):
+    help = '删除超过保留期的日志分区（整表删除），并提前创建当前和下一周期的分区'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='保留天数，默认读取 LOG_RETENTION_DAYS，0表示不清理')
+        parser.add_argument('--dry-run', action='store_true', help='只列出将要删除的分区和行数')
+        parser.add_argument('--sync-schema', action='store_true', help='把日志模型的字段变更同步到已有的分区表')
+    
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.LOG_RETENTION_DAYS
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(days=days) if days > 0 else None
+        
+        for table in partitioned_tables():
+            label = table.model._meta.verbose_name
+            
+            if options['sync_schema'] and not dry_run:
+                for sql in table.sync_schema():
+                    self.stdout.write(sql)
+            
+            if not dry_run:
+                for partition in table.ensure_upcoming():
+                    self.stdout.write(f'{label}: 分区 {partition.name} 已就绪')
+            
+            if cutoff is None:
+                continue
+            
+            dropped = table.drop_before(cutoff, dry_run=dry_run)
+            rows = table.prune_default(cutoff, dry_run=dry_run)
+            names = '、'.join(partition.name for partition in dropped) or '无'
+            verb = '将删除' if dry_run else '已删除'
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: {verb}分区 {names}，默认分区{verb} {rows} 条 {cutoff:%Y-%m-%d} 之前的日志'
+            ))
+        
+        # 汇总有各自的保留期（ROLLUP_*_RETENTION_DAYS）
+        for rollup in rollup_tables():
+            rows = rollup.prune(dry_run=dry_run)
+            verb = '将删除' if dry_run else '已删除'
+            self.stdout.write(self.style.SUCCESS(f'{rollup.model._meta.verbose_name}: {verb} {rows} 行过期的汇总'))
+        
+        if cutoff is None:
+            return
+        
+        # 日志删除后，最早的日志之前就没有再被引用过的内容可以删除
+        for store in body_stores():
+            rows = store.collect_garbage(dry_run=dry_run)
+            verb = '将删除' if dry_run else '已删除'
+            self.stdout.write(self.style.SUCCESS(
+                f'{store.model._meta.verbose_name}: {verb} {rows} 份不再被引用的内容'
+            ))
@@ -0,0 +1,24 @@
+"""
+从原始日志重新计算调用汇总（API使用日志和Kintone请求日志）
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from automationapi.rollups import rollup_tables
+
+
+class Command(BaseCommand):
+    help = '从原始日志重新计算最近若干天的分钟和小时汇总（启用汇总前的日志或汇总写入失败后使用）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='重新计算的天数（从此前的整点开始）')
+    
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        for rollup in rollup_tables():
+            rows = rollup.rebuild(since)
+            self.stdout.write(self.style.SUCCESS(
+                f'{rollup.model._meta.verbose_name}: 已写入 {rows} 行 {since:%Y-%m-%d %H:00} 之后的汇总'
+            ))
@@ -0,0 +1,52 @@
+"""
+后台提前续期访问令牌
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from microsoft_api.tokens import TokenRefresher
+
+
+class Command(BaseCommand):
+    help = '在访问令牌过期前主动续期所有活跃的API Token（常驻运行）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='只检查一轮后退出')
+        parser.add_argument('--margin', type=int, default=None, help='提前续期的秒数')
+        parser.add_argument('--jitter', type=int, default=None, help='续期时间的随机抖动上限（秒）')
+        parser.add_argument('--max-sleep', type=int, default=60, help='两轮检查之间的最长等待秒数')
+    
+    def handle(self, *args, **options):
+        refresher = TokenRefresher(margin=options['margin'], jitter=options['jitter'])
+        
+        self.stdout.write(
+            f'令牌续期已启动：提前 {refresher.margin} 秒，抖动 {refresher.jitter} 秒'
+        )
+        
+        try:
+            while True:
+                results, wait = refresher.run_once()
+                
+                for result in results:
+                    if result['ok']:
+                        self.stdout.write(self.style.SUCCESS(
+                            f"✓ 续期成功: {result['token'].name} 耗时 {result['latency']:.3f}s"
+                        ))
+                    else:
+                        self.stdout.write(self.style.ERROR(
+                            f"✗ 续期失败: {result['token'].name} 耗时 {result['latency']:.3f}s - {result['error']}"
+                        ))
+                
+                if options['once']:
+                    break
+                
+                time.sleep(min(wait if wait is not None else options['max_sleep'], options['max_sleep']))
+        except KeyboardInterrupt:
+            pass
+        
+        stats = refresher.stats
+        self.stdout.write(
+            f"\n共续期 {stats['refreshed']} 次，失败 {stats['failed']} 次，"
+            f"最大耗时 {stats['max_latency']:.3f}s"
+        )
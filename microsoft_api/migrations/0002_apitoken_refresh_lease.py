@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apitoken',
+            name='refresh_lease_until',
+            field=models.DateTimeField(blank=True, help_text='持有租约的进程负责刷新令牌，避免多进程同时刷新', null=True, verbose_name='刷新租约到期时间'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0003_usage_log_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiendpoint',
+            name='connect_timeout',
+            field=models.FloatField(blank=True, help_text='为空时使用 GRAPH_CONNECT_TIMEOUT', null=True, verbose_name='连接超时(秒)'),
+        ),
+        migrations.AddField(
+            model_name='apiendpoint',
+            name='read_timeout',
+            field=models.FloatField(blank=True, help_text='为空时使用 GRAPH_READ_TIMEOUT', null=True, verbose_name='读取超时(秒)'),
+        ),
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='timeout_phase',
+            field=models.CharField(blank=True, choices=[('connect', '连接'), ('read', '读取'), ('write', '发送'), ('pool', '等待连接池'), ('deadline', '超过截止时间')], max_length=10, null=True, verbose_name='超时阶段'),
+        ),
+    ]
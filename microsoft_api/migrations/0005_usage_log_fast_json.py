@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:25
+
+import automationapi.fastjson
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0004_timeouts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apiusagelog',
+            name='request_headers',
+            field=models.JSONField(blank=True, encoder=automationapi.fastjson.FastJSONEncoder, null=True, verbose_name='请求头'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0006_usage_log_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APILogBody',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256摘要')),
+                ('codec', models.CharField(max_length=8, verbose_name='压缩方式')),
+                ('data', models.BinaryField(verbose_name='内容')),
+                ('size', models.PositiveIntegerField(help_text='压缩前（截断后）的大小', verbose_name='大小(字节)')),
+                ('truncated', models.BooleanField(default=False, verbose_name='是否截断')),
+                ('last_used', models.DateField(db_index=True, verbose_name='最后引用日期')),
+            ],
+            options={
+                'verbose_name': 'API日志内容',
+                'verbose_name_plural': 'API日志内容',
+            },
+        ),
+        migrations.AddField(
+            model_name='apiendpoint',
+            name='log_body_max_size',
+            field=models.PositiveIntegerField(blank=True, help_text='请求体/响应体最多记录的字节数，为空时使用 LOG_BODY_MAX_SIZE，0表示不记录', null=True, verbose_name='日志内容上限(字节)'),
+        ),
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='request_body_digest',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='请求体摘要'),
+        ),
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='response_body_digest',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='响应体摘要'),
+        ),
+        migrations.AlterField(
+            model_name='apiusagelog',
+            name='request_body',
+            field=models.TextField(blank=True, help_text='旧日志，新日志保存在内容存储中', null=True, verbose_name='请求体'),
+        ),
+        migrations.AlterField(
+            model_name='apiusagelog',
+            name='response_body',
+            field=models.TextField(blank=True, help_text='旧日志，新日志保存在内容存储中', null=True, verbose_name='响应体'),
+        ),
+    ]
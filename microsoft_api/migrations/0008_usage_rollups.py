@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0007_usage_log_bodies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grain', models.CharField(choices=[('minute', '分钟'), ('hour', '小时')], max_length=6, verbose_name='粒度')),
+                ('bucket', models.DateTimeField(help_text='时间桶的起始时间（UTC）', verbose_name='时间桶')),
+                ('status', models.CharField(max_length=20, verbose_name='状态')),
+                ('count', models.PositiveBigIntegerField(default=0, verbose_name='调用次数')),
+                ('response_time_sum', models.FloatField(default=0, verbose_name='响应时间合计(秒)')),
+                ('response_time_count', models.PositiveBigIntegerField(default=0, verbose_name='有响应时间的调用次数')),
+                ('service', models.CharField(max_length=50, verbose_name='服务类型')),
+                ('endpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='microsoft_api.apiendpoint', verbose_name='API端点')),
+            ],
+            options={
+                'verbose_name': 'API使用汇总',
+                'verbose_name_plural': 'API使用汇总',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='apiusagerollup',
+            constraint=models.UniqueConstraint(fields=('grain', 'bucket', 'endpoint', 'service', 'status'), name='apiusagerollup_unique_bucket'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0008_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiusagerollup',
+            name='latency_histogram',
+            field=models.JSONField(default=dict, help_text='{桶序号: 次数}', verbose_name='响应时间直方图'),
+        ),
+        migrations.AddField(
+            model_name='apiusagerollup',
+            name='response_time_max',
+            field=models.FloatField(blank=True, null=True, verbose_name='最长响应时间(秒)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microsoft_api', '0009_usage_rollup_latency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apiusagelog',
+            name='request_path',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='URL的路径部分，Admin按前缀搜索', max_length=255, verbose_name='请求路径'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from automationapi.bodystore import BodyStore, LogBody
+from automationapi.counters import BufferedCounter
+from automationapi.fastjson import FastJSONEncoder
+from automationapi.partitions import PartitionedTable
+from automationapi.rollups import RollupTable, UsageRollup
 
 
 class APIToken(models.Model):
@@ -14,6 +19,8 @@ class APIToken(models.Model):
     # 访问令牌缓存
     access_token = models.TextField(blank=True, null=True, verbose_name='Access Token')
     token_expires_at = models.DateTimeField(blank=True, null=True, verbose_name='Token过期时间')
+    refresh_lease_until = models.DateTimeField(blank=True, null=True, verbose_name='刷新租约到期时间',
+                                               help_text='持有租约的进程负责刷新令牌，避免多进程同时刷新')
     
     # 配置信息
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
@@ -63,6 +70,12 @@ class APIEndpoint(models.Model):
     
     # 配置
     requires_body = models.BooleanField(default=False, verbose_name='需要请求体')
+    connect_timeout = models.FloatField(blank=True, null=True, verbose_name='连接超时(秒)',
+                                        help_text='为空时使用 GRAPH_CONNECT_TIMEOUT')
+    read_timeout = models.FloatField(blank=True, null=True, verbose_name='读取超时(秒)',
+                                     help_text='为空时使用 GRAPH_READ_TIMEOUT')
+    log_body_max_size = models.PositiveIntegerField(blank=True, null=True, verbose_name='日志内容上限(字节)',
+                                                    help_text='请求体/响应体最多记录的字节数，为空时使用 LOG_BODY_MAX_SIZE，0表示不记录')
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
     
     # 统计
@@ -79,6 +92,20 @@ class APIEndpoint(models.Model):
     
     def __str__(self):
         return f"{self.get_service_display()} - {self.name}"
+    
+    @property
+    def current_total_calls(self):
+        """总调用次数（包含本进程尚未写入数据库的增量）"""
+        return endpoint_call_counter.current(self)[0]
+    
+    @property
+    def current_last_called(self):
+        """最后调用时间（包含本进程尚未写入数据库的调用）"""
+        return endpoint_call_counter.current(self)[1]
+
+
+# 端点调用统计的计数器（见 automationapi/counters.py）
+endpoint_call_counter = BufferedCounter(APIEndpoint, 'total_calls', 'last_called')
 
 
 class APIUsageLog(models.Model):
@@ -90,6 +117,14 @@ class APIUsageLog(models.Model):
         ('error', '错误'),
     ]
     
+    TIMEOUT_PHASE_CHOICES = [
+        ('connect', '连接'),
+        ('read', '读取'),
+        ('write', '发送'),
+        ('pool', '等待连接池'),
+        ('deadline', '超过截止时间'),
+    ]
+    
     endpoint = models.ForeignKey(APIEndpoint, on_delete=models.CASCADE, related_name='usage_logs', 
                                 verbose_name='API端点')
     token = models.ForeignKey(APIToken, on_delete=models.SET_NULL, null=True, blank=True, 
@@ -98,21 +133,34 @@ class APIUsageLog(models.Model):
     # 请求信息
     request_method = models.CharField(max_length=10, verbose_name='请求方法')
     request_url = models.TextField(verbose_name='请求URL')
-    request_body = models.TextField(blank=True, null=True, verbose_name='请求体')
-    request_headers = models.JSONField(blank=True, null=True, verbose_name='请求头')
+    request_path = models.CharField(max_length=255, blank=True, default='', db_index=True, verbose_name='请求路径',
+                                    help_text='URL的路径部分，Admin按前缀搜索')
+    request_body = models.TextField(blank=True, null=True, verbose_name='请求体', help_text='旧日志，新日志保存在内容存储中')
+    request_body_digest = models.CharField(max_length=64, blank=True, null=True, verbose_name='请求体摘要')
+    request_headers = models.JSONField(blank=True, null=True, encoder=FastJSONEncoder, verbose_name='请求头')
     
     # 响应信息
     status_code = models.IntegerField(blank=True, null=True, verbose_name='状态码')
-    response_body = models.TextField(blank=True, null=True, verbose_name='响应体')
+    response_body = models.TextField(blank=True, null=True, verbose_name='响应体', help_text='旧日志，新日志保存在内容存储中')
+    response_body_digest = models.CharField(max_length=64, blank=True, null=True, verbose_name='响应体摘要')
     response_time = models.FloatField(blank=True, null=True, verbose_name='响应时间(秒)')
     
     # 状态
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name='状态')
     error_message = models.TextField(blank=True, null=True, verbose_name='错误信息')
     
+    # 重试（同一次调用的各次尝试共享request_id）
+    request_id = models.CharField(max_length=32, blank=True, null=True, db_index=True, verbose_name='调用ID')
+    attempt = models.PositiveSmallIntegerField(default=1, verbose_name='尝试次数')
+    
+    # 超时（发生在哪个阶段）
+    timeout_phase = models.CharField(max_length=10, choices=TIMEOUT_PHASE_CHOICES, blank=True, null=True,
+                                     verbose_name='超时阶段')
+    
     # 用户和时间
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='调用用户')
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='调用时间', db_index=True)
+    # 日志可能缓冲后批量写入，调用时间在创建实例时确定
+    created_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='调用时间', db_index=True)
     
     class Meta:
         verbose_name = 'API使用日志'
@@ -128,6 +176,45 @@ class APIUsageLog(models.Model):
         return f"{self.endpoint.name} - {self.status} ({self.created_at.strftime('%Y-%m-%d %H:%M:%S')})"
 
 
+# 使用日志按时间分区存储，原表作为默认分区（见 automationapi/partitions.py）
+usage_log_partitions = PartitionedTable(APIUsageLog)
+
+
+class APILogBody(LogBody):
+    """API使用日志的请求体/响应体（压缩后按摘要去重保存）"""
+    
+    class Meta:
+        verbose_name = 'API日志内容'
+        verbose_name_plural = 'API日志内容'
+
+
+# 日志行只保存摘要，内容压缩去重后保存在 APILogBody（见 automationapi/bodystore.py）
+usage_log_bodies = BodyStore(APILogBody, partitions=usage_log_partitions)
+
+
+class APIUsageRollup(UsageRollup):
+    """API使用日志按分钟/小时、端点和状态的汇总"""
+    
+    endpoint = models.ForeignKey(APIEndpoint, on_delete=models.CASCADE, related_name='usage_rollups',
+                                 verbose_name='API端点')
+    service = models.CharField(max_length=50, verbose_name='服务类型')
+    
+    class Meta:
+        verbose_name = 'API使用汇总'
+        verbose_name_plural = 'API使用汇总'
+        constraints = [
+            models.UniqueConstraint(fields=['grain', 'bucket', 'endpoint', 'service', 'status'],
+                                    name='apiusagerollup_unique_bucket'),
+        ]
+
+
+# 统计接口读取的预聚合汇总，由日志写入器更新（见 automationapi/rollups.py）
+usage_rollups = RollupTable(APIUsageRollup, usage_log_partitions, {
+    'endpoint_id': 'endpoint_id',
+    'service': 'endpoint__service',
+})
+
+
 class TeamsMessage(models.Model):
     """Teams消息模板"""
     
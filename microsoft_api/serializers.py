@@ -2,7 +2,7 @@
 REST API序列化器
 """
 from rest_framework import serializers
-from .models import APIToken, APIEndpoint, APIUsageLog, TeamsMessage, EmailTemplate
+from .models import APIToken, APIEndpoint, APIUsageLog, TeamsMessage, EmailTemplate, usage_log_bodies
 
 
 class APITokenSerializer(serializers.ModelSerializer):
@@ -42,15 +42,16 @@ class APIEndpointSerializer(serializers.ModelSerializer):
     """API端点序列化器"""
     
     service_display = serializers.CharField(source='get_service_display', read_only=True)
+    total_calls = serializers.IntegerField(source='current_total_calls', read_only=True)
+    last_called = serializers.DateTimeField(source='current_last_called', read_only=True)
     
     class Meta:
         model = APIEndpoint
         fields = [
             'id', 'name', 'service', 'service_display', 'endpoint_url',
-            'http_method', 'description', 'requires_body', 'is_active',
-            'total_calls', 'last_called', 'created_at', 'updated_at'
+            'http_method', 'description', 'requires_body', 'connect_timeout', 'read_timeout', 'is_active',
+            'log_body_max_size', 'total_calls', 'last_called', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['total_calls', 'last_called']
 
 
 class APIUsageLogSerializer(serializers.ModelSerializer):
@@ -67,7 +68,7 @@ class APIUsageLogSerializer(serializers.ModelSerializer):
             'id', 'endpoint', 'endpoint_name', 'token', 'token_name',
             'request_method', 'request_url', 'status_code',
             'response_time', 'status', 'status_display', 'error_message',
-            'user', 'username', 'created_at'
+            'timeout_phase', 'request_id', 'attempt', 'user', 'username', 'created_at'
         ]
 
 
@@ -78,9 +79,34 @@ class APIUsageLogDetailSerializer(serializers.ModelSerializer):
     token_name = serializers.CharField(source='token.name', read_only=True)
     username = serializers.CharField(source='user.username', read_only=True)
     
+    # 内容按摘要保存在内容存储中，序列化时才取出并解压；旧日志直接保存在日志行中
+    request_body = serializers.SerializerMethodField()
+    response_body = serializers.SerializerMethodField()
+    
     class Meta:
         model = APIUsageLog
         fields = '__all__'
+    
+    def get_request_body(self, obj):
+        return usage_log_bodies.get(obj.request_body_digest) if obj.request_body_digest else obj.request_body
+    
+    def get_response_body(self, obj):
+        return usage_log_bodies.get(obj.response_body_digest) if obj.response_body_digest else obj.response_body
+
+
+class APIUsageLogExportSerializer(serializers.Serializer):
+    """流式导出API使用日志（过滤参数与日志列表相同）"""
+    
+    FORMAT_CHOICES = [
+        ('ndjson', 'NDJSON'),
+        ('csv', 'CSV'),
+        ('columnar', '列式NDJSON'),
+    ]
+    
+    # 查询参数 format 被DRF用于选择渲染器，因此使用 export_format
+    export_format = serializers.ChoiceField(choices=FORMAT_CHOICES, default='ndjson', help_text='导出格式')
+    chunk_size = serializers.IntegerField(default=2000, min_value=100, max_value=10000,
+                                          help_text='每次从数据库读取的行数，列式格式每行的记录数')
 
 
 class TeamsMessageSerializer(serializers.ModelSerializer):
@@ -158,3 +184,74 @@ class SharePointOperationSerializer(serializers.Serializer):
     site_id = serializers.CharField(help_text='站点ID')
     list_id = serializers.CharField(required=False, help_text='列表ID（获取列表项时必需）')
 
+
+
+class GraphExportSerializer(serializers.Serializer):
+    """流式导出Graph列表（自动跟随 @odata.nextLink）"""
+    
+    SOURCE_CHOICES = [
+        ('teams', 'Teams团队'),
+        ('messages', '邮件'),
+        ('site_lists', 'SharePoint列表'),
+        ('list_items', 'SharePoint列表项'),
+    ]
+    
+    FORMAT_CHOICES = [
+        ('ndjson', 'NDJSON'),
+        ('csv', 'CSV'),
+    ]
+    
+    token_id = serializers.IntegerField(required=False, help_text='API Token ID，不提供则使用默认')
+    source = serializers.ChoiceField(choices=SOURCE_CHOICES, help_text='数据源')
+    folder = serializers.CharField(default='inbox', help_text='邮件文件夹（messages时使用）')
+    site_id = serializers.CharField(required=False, help_text='站点ID（site_lists、list_items时必需）')
+    list_id = serializers.CharField(required=False, help_text='列表ID（list_items时必需）')
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=999, help_text='每页数量')
+    prefetch = serializers.BooleanField(default=True, help_text='是否在输出当前页时预取下一页')
+    format = serializers.ChoiceField(choices=FORMAT_CHOICES, default='ndjson', help_text='导出格式')
+    
+    def validate(self, data):
+        if data['source'] in ('site_lists', 'list_items') and not data.get('site_id'):
+            raise serializers.ValidationError("SharePoint数据源需要提供site_id")
+        if data['source'] == 'list_items' and not data.get('list_id'):
+            raise serializers.ValidationError("导出列表项需要提供list_id")
+        return data
+
+
+class GraphBatchOperationSerializer(serializers.Serializer):
+    """批量请求中的单个操作"""
+    
+    OPERATION_CHOICES = [
+        ('send_channel_message', '发送频道消息'),
+        ('send_chat_message', '发送聊天消息'),
+        ('list_teams', '列出团队'),
+        ('send_email', '发送邮件'),
+        ('list_messages', '列出邮件'),
+        ('get_site', '获取站点'),
+        ('list_site_lists', '列出列表'),
+        ('get_list_items', '获取列表项'),
+    ]
+    
+    operation = serializers.ChoiceField(choices=OPERATION_CHOICES)
+    params = serializers.DictField(default=dict, help_text='传给服务方法的参数')
+    depends_on = serializers.ListField(
+        child=serializers.IntegerField(min_value=0),
+        required=False,
+        default=list,
+        help_text='依赖的操作序号（从0开始），依赖失败时本操作不执行'
+    )
+
+
+class GraphBatchSerializer(serializers.Serializer):
+    """Graph批量请求"""
+    
+    token_id = serializers.IntegerField(required=False, help_text='API Token ID，不提供则使用默认')
+    operations = GraphBatchOperationSerializer(many=True)
+    
+    def validate_operations(self, operations):
+        if not operations:
+            raise serializers.ValidationError("至少需要一个操作")
+        for index, operation in enumerate(operations):
+            if any(i >= index for i in operation['depends_on']):
+                raise serializers.ValidationError(f"操作 {index} 只能依赖排在它之前的操作")
+        return operations
@@ -2,37 +2,115 @@
 微软API服务类
 处理与Microsoft Graph API的交互
 """
-import requests
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
+from django.conf import settings
+from django.db import connection as db_connection
 from django.utils import timezone
-from .models import APIToken, APIUsageLog
+from automationapi.circuit import CircuitGuard, circuit_breakers
+from automationapi.deadline import DeadlineExceeded, check_deadline, request_timeout, timeout_phase
+from automationapi.fastjson import response_json
+from automationapi.http import SessionPool, url_path
+from automationapi.logbuffer import BufferedLogWriter
+from automationapi.ratelimit import RateLimitedMixin
+from automationapi.retry import RetryPolicy
+from .models import (
+    APIToken, APIEndpoint, APIUsageLog, endpoint_call_counter, usage_log_bodies, usage_log_partitions,
+    usage_rollups,
+)
+from .tokens import token_cache
+from .batch import GraphBatch
 
 
-class MicrosoftGraphService:
+# 所有Graph服务共享的连接池（按主机区分graph.microsoft.com和login.microsoftonline.com）
+graph_session_pool = SessionPool('microsoft_graph')
+
+# 调用日志的缓冲写入器（见 automationapi/logbuffer.py），写入后累加到汇总表
+usage_log_writer = BufferedLogWriter(
+    APIUsageLog, storage=usage_log_partitions, after_write=[usage_rollups.add]
+)
+
+
+class MicrosoftGraphService(RateLimitedMixin):
     """Microsoft Graph API基础服务类"""
     
     BASE_URL = "https://graph.microsoft.com/v1.0"
     AUTH_URL = "https://login.microsoftonline.com"
     
+    session_pool = graph_session_pool
+    
+    # 429/503/504及网络错误的重试策略（Graph限流时返回Retry-After）
+    retry_policy = RetryPolicy()
+    
+    # 按租户限流（所有worker共享）
+    RATE_LIMIT_PREFIX = 'graph'
+    RATE_LIMIT_SETTINGS = ('GRAPH_RATE_LIMIT', 'GRAPH_RATE_BURST')
+    
+    # 当前所在的批量请求（见 batch()），为None时直接发送请求
+    _batch = None
+    
     def __init__(self, token_id=None):
         """
         初始化服务
         :param token_id: APIToken的ID，如果为None则使用第一个活跃的token
         """
+        self.api_token = self.load_token(token_id)
+    
+    @staticmethod
+    def load_token(token_id=None):
+        """加载APIToken，如果token_id为None则使用第一个活跃的token"""
         if token_id:
-            self.api_token = APIToken.objects.get(id=token_id, is_active=True)
+            api_token = APIToken.objects.get(id=token_id, is_active=True)
         else:
-            self.api_token = APIToken.objects.filter(is_active=True).first()
+            api_token = APIToken.objects.filter(is_active=True).first()
             
-        if not self.api_token:
+        if not api_token:
             raise ValueError("没有可用的API Token")
+        return api_token
+    
+    def rate_limit_scope(self):
+        """Graph按租户限流"""
+        return self.api_token.tenant_id
+    
+    def circuit_guard(self, log_endpoint=None):
+        """
+        按端点熔断，未配置端点的请求按租户熔断
+        :param log_endpoint: APIEndpoint对象
+        """
+        if log_endpoint is not None:
+            key = f"graph:endpoint:{log_endpoint.pk}"
+        else:
+            key = f"graph:tenant:{self.api_token.tenant_id}"
+        return CircuitGuard([circuit_breakers.get(key)])
+    
+    def get_timeout(self, log_endpoint=None):
+        """
+        出站请求的 (连接超时, 读取超时)，APIEndpoint上的配置优先，且不超过当前请求的剩余时间
+        :param log_endpoint: APIEndpoint对象
+        """
+        connect = getattr(settings, 'GRAPH_CONNECT_TIMEOUT', 5)
+        read = getattr(settings, 'GRAPH_READ_TIMEOUT', 30)
+        if log_endpoint is not None:
+            connect = log_endpoint.connect_timeout or connect
+            read = log_endpoint.read_timeout or read
+        return request_timeout(connect, read)
+    
+    def get_session(self, url):
+        """获取目标主机的复用Session"""
+        return self.session_pool.for_url(url)
     
     def get_access_token(self):
-        """获取访问令牌，如果过期则刷新"""
-        if self.api_token.is_token_valid():
-            return self.api_token.access_token
-        
-        # Token过期或不存在，重新获取
+        """获取访问令牌（优先使用进程内缓存，过期时单飞刷新）"""
+        return token_cache.get(self.api_token, self.fetch_access_token)
+    
+    def fetch_access_token(self):
+        """
+        向OAuth端点请求新的访问令牌
+        :return: (access_token, expires_at)
+        """
         token_url = f"{self.AUTH_URL}/{self.api_token.tenant_id}/oauth2/v2.0/token"
         
         data = {
@@ -42,19 +120,31 @@ class MicrosoftGraphService:
             'grant_type': 'client_credentials'
         }
         
-        response = requests.post(token_url, data=data)
+        response = self.get_session(token_url).post(token_url, data=data, timeout=self.get_timeout())
         
         if response.status_code == 200:
-            token_data = response.json()
-            self.api_token.access_token = token_data['access_token']
+            token_data = response_json(response)
             # 提前5分钟过期
             expires_in = token_data.get('expires_in', 3600) - 300
-            self.api_token.token_expires_at = timezone.now() + timedelta(seconds=expires_in)
-            self.api_token.save()
-            return self.api_token.access_token
+            return token_data['access_token'], timezone.now() + timedelta(seconds=expires_in)
         else:
             raise Exception(f"获取访问令牌失败: {response.text}")
     
+    def batch(self):
+        """
+        创建Graph批量请求上下文
+        上下文中的服务方法调用只登记请求并返回BatchResult，退出上下文时合并发送
+        """
+        return GraphBatch(self)
+    
+    def find_log_endpoint(self, service, keyword):
+        """查找用于记录日志的端点配置"""
+        return APIEndpoint.objects.filter(
+            service=service,
+            endpoint_url__icontains=keyword,
+            is_active=True
+        ).first()
+    
     def get_headers(self):
         """获取请求头"""
         return {
@@ -62,75 +152,186 @@ class MicrosoftGraphService:
             'Content-Type': 'application/json'
         }
     
-    def make_request(self, method, endpoint, data=None, params=None, log_endpoint=None, user=None):
+    def build_url(self, endpoint):
+        """构建请求URL，@odata.nextLink等完整URL原样使用"""
+        if endpoint.startswith('https://'):
+            return endpoint
+        return f"{self.BASE_URL}/{endpoint.lstrip('/')}"
+    
+    def make_request(self, method, endpoint, data=None, params=None, log_endpoint=None, user=None, retry=None,
+                     content=None, content_type=None):
         """
         发送API请求
         :param method: HTTP方法
-        :param endpoint: API端点路径
+        :param endpoint: API端点路径或完整URL
         :param data: 请求体数据
         :param params: URL参数
         :param log_endpoint: APIEndpoint对象，用于记录日志
         :param user: 调用用户
-        :return: 响应数据
+        :param retry: 是否重试，None时只重试幂等请求（见 retry_policy）
+        :param content: 原始请求体（如上传的文件内容），不记录到日志，不能放入批量请求
+        :param content_type: 原始请求体的Content-Type
+        :return: 响应数据；在批量请求上下文中返回BatchResult
+        :raises CircuitOpenError: 端点已熔断，请求没有发出
+        :raises DeadlineExceeded: 当前请求的时间预算已用完，请求没有发出
         """
-        url = f"{self.BASE_URL}/{endpoint.lstrip('/')}"
-        headers = self.get_headers()
+        if self._batch is not None and content is None:
+            return self._batch.add(method, endpoint, data=data, params=params,
+                                   log_endpoint=log_endpoint, user=user, retry=retry)
         
-        start_time = datetime.now()
+        url = self.build_url(endpoint)
+        retry_state = self.retry_policy.begin(method, retry)
+        guard = self.circuit_guard(log_endpoint)
         
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                params=params
-            )
+        for attempt in retry_state:
+            headers = self.get_headers()
+            if content_type:
+                headers['Content-Type'] = content_type
+            self.throttle()
+            try:
+                check_deadline()
+            except DeadlineExceeded as e:
+                self.log_error(log_endpoint, method, url, data, e, user, retry_state.request_id, attempt)
+                raise
+            guard.enter()
+            
+            start_time = datetime.now()
+            
+            try:
+                response = self.get_session(url).request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    json=data,
+                    data=content,
+                    params=params,
+                    timeout=self.get_timeout(log_endpoint)
+                )
+            except Exception as e:
+                guard.failure()
+                # 记录错误日志
+                self.log_error(log_endpoint, method, url, data, e, user, retry_state.request_id, attempt)
+                delay = retry_state.delay_for(error=e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
             
             end_time = datetime.now()
             response_time = (end_time - start_time).total_seconds()
+            guard.record(response.status_code)
             
             # 记录日志
-            if log_endpoint:
-                status = 'success' if response.status_code < 400 else 'failed'
-                
-                APIUsageLog.objects.create(
-                    endpoint=log_endpoint,
-                    token=self.api_token,
-                    request_method=method,
-                    request_url=url,
-                    request_body=str(data) if data else None,
-                    request_headers={'Authorization': 'Bearer ***'},  # 隐藏敏感信息
-                    status_code=response.status_code,
-                    response_body=response.text[:5000],  # 限制长度
-                    response_time=response_time,
-                    status=status,
-                    error_message=response.text if status == 'failed' else None,
-                    user=user
-                )
-                
-                # 更新端点统计
-                log_endpoint.total_calls += 1
-                log_endpoint.last_called = timezone.now()
-                log_endpoint.save()
+            self.log_response(log_endpoint, method, url, data, response, response_time, user,
+                              retry_state.request_id, attempt)
+            self.throttled(response)
             
-            response.raise_for_status()
-            return response.json() if response.content else None
+            delay = retry_state.delay_for(response=response)
+            if delay is not None:
+                time.sleep(delay)
+                continue
             
-        except Exception as e:
-            # 记录错误日志
-            if log_endpoint:
-                APIUsageLog.objects.create(
-                    endpoint=log_endpoint,
-                    token=self.api_token,
-                    request_method=method,
-                    request_url=url,
-                    request_body=str(data) if data else None,
-                    status='error',
-                    error_message=str(e),
-                    user=user
-                )
-            raise
+            # 响应已由 log_response 记录（状态为failed），不再另记一条错误日志
+            response.raise_for_status()
+            return response_json(response)
+    
+    def iter_pages(self, endpoint, params=None, log_endpoint=None, user=None, prefetch=False):
+        """
+        按 @odata.nextLink 逐页读取列表的生成器，内存中最多保留两页
+        :param endpoint: API端点路径
+        :param params: 第一页的URL参数（nextLink已包含后续页的参数）
+        :param log_endpoint: APIEndpoint对象，用于记录日志
+        :param user: 调用用户
+        :param prefetch: 是否在调用方处理当前页时于后台线程预取下一页
+        """
+        fetch = partial(self.make_request, 'GET', log_endpoint=log_endpoint, user=user)
+        page = fetch(endpoint, params=params)
+        
+        if not prefetch:
+            while page is not None:
+                next_link = page.get('@odata.nextLink')
+                yield page
+                page = fetch(next_link) if next_link else None
+            return
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='graph-prefetch') as executor:
+            while page is not None:
+                next_link = page.get('@odata.nextLink')
+                future = executor.submit(
+                    contextvars.copy_context().run, self._fetch_in_worker, fetch, next_link
+                ) if next_link else None
+                yield page
+                page = future.result() if future else None
+    
+    @staticmethod
+    def _fetch_in_worker(fetch, url):
+        """在预取线程中读取下一页，结束后关闭该线程的数据库连接"""
+        try:
+            return fetch(url)
+        finally:
+            db_connection.close()
+    
+    def iter_items(self, endpoint, params=None, log_endpoint=None, user=None, prefetch=False):
+        """
+        逐条读取列表（各页 value 中的元素）的生成器
+        参数与 iter_pages 相同
+        """
+        for page in self.iter_pages(endpoint, params, log_endpoint, user, prefetch):
+            yield from page.get('value', [])
+    
+    def log_response(self, log_endpoint, method, url, data, response, response_time, user=None,
+                     request_id=None, attempt=1):
+        """
+        记录收到响应的调用日志并更新端点统计
+        :param request_id: 同一次调用各次尝试共享的关联ID
+        :param attempt: 第几次尝试
+        """
+        if not log_endpoint:
+            return
+        
+        status = 'success' if response.status_code < 400 else 'failed'
+        max_size = log_endpoint.log_body_max_size
+        
+        usage_log_writer.write(APIUsageLog(
+            endpoint=log_endpoint,
+            token=self.api_token,
+            request_method=method,
+            request_url=url,
+            request_path=url_path(url),
+            request_body_digest=usage_log_bodies.put(data, max_size),
+            request_headers={'Authorization': 'Bearer ***'},  # 隐藏敏感信息
+            status_code=response.status_code,
+            response_body_digest=usage_log_bodies.put(response.text, max_size),
+            response_time=response_time,
+            status=status,
+            error_message=response.text[:1000] if status == 'failed' else None,  # 完整内容见响应体
+            request_id=request_id,
+            attempt=attempt,
+            user=user
+        ))
+        
+        # 更新端点统计（内存中累加，定期原子写入）
+        endpoint_call_counter.incr(log_endpoint.pk)
+    
+    def log_error(self, log_endpoint, method, url, data, error, user=None, request_id=None, attempt=1):
+        """记录调用异常日志"""
+        if not log_endpoint:
+            return
+        
+        usage_log_writer.write(APIUsageLog(
+            endpoint=log_endpoint,
+            token=self.api_token,
+            request_method=method,
+            request_url=url,
+            request_path=url_path(url),
+            request_body_digest=usage_log_bodies.put(data, log_endpoint.log_body_max_size),
+            status='error',
+            error_message=str(error),
+            request_id=request_id,
+            attempt=attempt,
+            timeout_phase=timeout_phase(error),
+            user=user
+        ))
 
 
 class TeamsService(MicrosoftGraphService):
@@ -151,12 +352,7 @@ class TeamsService(MicrosoftGraphService):
             }
         }
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='teams',
-            endpoint_url__icontains='messages',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('teams', 'messages')
         
         return self.make_request('POST', endpoint, data=data, log_endpoint=log_endpoint, user=user)
     
@@ -174,12 +370,7 @@ class TeamsService(MicrosoftGraphService):
             }
         }
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='teams',
-            endpoint_url__icontains='chats',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('teams', 'chats')
         
         return self.make_request('POST', endpoint, data=data, log_endpoint=log_endpoint, user=user)
     
@@ -187,14 +378,20 @@ class TeamsService(MicrosoftGraphService):
         """列出所有团队"""
         endpoint = "me/joinedTeams"
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='teams',
-            endpoint_url__icontains='joinedTeams',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('teams', 'joinedTeams')
         
         return self.make_request('GET', endpoint, log_endpoint=log_endpoint, user=user)
+    
+    def iter_teams(self, page_size=None, prefetch=False, user=None):
+        """
+        逐条读取所有团队（自动跟随 @odata.nextLink）
+        :param page_size: 每页数量（该端点不支持$top，忽略）
+        :param prefetch: 是否预取下一页
+        :param user: 调用用户
+        """
+        log_endpoint = self.find_log_endpoint('teams', 'joinedTeams')
+        
+        return self.iter_items("me/joinedTeams", log_endpoint=log_endpoint, user=user, prefetch=prefetch)
 
 
 class OutlookService(MicrosoftGraphService):
@@ -230,12 +427,7 @@ class OutlookService(MicrosoftGraphService):
                 {"emailAddress": {"address": email}} for email in cc_recipients
             ]
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='outlook',
-            endpoint_url__icontains='sendMail',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('outlook', 'sendMail')
         
         return self.make_request('POST', endpoint, data=message, log_endpoint=log_endpoint, user=user)
     
@@ -249,14 +441,24 @@ class OutlookService(MicrosoftGraphService):
         endpoint = f"me/mailFolders/{folder}/messages"
         params = {'$top': top}
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='outlook',
-            endpoint_url__icontains='messages',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('outlook', 'messages')
         
         return self.make_request('GET', endpoint, params=params, log_endpoint=log_endpoint, user=user)
+    
+    def iter_messages(self, folder='inbox', page_size=None, prefetch=False, user=None):
+        """
+        逐条读取文件夹中的所有邮件（自动跟随 @odata.nextLink）
+        :param folder: 文件夹名称
+        :param page_size: 每页数量（$top）
+        :param prefetch: 是否预取下一页
+        :param user: 调用用户
+        """
+        endpoint = f"me/mailFolders/{folder}/messages"
+        params = {'$top': page_size} if page_size else None
+        
+        log_endpoint = self.find_log_endpoint('outlook', 'messages')
+        
+        return self.iter_items(endpoint, params, log_endpoint=log_endpoint, user=user, prefetch=prefetch)
 
 
 class SharePointService(MicrosoftGraphService):
@@ -270,12 +472,7 @@ class SharePointService(MicrosoftGraphService):
         """
         endpoint = f"sites/{site_id}"
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='sharepoint',
-            endpoint_url__icontains='sites',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('sharepoint', 'sites')
         
         return self.make_request('GET', endpoint, log_endpoint=log_endpoint, user=user)
     
@@ -287,15 +484,25 @@ class SharePointService(MicrosoftGraphService):
         """
         endpoint = f"sites/{site_id}/lists"
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='sharepoint',
-            endpoint_url__icontains='lists',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('sharepoint', 'lists')
         
         return self.make_request('GET', endpoint, log_endpoint=log_endpoint, user=user)
     
+    def iter_site_lists(self, site_id, page_size=None, prefetch=False, user=None):
+        """
+        逐条读取站点的所有列表（自动跟随 @odata.nextLink）
+        :param site_id: 站点ID
+        :param page_size: 每页数量（$top）
+        :param prefetch: 是否预取下一页
+        :param user: 调用用户
+        """
+        endpoint = f"sites/{site_id}/lists"
+        params = {'$top': page_size} if page_size else None
+        
+        log_endpoint = self.find_log_endpoint('sharepoint', 'lists')
+        
+        return self.iter_items(endpoint, params, log_endpoint=log_endpoint, user=user, prefetch=prefetch)
+    
     def get_list_items(self, site_id, list_id, user=None):
         """
         获取列表项
@@ -305,15 +512,26 @@ class SharePointService(MicrosoftGraphService):
         """
         endpoint = f"sites/{site_id}/lists/{list_id}/items"
         
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='sharepoint',
-            endpoint_url__icontains='items',
-            is_active=True
-        ).first()
+        log_endpoint = self.find_log_endpoint('sharepoint', 'items')
         
         return self.make_request('GET', endpoint, log_endpoint=log_endpoint, user=user)
     
+    def iter_list_items(self, site_id, list_id, page_size=None, prefetch=False, user=None):
+        """
+        逐条读取列表的所有列表项（自动跟随 @odata.nextLink）
+        :param site_id: 站点ID
+        :param list_id: 列表ID
+        :param page_size: 每页数量（$top）
+        :param prefetch: 是否预取下一页
+        :param user: 调用用户
+        """
+        endpoint = f"sites/{site_id}/lists/{list_id}/items"
+        params = {'$top': page_size} if page_size else None
+        
+        log_endpoint = self.find_log_endpoint('sharepoint', 'items')
+        
+        return self.iter_items(endpoint, params, log_endpoint=log_endpoint, user=user, prefetch=prefetch)
+    
     def upload_file(self, site_id, drive_id, file_path, file_content, user=None):
         """
         上传文件到SharePoint
@@ -325,38 +543,12 @@ class SharePointService(MicrosoftGraphService):
         """
         endpoint = f"sites/{site_id}/drives/{drive_id}/root:/{file_path}:/content"
         
-        # 特殊处理：文件上传需要不同的Content-Type
-        url = f"{self.BASE_URL}/{endpoint.lstrip('/')}"
-        headers = {
-            'Authorization': f'Bearer {self.get_access_token()}',
-            'Content-Type': 'application/octet-stream'
-        }
-        
-        response = requests.put(url, headers=headers, data=file_content)
-        
-        from .models import APIEndpoint
-        log_endpoint = APIEndpoint.objects.filter(
-            service='sharepoint',
-            endpoint_url__icontains='upload',
-            is_active=True
-        ).first()
-        
-        if log_endpoint:
-            log_endpoint.total_calls += 1
-            log_endpoint.last_called = timezone.now()
-            log_endpoint.save()
-            
-            APIUsageLog.objects.create(
-                endpoint=log_endpoint,
-                token=self.api_token,
-                request_method='PUT',
-                request_url=url,
-                status_code=response.status_code,
-                response_body=response.text[:5000],
-                status='success' if response.status_code < 400 else 'failed',
-                user=user
-            )
-        
-        response.raise_for_status()
-        return response.json() if response.content else None
-
+        # 同名文件覆盖写入，PUT可以安全重试
+        return self.make_request(
+            'PUT',
+            endpoint,
+            log_endpoint=self.find_log_endpoint('sharepoint', 'upload'),
+            user=user,
+            content=file_content,
+            content_type='application/octet-stream'
+        )
@@ -0,0 +1,29 @@
+"""
+微软API模型信号处理
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import APIToken
+from .tokens import CREDENTIAL_FIELDS, token_cache
+
+
+@receiver(pre_save, sender=APIToken)
+def reset_token_on_credentials_change(sender, instance, **kwargs):
+    """
+    凭据修改后清除数据库中保存的访问令牌
+    其他进程的缓存因 updated_at 变化失效后从数据库读取，不会再取回按旧凭据获取的令牌
+    """
+    if instance.pk is None:
+        return
+    previous = APIToken.objects.filter(pk=instance.pk).values(*CREDENTIAL_FIELDS).first()
+    if previous and any(previous[field] != getattr(instance, field) for field in CREDENTIAL_FIELDS):
+        instance.access_token = None
+        instance.token_expires_at = None
+
+
+@receiver(post_save, sender=APIToken)
+@receiver(post_delete, sender=APIToken)
+def invalidate_cached_token(sender, instance, **kwargs):
+    """Token配置修改或删除后，清除本进程缓存的访问令牌（其他进程按 updated_at 判断，见 tokens.py）"""
+    token_cache.invalidate(instance.pk)
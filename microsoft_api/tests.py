@@ -1,11 +1,34 @@
 """
 单元测试
 """
+import json
+import threading
+from datetime import timedelta, timezone as dt_timezone
+from unittest import mock
+
+import requests
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.utils import timezone
+import httpx
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from .models import APIToken, APIEndpoint, APIUsageLog
+from automationapi import counters, logbuffer
+from automationapi.deadline import Deadline, DeadlineExceeded, current_deadline
+from automationapi.rollups import bucket_start
+from automationapi.testing import create_api_token, create_endpoint, create_user, fake_response
+from .models import (
+    APILogBody, APIToken, APIEndpoint, APIUsageLog, APIUsageRollup, endpoint_call_counter, usage_log_bodies,
+    usage_log_partitions, usage_rollups,
+)
+from .services import (
+    MicrosoftGraphService, TeamsService, OutlookService, SharePointService, graph_session_pool, usage_log_writer
+)
+from .batch import GraphBatch, GraphBatchError
+from .tokens import token_cache, TokenRefresher
+from .async_services import AsyncTeamsService, AsyncSharePointService
 
 
 class APITokenModelTest(TestCase):
@@ -59,6 +82,33 @@ class APIEndpointModelTest(TestCase):
         """测试端点调用次数默认值"""
         self.assertEqual(self.endpoint.total_calls, 0)
 
+    def test_call_counter_atomic_update(self):
+        """未启用延迟写入时直接原子更新，最后调用时间不会倒退"""
+        now = timezone.now()
+        endpoint_call_counter.incr(self.endpoint.pk, at=now)
+        endpoint_call_counter.incr(self.endpoint.pk, at=now - timedelta(minutes=5))
+        self.endpoint.refresh_from_db()
+        self.assertEqual(self.endpoint.total_calls, 2)
+        self.assertEqual(self.endpoint.last_called, now)
+
+    def test_call_counter_buffered(self):
+        """启用延迟写入时读取合并尚未写入的增量，flush后写入数据库"""
+        with mock.patch.object(counters, '_started', True), \
+                self.settings(COUNTER_FLUSH_INTERVAL=3600):
+            self.addCleanup(endpoint_call_counter.stop)
+            for _ in range(3):
+                endpoint_call_counter.incr(self.endpoint.pk)
+
+            self.endpoint.refresh_from_db()
+            self.assertEqual(self.endpoint.total_calls, 0)
+            self.assertEqual(self.endpoint.current_total_calls, 3)
+            self.assertIsNotNone(self.endpoint.current_last_called)
+
+            self.assertEqual(endpoint_call_counter.flush(), 1)
+            self.endpoint.refresh_from_db()
+            self.assertEqual(self.endpoint.total_calls, 3)
+            self.assertEqual(self.endpoint.current_total_calls, 3)
+
 
 class APITokenViewSetTest(APITestCase):
     """API Token视图集测试"""
@@ -128,8 +178,16 @@ class APIEndpointViewSetTest(APITestCase):
     
     def test_endpoint_statistics(self):
         """测试端点统计"""
-        response = self.client.get('/api/endpoints/statistics/')
+        # 未收到响应的调用不计入计数器，但仍计入调用次数
+        usage_log_writer.write(APIUsageLog(endpoint=self.endpoint, request_method='GET', request_url='teams/test',
+                                           status='error', error_message='Connection refused'))
+        # 从汇总表读取，不查询日志分区
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/endpoints/statistics/')
+        self.assertFalse([q['sql'] for q in queries if 'apiusagelog' in q['sql'].lower()])
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['service'], row['total_endpoints'], row['total_calls']) for row in response.data],
+                         [('teams', 1, 1)])
 
 
 class APIUsageLogTest(TestCase):
@@ -175,3 +233,816 @@ class APIUsageLogTest(TestCase):
         """测试日志字符串表示"""
         self.assertIn('测试端点', str(self.log))
         self.assertIn('success', str(self.log))
+
+
+class MicrosoftGraphServiceTest(TestCase):
+    """Graph服务层测试"""
+    
+    def setUp(self):
+        self.token = create_api_token()
+        self.endpoint = create_endpoint(endpoint_url='me/joinedTeams')
+        graph_session_pool.close_all()
+        token_cache.clear()
+    
+    def test_requests_reuse_pooled_session(self):
+        """测试多次调用复用同一个连接池Session"""
+        service = MicrosoftGraphService(token_id=self.token.id)
+        before = graph_session_pool.stats()
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={'value': []})) as request:
+            service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+            service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+        
+        self.assertEqual(request.call_count, 2)
+        stats = graph_session_pool.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        # 日志单独保存URL的路径部分，供Admin按前缀搜索
+        self.assertEqual(usage_log_partitions.query().filter(request_path__startswith='/v1.0/me/').count(), 2)
+    
+    def test_upload_file_uses_request_pipeline(self):
+        """测试文件上传经过重试和熔断，请求异常也记录日志"""
+        upload = APIEndpoint.objects.create(name='上传文件', service='sharepoint', endpoint_url='drives/upload',
+                                            http_method='PUT')
+        service = SharePointService(token_id=self.token.id)
+        reply = fake_response(json_data={'id': 'file-1'})
+        
+        with mock.patch('time.sleep'), \
+                mock.patch('requests.Session.request', side_effect=[requests.ConnectionError('reset'), reply]) as request:
+            result = service.upload_file('site', 'drive', 'a.txt', b'data')
+        
+        self.assertEqual(result, {'id': 'file-1'})
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request.call_args.kwargs['data'], b'data')
+        self.assertEqual(request.call_args.kwargs['headers']['Content-Type'], 'application/octet-stream')
+        statuses = [log.status for log in usage_log_partitions.query().filter(endpoint=upload).union('attempt')]
+        self.assertEqual(statuses, ['error', 'success'])
+
+
+class TokenCacheTest(TestCase):
+    """访问令牌缓存测试"""
+    
+    def setUp(self):
+        self.token = create_api_token(access_token=None, token_expires_at=None)
+        token_cache.clear()
+    
+    def test_expired_token_refreshed_once(self):
+        """测试过期令牌只刷新一次，之后命中缓存且不查询数据库"""
+        expires_at = timezone.now() + timedelta(hours=1)
+        fetch = mock.Mock(return_value=('new-token', expires_at))
+        
+        self.assertEqual(token_cache.get(self.token, fetch), 'new-token')
+        with self.assertNumQueries(0):
+            self.assertEqual(token_cache.get(self.token, fetch), 'new-token')
+        
+        self.assertEqual(fetch.call_count, 1)
+        self.token.refresh_from_db()
+        self.assertEqual(self.token.access_token, 'new-token')
+        self.assertIsNone(self.token.refresh_lease_until)
+    
+    def test_waits_for_lease_holder(self):
+        """测试其他进程持有租约时等待其刷新结果而不重复刷新"""
+        APIToken.objects.filter(pk=self.token.pk).update(
+            refresh_lease_until=timezone.now() + timedelta(seconds=30)
+        )
+        fetch = mock.Mock()
+        
+        def other_process_refreshes(seconds):
+            APIToken.objects.filter(pk=self.token.pk).update(
+                access_token='other-token',
+                token_expires_at=timezone.now() + timedelta(hours=1),
+                refresh_lease_until=None
+            )
+        
+        with mock.patch('microsoft_api.tokens.time.sleep', side_effect=other_process_refreshes):
+            self.assertEqual(token_cache.get(self.token, fetch), 'other-token')
+        fetch.assert_not_called()
+    
+    def test_other_process_config_change_bypasses_cache(self):
+        """测试其他进程修改凭据后，本进程加载到新的Token时不再使用缓存的旧令牌"""
+        expires_at = timezone.now() + timedelta(hours=1)
+        token_cache.get(self.token, mock.Mock(return_value=('old-token', expires_at)))
+        
+        # 模拟其他进程保存：本进程的信号不会触发
+        with mock.patch.object(token_cache, 'invalidate'):
+            changed = APIToken.objects.get(pk=self.token.pk)
+            changed.client_secret = 'new-secret'
+            changed.save()
+        self.assertIsNone(APIToken.objects.get(pk=self.token.pk).access_token)
+        
+        fresh = APIToken.objects.get(pk=self.token.pk)
+        fetch = mock.Mock(return_value=('new-token', expires_at))
+        self.assertEqual(token_cache.get(fresh, fetch), 'new-token')
+        self.assertEqual(fetch.call_count, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(token_cache.get(fresh, fetch), 'new-token')
+    
+    def test_failed_refresh_releases_lease(self):
+        """测试刷新失败后释放租约"""
+        fetch = mock.Mock(side_effect=Exception('获取访问令牌失败'))
+        
+        with self.assertRaises(Exception):
+            token_cache.get(self.token, fetch)
+        
+        self.token.refresh_from_db()
+        self.assertIsNone(self.token.refresh_lease_until)
+
+
+class TokenRefresherTest(TestCase):
+    """令牌提前续期测试"""
+    
+    def setUp(self):
+        self.token = create_api_token(access_token='old-token',
+                                      token_expires_at=timezone.now() + timedelta(minutes=5))
+        token_cache.clear()
+    
+    def test_refreshes_tokens_within_margin(self):
+        """测试即将过期的Token被提前续期"""
+        refresher = TokenRefresher(margin=600, jitter=0)
+        new_expiry = timezone.now() + timedelta(hours=1)
+        
+        with mock.patch.object(MicrosoftGraphService, 'fetch_access_token',
+                               return_value=('new-token', new_expiry)):
+            results, wait = refresher.run_once()
+        
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0]['ok'])
+        self.assertEqual(refresher.stats['refreshed'], 1)
+        self.token.refresh_from_db()
+        self.assertEqual(self.token.access_token, 'new-token')
+        # 下一次续期安排在新过期时间前10分钟左右
+        self.assertAlmostEqual(wait, 50 * 60, delta=5)
+    
+    def test_failure_is_reported_and_retried(self):
+        """测试续期失败被记录并安排重试"""
+        refresher = TokenRefresher(margin=600, jitter=0, retry_interval=30)
+        
+        with mock.patch.object(MicrosoftGraphService, 'fetch_access_token',
+                               side_effect=Exception('获取访问令牌失败')), \
+                self.assertLogs('microsoft_api.tokens', level='WARNING'):
+            results, wait = refresher.run_once()
+        
+        self.assertFalse(results[0]['ok'])
+        self.assertEqual(refresher.stats['failed'], 1)
+        self.assertAlmostEqual(wait, 30, delta=2)
+
+
+class AsyncGraphServiceTest(TestCase):
+    """异步Graph服务测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.token = create_api_token()
+        self.endpoint = create_endpoint(name='Teams - 发送聊天消息', endpoint_url='chats/{chat_id}/messages',
+                                        http_method='POST')
+        token_cache.clear()
+    
+    def graph_response(self, json_data):
+        request = httpx.Request('POST', 'https://graph.microsoft.com/v1.0/chats/1/messages')
+        return httpx.Response(201, json=json_data, request=request)
+    
+    async def test_send_chat_message(self):
+        """测试异步发送聊天消息并记录日志"""
+        service = await AsyncTeamsService.create(token_id=self.token.id)
+        
+        with mock.patch('httpx.AsyncClient.request', new_callable=mock.AsyncMock,
+                        return_value=self.graph_response({'id': 'msg-1'})) as request:
+            result = await service.send_chat_message('1', 'hello')
+        
+        self.assertEqual(result, {'id': 'msg-1'})
+        self.assertEqual(request.call_args.kwargs['headers']['Authorization'], 'Bearer cached-token')
+        self.assertEqual(await usage_log_partitions.query().filter(endpoint=self.endpoint).acount(), 1)
+    
+    def test_async_view(self):
+        """测试异步视图"""
+        self.client.force_login(self.user)
+        
+        with mock.patch('httpx.AsyncClient.request', new_callable=mock.AsyncMock,
+                        return_value=self.graph_response({'id': 'msg-1'})):
+            response = self.client.post(
+                '/api/async/microsoft/send_teams_message/',
+                {'message_type': 'chat', 'chat_id': '1', 'message': 'hello'},
+                content_type='application/json'
+            )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], {'id': 'msg-1'})
+    
+    def test_async_view_requires_login(self):
+        """测试异步视图需要登录"""
+        response = self.client.get('/api/async/microsoft/list_teams/')
+        self.assertEqual(response.status_code, 403)
+
+
+class GraphBatchTest(TestCase):
+    """Graph批量请求测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.token = create_api_token()
+        self.chat_endpoint = create_endpoint(name='Teams - 发送聊天消息', endpoint_url='chats/{chat_id}/messages',
+                                             http_method='POST')
+        self.mail_endpoint = create_endpoint(name='Outlook - 发送邮件', service='outlook', endpoint_url='me/sendMail',
+                                             http_method='POST')
+        token_cache.clear()
+    
+    def batch_reply(self, method, url, json=None, **kwargs):
+        """按子请求ID生成$batch响应，ID为2的子请求失败"""
+        responses = []
+        for sub in reversed(json['requests']):
+            status_code = 404 if sub['id'] == '2' else 201
+            responses.append({'id': sub['id'], 'status': status_code, 'body': {'url': sub['url']}})
+        return fake_response(json_data={'responses': responses})
+    
+    def test_calls_are_merged_and_split(self):
+        """测试多次调用合并为一个$batch请求，并把结果分发回各调用方"""
+        teams = TeamsService(token_id=self.token.id)
+        outlook = OutlookService(token_id=self.token.id)
+        
+        with mock.patch('requests.Session.request', side_effect=self.batch_reply) as request:
+            with GraphBatch(teams, outlook) as batch:
+                first = teams.send_chat_message('chat-1', 'hello')
+                second = teams.send_chat_message('chat-2', 'hello')
+                with batch.after(first):
+                    third = outlook.send_email(['a@example.com'], '主题', '正文')
+        
+        self.assertEqual(request.call_count, 1)
+        self.assertTrue(request.call_args.kwargs['url'].endswith('/$batch'))
+        sub_requests = request.call_args.kwargs['json']['requests']
+        self.assertEqual(sub_requests[2]['dependsOn'], ['1'])
+        
+        self.assertEqual(first.result(), {'url': '/chats/chat-1/messages'})
+        with self.assertRaises(GraphBatchError):
+            second.result()
+        self.assertEqual(third.result(), {'url': '/me/sendMail'})
+        
+        self.assertEqual(usage_log_partitions.query().filter(endpoint=self.chat_endpoint).count(), 2)
+        self.assertEqual(usage_log_partitions.query().filter(endpoint=self.mail_endpoint, status='success').count(), 1)
+    
+    def test_throttled_sub_requests_requeued(self):
+        """测试被限流的子请求按Retry-After重新发送，依赖它的子请求随之重发，日志不记录整批的往返时间"""
+        teams = TeamsService(token_id=self.token.id)
+        replies = [
+            fake_response(json_data={'responses': [
+                {'id': '1', 'status': 429, 'headers': {'Retry-After': '3'}, 'body': {'error': 'throttled'}},
+                {'id': '2', 'status': 424, 'body': {'error': 'failed dependency'}},
+            ]}),
+            fake_response(json_data={'responses': [
+                {'id': '1', 'status': 201, 'body': {'id': 'msg-1'}},
+                {'id': '2', 'status': 201, 'body': {'id': 'msg-2'}},
+            ]}),
+        ]
+        
+        with mock.patch('requests.Session.request', side_effect=replies) as request, \
+                mock.patch('time.sleep') as sleep, \
+                self.settings(RATE_LIMIT_BACKEND='local'):
+            with GraphBatch(teams) as batch:
+                first = teams.send_chat_message('chat-1', 'hello')
+                with batch.after(first):
+                    second = teams.send_chat_message('chat-2', 'hello')
+            # 429同时阻塞了租户的共享令牌桶
+            self.assertLess(teams.rate_limit_level('test-tenant')['tokens'], 0)
+        
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request.call_args.kwargs['json']['requests'][1]['dependsOn'], ['1'])
+        sleep.assert_any_call(3.0)
+        self.assertEqual((first.result(), second.result()), ({'id': 'msg-1'}, {'id': 'msg-2'}))
+        logs = list(usage_log_partitions.query().union('attempt', 'request_url'))
+        self.assertEqual([(log.attempt, log.status) for log in logs],
+                         [(1, 'failed'), (1, 'failed'), (2, 'success'), (2, 'success')])
+        self.assertEqual({log.response_time for log in logs}, {None})
+    
+    def test_chunks_keep_dependencies_together(self):
+        """测试超过20个子请求时分批，且相互依赖的请求在同一批"""
+        teams = TeamsService(token_id=self.token.id)
+        batch = GraphBatch(teams)
+        results = [batch.add('GET', f'teams/{i}') for i in range(19)]
+        with batch.after(results[0]):
+            batch.add('GET', 'teams/19')
+            batch.add('GET', 'teams/20')
+        
+        chunks = batch.chunks()
+        
+        self.assertEqual([len(chunk) for chunk in chunks], [20, 1])
+        first_chunk_ids = {item['result'].id for item in chunks[0]}
+        self.assertTrue({'1', '20', '21'} <= first_chunk_ids)
+    
+    def test_batch_action(self):
+        """测试批量操作接口"""
+        self.client.force_login(self.user)
+        
+        with mock.patch('requests.Session.request', side_effect=self.batch_reply):
+            response = self.client.post('/api/microsoft/batch/', {
+                'operations': [
+                    {'operation': 'send_chat_message', 'params': {'chat_id': 'c1', 'message': 'hi'}},
+                    {'operation': 'send_chat_message', 'params': {'chat_id': 'c2', 'message': 'hi'}},
+                ]
+            }, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        statuses = [item['status'] for item in response.json()['data']]
+        self.assertEqual(statuses, ['success', 'error'])
+
+
+class GraphPagingTest(TestCase):
+    """@odata.nextLink 分页迭代测试"""
+    
+    NEXT_LINK = 'https://graph.microsoft.com/v1.0/sites/s1/lists/l1/items?$top=2&$skiptoken=abc'
+    
+    def setUp(self):
+        self.user = create_user()
+        self.token = create_api_token()
+        self.pages = [
+            {'value': [{'id': '1'}, {'id': '2'}], '@odata.nextLink': self.NEXT_LINK},
+            {'value': [{'id': '3'}]},
+        ]
+        token_cache.clear()
+    
+    def test_iter_list_items_follows_next_link(self):
+        """测试自动跟随nextLink读取所有页"""
+        service = SharePointService(token_id=self.token.id)
+        
+        with mock.patch('requests.Session.request',
+                        side_effect=[fake_response(json_data=page) for page in self.pages]) as request:
+            items = list(service.iter_list_items('s1', 'l1', page_size=2))
+        
+        self.assertEqual([item['id'] for item in items], ['1', '2', '3'])
+        first, second = request.call_args_list
+        self.assertEqual(first.kwargs['url'], 'https://graph.microsoft.com/v1.0/sites/s1/lists/l1/items')
+        self.assertEqual(first.kwargs['params'], {'$top': 2})
+        self.assertEqual(second.kwargs['url'], self.NEXT_LINK)
+        self.assertIsNone(second.kwargs['params'])
+    
+    def test_prefetch_next_page(self):
+        """测试处理当前页时已经在后台请求下一页"""
+        service = SharePointService(token_id=self.token.id)
+        service.get_access_token()
+        next_page_requested = threading.Event()
+        
+        def request(method, url, **kwargs):
+            if url == self.NEXT_LINK:
+                next_page_requested.set()
+                return fake_response(json_data=self.pages[1])
+            return fake_response(json_data=self.pages[0])
+        
+        with mock.patch('requests.Session.request', side_effect=request):
+            items = service.iter_list_items('s1', 'l1', prefetch=True)
+            self.assertEqual(next(items)['id'], '1')
+            self.assertTrue(next_page_requested.wait(5))
+            self.assertEqual([item['id'] for item in items], ['2', '3'])
+    
+    def test_export_items_streams_ndjson(self):
+        """测试导出接口以NDJSON流式输出所有页"""
+        self.client.force_login(self.user)
+        
+        with mock.patch('requests.Session.request',
+                        side_effect=[fake_response(json_data=page) for page in self.pages]):
+            response = self.client.post('/api/microsoft/export_items/', {
+                'token_id': self.token.id,
+                'source': 'list_items',
+                'site_id': 's1',
+                'list_id': 'l1',
+                'prefetch': False
+            }, content_type='application/json')
+            self.assertTrue(response.streaming)
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        
+        self.assertEqual([json.loads(line)['id'] for line in lines], ['1', '2', '3'])
+    
+    async def test_async_iter_with_prefetch(self):
+        """测试异步迭代器跟随nextLink并预取"""
+        service = await AsyncSharePointService.create(token_id=self.token.id)
+        
+        async def request(method, url, **kwargs):
+            page = self.pages[1] if url == self.NEXT_LINK else self.pages[0]
+            return httpx.Response(200, json=page, request=httpx.Request(method, url))
+        
+        with mock.patch('httpx.AsyncClient.request', side_effect=request):
+            items = [item['id'] async for item in service.iter_list_items('s1', 'l1', prefetch=True)]
+        
+        self.assertEqual(items, ['1', '2', '3'])
+
+
+class GraphRetryTest(TestCase):
+    """Graph请求重试测试"""
+    
+    def setUp(self):
+        self.token = create_api_token(tenant_id='retry-tenant')
+        self.endpoint = create_endpoint(endpoint_url='me/joinedTeams')
+        token_cache.clear()
+    
+    def test_throttled_request_retried_after_retry_after(self):
+        """测试429按Retry-After等待后重试，各次尝试记录为关联的日志"""
+        service = MicrosoftGraphService(token_id=self.token.id)
+        responses = [
+            fake_response(429, {'error': 'throttled'}, headers={'Retry-After': '2'}),
+            fake_response(json_data={'value': []}),
+        ]
+        
+        with mock.patch('requests.Session.request', side_effect=responses), \
+                mock.patch('time.sleep') as sleep, \
+                self.settings(RATE_LIMIT_BACKEND='local'):
+            result = service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+            # 429同时阻塞了租户的共享令牌桶
+            self.assertLess(service.rate_limit_level('retry-tenant')['tokens'], 0)
+        
+        self.assertEqual(result, {'value': []})
+        sleep.assert_any_call(2.0)
+        logs = list(usage_log_partitions.query().union('attempt'))
+        self.assertEqual([(log.attempt, log.status) for log in logs], [(1, 'failed'), (2, 'success')])
+        self.assertEqual(logs[0].request_id, logs[1].request_id)
+    
+    def test_writes_not_retried_by_default(self):
+        """测试POST默认不重试"""
+        service = MicrosoftGraphService(token_id=self.token.id)
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(503, {})) as request, \
+                mock.patch('time.sleep'):
+            with self.assertRaises(Exception):
+                service.make_request('POST', 'me/sendMail', data={}, log_endpoint=self.endpoint)
+        
+        self.assertEqual(request.call_count, 1)
+        # 失败的响应只记录一条日志
+        self.assertEqual([log.status for log in usage_log_partitions.query().union()], ['failed'])
+
+
+
+class GraphTimeoutTest(TestCase):
+    """Graph请求超时与截止时间测试"""
+    
+    def setUp(self):
+        self.token = create_api_token(tenant_id='timeout-tenant')
+        self.endpoint = create_endpoint(endpoint_url='me/joinedTeams', read_timeout=90)
+        token_cache.clear()
+    
+    def test_endpoint_timeout_clamped_to_deadline(self):
+        """测试端点的读取超时优先于全局配置，且不超过剩余时间"""
+        service = MicrosoftGraphService(token_id=self.token.id)
+        
+        with mock.patch('requests.Session.request', return_value=fake_response(json_data={})) as request, \
+                self.settings(RATE_LIMIT_BACKEND='local', GRAPH_CONNECT_TIMEOUT=3):
+            service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+            self.assertEqual(request.call_args.kwargs['timeout'], (3, 90))
+            
+            token = current_deadline.set(Deadline(10))
+            try:
+                service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+            finally:
+                current_deadline.reset(token)
+            connect, read = request.call_args.kwargs['timeout']
+        
+        self.assertEqual(connect, 3)
+        self.assertLessEqual(read, 10)
+    
+    def test_timeout_logged_with_phase(self):
+        """测试超时异常按阶段记录日志"""
+        service = MicrosoftGraphService(token_id=self.token.id)
+        
+        with mock.patch('requests.Session.request', side_effect=requests.ConnectTimeout('timed out')), \
+                self.settings(RATE_LIMIT_BACKEND='local', API_RETRY_MAX_ATTEMPTS=1):
+            with self.assertRaises(requests.ConnectTimeout):
+                service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+        
+        self.assertEqual(usage_log_partitions.query().union().get().timeout_phase, 'connect')
+    
+    def test_expired_deadline_stops_request(self):
+        """测试截止时间已过时不再发送请求"""
+        service = MicrosoftGraphService(token_id=self.token.id)
+        
+        token = current_deadline.set(Deadline(0.001))
+        try:
+            with mock.patch('requests.Session.request') as request, \
+                    mock.patch('time.monotonic', side_effect=lambda: 1e9), \
+                    self.settings(RATE_LIMIT_BACKEND='local'):
+                with self.assertRaises(DeadlineExceeded):
+                    service.make_request('GET', 'me/joinedTeams', log_endpoint=self.endpoint)
+        finally:
+            current_deadline.reset(token)
+        
+        request.assert_not_called()
+        self.assertEqual(usage_log_partitions.query().union().get().timeout_phase, 'deadline')
+
+
+class UsageLogPartitionTest(APITestCase):
+    """使用日志按时间分区存储测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_authenticate(user=self.user)
+        self.endpoint = create_endpoint()
+        self.now = timezone.now()
+    
+    def write_log(self, created_at, status='success'):
+        log = APIUsageLog(endpoint=self.endpoint, request_method='GET', request_url='teams/test',
+                          status=status, user=self.user, created_at=created_at)
+        usage_log_writer.write(log)
+        return log
+    
+    def test_logs_routed_by_month(self):
+        """测试日志按月写入各自的分区，主键可定位分区，按时间范围裁剪分区"""
+        old = self.write_log(self.now - timedelta(days=62), status='error')
+        new = self.write_log(self.now)
+        legacy = APIUsageLog.objects.create(endpoint=self.endpoint, request_method='GET',
+                                            request_url='teams/test', status='success')
+        
+        old_partition = usage_log_partitions.partition_for_pk(old.pk)
+        new_partition = usage_log_partitions.partition_for_pk(new.pk)
+        self.assertEqual(new_partition.name, self.now.astimezone(dt_timezone.utc).strftime('%Y-%m'))
+        self.assertNotEqual(old_partition.table, new_partition.table)
+        self.assertTrue(usage_log_partitions.partition_for_pk(legacy.pk).is_default)
+        self.assertEqual(new_partition.model.objects.get().pk, new.pk)
+        
+        self.assertEqual(usage_log_partitions.query().count(), 3)
+        recent = usage_log_partitions.query(since=self.now - timedelta(days=1))
+        self.assertNotIn(old_partition.table, [p.table for p in recent.partitions()])
+        self.assertEqual(recent.count_by('status'), [{'status': 'success', 'count': 2}])
+    
+    def test_log_api_across_partitions(self):
+        """测试日志列表跨分区合并分页，详情按主键定位，统计合并各分区"""
+        old = self.write_log(self.now - timedelta(days=40), status='failed')
+        new = self.write_log(self.now)
+        
+        response = self.client.get('/api/logs/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], [new.pk, old.pk])
+        self.assertEqual(response.data['results'][0]['endpoint_name'], '测试端点')
+        
+        response = self.client.get('/api/logs/', {'page': 1})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([row['id'] for row in response.data['results']], [new.pk, old.pk])
+        
+        response = self.client.get('/api/logs/', {'days': 7})
+        self.assertEqual([row['id'] for row in response.data['results']], [new.pk])
+        
+        response = self.client.get(f'/api/logs/{old.pk}/')
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(self.client.get(f'/api/logs/{old.pk + 1}/').status_code, status.HTTP_404_NOT_FOUND)
+        
+        response = self.client.get('/api/logs/statistics/', {'days': 60})
+        self.assertEqual(response.data['total_calls'], 2)
+        self.assertEqual(response.data['failed_calls'], 1)
+        self.assertEqual(response.data['by_endpoint'], [{'endpoint__name': '测试端点', 'count': 2}])
+    
+    def test_log_cursor_pagination(self):
+        """测试游标分页按时间倒序跨分区翻页，保留过滤条件"""
+        logs = [
+            self.write_log(self.now - timedelta(days=40)),
+            self.write_log(self.now - timedelta(days=1), status='failed'),
+            self.write_log(self.now - timedelta(days=1)),
+            self.write_log(self.now),
+        ]
+        
+        seen = []
+        url = '/api/logs/?page_size=1'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), 1)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [logs[3].pk, logs[2].pk, logs[1].pk, logs[0].pk])
+        
+        response = self.client.get('/api/logs/', {'page_size': 1, 'status': 'success', 'total': 'approx'})
+        self.assertEqual(response.data['approximate_count'], 3)
+        self.assertIn('status=success', response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], [logs[2].pk])
+        
+        response = self.client.get('/api/logs/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_log_export_streams_values(self):
+        """测试日志导出按列表的过滤条件流式输出NDJSON、CSV和列式格式"""
+        old = self.write_log(self.now - timedelta(days=40), status='failed')
+        new = self.write_log(self.now)
+        
+        response = self.client.get('/api/logs/export/')
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [new.pk, old.pk])
+        self.assertEqual(rows[0]['endpoint_name'], '测试端点')
+        
+        response = self.client.get('/api/logs/export/', {'export_format': 'csv', 'status': 'failed'})
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'created_at', 'endpoint'])
+        self.assertEqual(len(lines), 2)
+        
+        response = self.client.get('/api/logs/export/', {'export_format': 'columnar', 'chunk_size': 100})
+        header, batch = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(batch[header['columns'].index('id')], [new.pk, old.pk])
+        
+        response = self.client.get('/api/logs/export/', {'export_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_retention_drops_whole_partitions(self):
+        """测试保留期清理删除整个过期分区，默认分区逐行删除"""
+        old = self.write_log(self.now - timedelta(days=200))
+        self.write_log(self.now)
+        legacy = APIUsageLog.objects.create(endpoint=self.endpoint, request_method='GET',
+                                            request_url='teams/test', status='success')
+        APIUsageLog.objects.filter(pk=legacy.pk).update(created_at=self.now - timedelta(days=200))
+        old_table = usage_log_partitions.partition_for_pk(old.pk).table
+        
+        dropped = usage_log_partitions.drop_before(self.now - timedelta(days=90))
+        
+        self.assertEqual([p.table for p in dropped], [old_table])
+        self.assertEqual(usage_log_partitions.prune_default(self.now - timedelta(days=90)), 1)
+        self.assertNotIn(old_table, [p.table for p in usage_log_partitions.partitions()])
+        self.assertEqual(usage_log_partitions.query().count(), 1)
+    
+    def test_related_delete_reaches_partitions(self):
+        """测试删除用户时清空分区中日志的外键、删除端点时删除其日志，不留下列表查不到的日志"""
+        log = self.write_log(self.now)
+        other = create_user('other')
+        self.client.force_authenticate(user=other)
+        
+        self.user.delete()
+        response = self.client.get('/api/logs/')
+        self.assertEqual([(row['id'], row['user']) for row in response.data['results']], [(log.pk, None)])
+        
+        self.endpoint.delete()
+        self.assertEqual(usage_log_partitions.query().count(), 0)
+        self.assertEqual(self.client.get('/api/logs/').data['results'], [])
+    
+    def test_reads_use_cached_partition_list(self):
+        """测试读取使用缓存的分区列表，其他进程删除的分区在查询出错后跳过"""
+        old = self.write_log(self.now - timedelta(days=62))
+        new = self.write_log(self.now)
+        old_table = usage_log_partitions.partition_for_pk(old.pk).table
+        usage_log_partitions.partitions(refresh=True)
+        
+        introspection = connection.introspection
+        with mock.patch.object(introspection, 'table_names', wraps=introspection.table_names) as table_names:
+            self.assertEqual(usage_log_partitions.query().count(), 2)
+            self.assertEqual(self.client.get(f'/api/logs/{new.pk}/').status_code, status.HTTP_200_OK)
+            self.assertEqual(table_names.call_count, 0)
+            
+            # 模拟其他进程删除分区表，本进程的缓存中仍有该分区
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(old_table)}')
+            response = self.client.get('/api/logs/')
+            self.assertEqual([row['id'] for row in response.data['results']], [new.pk])
+            self.assertEqual(table_names.call_count, 1)
+        
+        self.assertEqual(usage_log_partitions.query().count(), 1)
+        self.assertEqual(self.client.get(f'/api/logs/{old.pk}/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class UsageLogBodyTest(APITestCase):
+    """请求体/响应体压缩去重存储测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_authenticate(user=self.user)
+        self.token = create_api_token()
+        self.endpoint = create_endpoint(http_method='POST')
+        token_cache.clear()
+    
+    def call(self, data, response):
+        service = MicrosoftGraphService(token_id=self.token.id)
+        with mock.patch('requests.Session.request', return_value=response):
+            try:
+                service.make_request('POST', 'teams/test', data=data, log_endpoint=self.endpoint)
+            except requests.HTTPError:
+                pass
+    
+    def test_identical_bodies_stored_once(self):
+        """测试相同内容只保存一份，日志行只保存摘要，详情接口解压后返回"""
+        payload = {'value': [{'id': str(i), 'displayName': '团队'} for i in range(200)]}
+        self.call({'body': {'content': 'hi'}}, fake_response(json_data=payload))
+        self.call({'body': {'content': 'hi'}}, fake_response(json_data=payload))
+        
+        logs = list(usage_log_partitions.query().union('-id'))
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(logs[0].response_body_digest, logs[1].response_body_digest)
+        self.assertIsNone(logs[0].response_body)
+        self.assertEqual(APILogBody.objects.count(), 2)
+        stored = APILogBody.objects.get(pk=logs[0].response_body_digest)
+        self.assertLess(len(stored.data), stored.size // 10)
+        
+        response = self.client.get(f'/api/logs/{logs[0].pk}/')
+        self.assertEqual(response.data['response_body'], str(payload))
+        self.assertEqual(json.loads(response.data['request_body']), {'body': {'content': 'hi'}})
+    
+    def test_endpoint_size_cap(self):
+        """测试端点的内容上限：超过上限时截断保存，为0时不保存，错误信息只保留开头"""
+        self.endpoint.log_body_max_size = 10
+        self.endpoint.save()
+        self.call(None, fake_response(status_code=500, json_data={'error': 'x' * 2000}))
+        log = usage_log_partitions.query().filter(status='failed').union()[0]
+        body = APILogBody.objects.get(pk=log.response_body_digest)
+        self.assertTrue(body.truncated)
+        self.assertEqual(body.text(), str({'error': 'x' * 2000})[:10])
+        self.assertEqual(len(log.error_message), 1000)
+        
+        self.endpoint.log_body_max_size = 0
+        self.endpoint.save()
+        self.call({'a': 1}, fake_response(json_data={'ok': True}))
+        log = usage_log_partitions.query().filter(status='success').union()[0]
+        self.assertIsNone(log.request_body_digest)
+        self.assertIsNone(log.response_body_digest)
+    
+    @mock.patch.object(logbuffer, '_started', True)
+    def test_body_remembered_after_write(self):
+        """测试启用缓冲时内容写入成功后才记住摘要，写入失败的内容之后会再次写入"""
+        writer = usage_log_bodies.writer
+        self.addCleanup(usage_log_bodies._recent.clear)
+        with mock.patch.object(writer, '_ensure_thread'):
+            with mock.patch.object(usage_log_bodies, 'bulk_create', side_effect=DatabaseError):
+                digest = usage_log_bodies.put('hello')
+                writer.flush()
+            self.assertEqual(usage_log_bodies.put('hello'), digest)
+            self.assertEqual(writer.stats()['pending'], 1)
+            writer.flush()
+            
+            usage_log_bodies.put('hello')
+            self.assertEqual(writer.stats()['pending'], 0)
+        self.assertEqual(APILogBody.objects.get().digest, digest)
+    
+    def test_unreferenced_bodies_collected(self):
+        """测试删除不再被任何日志引用的内容，日志仍引用的内容保留"""
+        self.call({'a': 1}, fake_response(json_data={'ok': True}))
+        APILogBody.objects.create(digest='0' * 64, codec='none', data=b'old', size=3,
+                                  last_used=timezone.localdate() - timedelta(days=400))
+        
+        self.assertEqual(usage_log_bodies.collect_garbage(dry_run=True), 1)
+        self.assertEqual(usage_log_bodies.collect_garbage(), 1)
+        self.assertEqual(APILogBody.objects.count(), 2)
+
+
+class UsageRollupTest(APITestCase):
+    """使用日志预聚合汇总测试"""
+    
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_authenticate(user=self.user)
+        self.endpoint = create_endpoint()
+        self.hour = bucket_start(timezone.now() - timedelta(hours=5), 'hour')
+    
+    def write_log(self, created_at, status='success', response_time=None):
+        usage_log_writer.write(APIUsageLog(endpoint=self.endpoint, request_method='GET', request_url='teams/test',
+                                           status=status, response_time=response_time, created_at=created_at))
+    
+    def test_writer_updates_minute_and_hour_buckets(self):
+        """测试写入日志时累加分钟和小时汇总，开头不足一小时的部分按分钟统计"""
+        self.write_log(self.hour + timedelta(minutes=10), response_time=1.0)
+        self.write_log(self.hour + timedelta(minutes=40), status='failed', response_time=3.0)
+        self.write_log(self.hour + timedelta(minutes=40, seconds=5))
+        
+        hour_row = APIUsageRollup.objects.get(grain='hour', status='success')
+        self.assertEqual((hour_row.bucket, hour_row.count, hour_row.service), (self.hour, 2, 'teams'))
+        self.assertEqual(APIUsageRollup.objects.filter(grain='minute').count(), 3)
+        
+        totals = usage_rollups.totals(since=self.hour + timedelta(minutes=20))
+        self.assertEqual(totals['by_status'], {'failed': 1, 'success': 1})
+        self.assertEqual(totals['avg_response_time'], 3.0)
+        self.assertEqual(usage_rollups.totals(since=self.hour)['count'], 3)
+        
+        response = self.client.get('/api/logs/statistics/', {'days': 1})
+        self.assertEqual(response.data['total_calls'], 3)
+        self.assertEqual(response.data['avg_response_time'], 2.0)
+        self.assertEqual(response.data['by_service'], [{'endpoint__service': 'teams', 'count': 3}])
+    
+    def test_rebuild_and_prune(self):
+        """测试从原始日志重新计算汇总，以及按保留期清理分钟汇总"""
+        self.write_log(self.hour + timedelta(minutes=10), response_time=1.0)
+        self.write_log(timezone.now() - timedelta(days=3), status='error')
+        expected = usage_rollups.totals(since=timezone.now() - timedelta(days=7))
+        
+        APIUsageRollup.objects.all().delete()
+        usage_rollups.rebuild(timezone.now() - timedelta(days=7))
+        
+        self.assertEqual(usage_rollups.totals(since=timezone.now() - timedelta(days=7)), expected)
+        self.assertEqual(APIUsageRollup.objects.filter(grain='minute').count(), 1)
+        self.assertEqual(APIUsageRollup.objects.filter(grain='hour').count(), 2)
+        
+        self.write_log(timezone.now() - timedelta(days=3))
+        self.assertEqual(usage_rollups.prune(), 1)
+        self.assertFalse(APIUsageRollup.objects.filter(grain='minute', bucket__lt=self.hour).exists())
+
+    def test_latency_percentiles(self):
+        """测试合并各时间桶的直方图计算分位数，误差在分桶精度以内"""
+        for i in range(100):
+            self.write_log(self.hour + timedelta(minutes=i % 60), response_time=(i + 1) / 100)
+        self.write_log(self.hour + timedelta(hours=1), response_time=5.0)
+        
+        response = self.client.get('/api/endpoints/latency/', {'days': 1})
+        row = response.data[0]
+        self.assertEqual((row['endpoint'], row['endpoint__name'], row['count']), (self.endpoint.pk, '测试端点', 101))
+        self.assertAlmostEqual(row['p50'], 0.51, delta=0.51 * 0.06)
+        self.assertAlmostEqual(row['p90'], 0.91, delta=0.91 * 0.06)
+        self.assertEqual(row['max'], 5.0)
+        
+        response = self.client.get(f'/api/endpoints/{self.endpoint.pk}/latency/', {'days': 1})
+        self.assertEqual(response.data['summary']['count'], 101)
+        self.assertEqual([row['count'] for row in response.data['hourly']], [100, 1])
+        self.assertEqual(response.data['hourly'][1]['p99'], 5.0)
+        
+        # 重新计算得到相同的直方图
+        histograms = dict(APIUsageRollup.objects.values_list('bucket', 'latency_histogram').filter(grain='hour'))
+        usage_rollups.rebuild(self.hour)
+        self.assertEqual(
+            dict(APIUsageRollup.objects.values_list('bucket', 'latency_histogram').filter(grain='hour')), histograms
+        )
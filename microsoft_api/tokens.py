@@ -0,0 +1,213 @@
+"""
+访问令牌缓存
+进程内按APIToken缓存Bearer令牌；过期时进程内单飞刷新，
+跨进程通过数据库租约（refresh_lease_until）保证每次过期只刷新一次。
+Token配置修改后，保存所在的进程通过信号清除缓存；其他进程的缓存项记录了取得令牌时Token的 updated_at，
+调用方加载到更新的Token（服务实例创建时从数据库读取）时不再使用缓存。
+已经创建的服务实例在令牌过期前仍使用旧令牌。
+"""
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import APIToken
+
+
+logger = logging.getLogger(__name__)
+
+# 修改后需要重新获取访问令牌的字段
+CREDENTIAL_FIELDS = ('client_id', 'client_secret', 'tenant_id')
+
+
+class TokenCache:
+    """进程内访问令牌缓存"""
+
+    def __init__(self):
+        self._tokens = {}  # token_id -> (access_token, expires_ts, Token的updated_at)
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, token_id):
+        with self._guard:
+            return self._locks.setdefault(token_id, threading.Lock())
+
+    def _store(self, api_token, access_token, expires_at, version=None):
+        self._tokens[api_token.pk] = (access_token, expires_at.timestamp(), version or api_token.updated_at)
+        # 同步到调用方持有的模型实例，保持 is_token_valid() 等方法可用
+        api_token.access_token = access_token
+        api_token.token_expires_at = expires_at
+        return access_token
+
+    def peek(self, token_id, version=None):
+        """
+        返回缓存中仍有效的令牌，不存在或已过期返回None（不访问数据库）
+        :param version: 调用方持有的Token的 updated_at，比缓存项新时说明配置已修改，缓存不再可用
+        """
+        entry = self._tokens.get(token_id)
+        if not entry or time.time() >= entry[1]:
+            return None
+        if version is not None and entry[2] is not None and version > entry[2]:
+            return None
+        return entry[0]
+
+    def get(self, api_token, fetch):
+        """
+        获取访问令牌
+        :param api_token: APIToken对象
+        :param fetch: 实际请求OAuth端点的函数，返回 (access_token, expires_at)
+        """
+        access_token = self.peek(api_token.pk, api_token.updated_at)
+        if access_token:
+            return access_token
+        return self.refresh(api_token, fetch)
+
+    def refresh(self, api_token, fetch, force=False):
+        """
+        刷新访问令牌
+        同一进程内同一Token只有一个线程执行刷新，其余线程等待结果；
+        数据库租约保证多个worker之间也只有一个进程请求OAuth端点
+        :param force: 即使当前令牌仍有效也强制刷新（用于提前续期）
+        """
+        lease_seconds = getattr(settings, 'MICROSOFT_TOKEN_REFRESH_LEASE', 30)
+        poll_interval = getattr(settings, 'MICROSOFT_TOKEN_REFRESH_POLL', 0.2)
+
+        with self._lock_for(api_token.pk):
+            if not force:
+                access_token = self.peek(api_token.pk, api_token.updated_at)
+                if access_token:
+                    return access_token
+
+            wait_until = time.monotonic() + lease_seconds
+            queryset = APIToken.objects.filter(pk=api_token.pk)
+            while True:
+                row = queryset.values('access_token', 'token_expires_at', 'updated_at').first()
+                if row is None:
+                    raise ValueError("API Token不存在")
+                if api_token.updated_at and row['updated_at'] > api_token.updated_at:
+                    # 调用方持有的Token已被修改，按新的凭据获取
+                    api_token.refresh_from_db(fields=CREDENTIAL_FIELDS + ('updated_at',))
+
+                now = timezone.now()
+                if not force and row['access_token'] and row['token_expires_at'] and now < row['token_expires_at']:
+                    # 其他进程已刷新
+                    return self._store(api_token, row['access_token'], row['token_expires_at'], row['updated_at'])
+
+                acquired = queryset.filter(
+                    Q(refresh_lease_until__isnull=True) | Q(refresh_lease_until__lt=now)
+                ).update(refresh_lease_until=now + timedelta(seconds=lease_seconds))
+
+                if acquired:
+                    try:
+                        access_token, expires_at = fetch()
+                    except Exception:
+                        queryset.update(refresh_lease_until=None)
+                        raise
+                    queryset.update(
+                        access_token=access_token,
+                        token_expires_at=expires_at,
+                        refresh_lease_until=None
+                    )
+                    return self._store(api_token, access_token, expires_at, row['updated_at'])
+
+                # 其他进程持有租约，等待其刷新结果
+                if time.monotonic() > wait_until:
+                    raise Exception("等待其他进程刷新访问令牌超时")
+                time.sleep(poll_interval)
+                force = False
+
+    def invalidate(self, token_id):
+        """使缓存失效"""
+        self._tokens.pop(token_id, None)
+
+    def clear(self):
+        self._tokens.clear()
+
+
+token_cache = TokenCache()
+
+
+class TokenRefresher:
+    """
+    令牌提前续期
+    在 token_expires_at 之前的 margin 秒（再减去随机抖动）主动刷新所有活跃Token，
+    使请求路径上不再出现OAuth往返
+    """
+
+    def __init__(self, margin=None, jitter=None, retry_interval=None, cache=None):
+        self.margin = margin if margin is not None else getattr(
+            settings, 'MICROSOFT_TOKEN_PREREFRESH_MARGIN', 600)
+        self.jitter = jitter if jitter is not None else getattr(
+            settings, 'MICROSOFT_TOKEN_PREREFRESH_JITTER', 120)
+        self.retry_interval = retry_interval if retry_interval is not None else getattr(
+            settings, 'MICROSOFT_TOKEN_PREREFRESH_RETRY', 30)
+        self.cache = cache or token_cache
+        self.schedule = {}  # token_id -> 计划刷新时间戳
+        self.stats = {'refreshed': 0, 'failed': 0, 'last_latency': None, 'max_latency': 0.0}
+
+    def plan(self, api_token):
+        """计算下一次刷新时间"""
+        if not api_token.access_token or not api_token.token_expires_at:
+            return time.time()
+        jitter = random.uniform(0, self.jitter)
+        return api_token.token_expires_at.timestamp() - self.margin - jitter
+
+    def refresh(self, api_token):
+        """
+        刷新单个Token
+        :return: (是否成功, 耗时秒数, 错误信息)
+        """
+        from .services import MicrosoftGraphService
+
+        start = time.monotonic()
+        try:
+            service = MicrosoftGraphService(token_id=api_token.pk)
+            self.cache.refresh(api_token, service.fetch_access_token, force=True)
+        except Exception as e:
+            latency = time.monotonic() - start
+            self.stats['failed'] += 1
+            logger.warning("令牌续期失败: token=%s latency=%.3fs error=%s", api_token.pk, latency, e)
+            return False, latency, str(e)
+
+        latency = time.monotonic() - start
+        self.stats['refreshed'] += 1
+        self.stats['last_latency'] = latency
+        self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+        logger.info("令牌续期成功: token=%s latency=%.3fs", api_token.pk, latency)
+        return True, latency, None
+
+    def run_once(self):
+        """
+        检查所有活跃Token，刷新到期的Token
+        :return: (本轮结果列表, 距下一次计划刷新的秒数)
+        """
+        results = []
+        now = time.time()
+        tokens = list(APIToken.objects.filter(is_active=True))
+        active_ids = {token.pk for token in tokens}
+        for token_id in list(self.schedule):
+            if token_id not in active_ids:
+                del self.schedule[token_id]
+
+        for api_token in tokens:
+            due = self.schedule.get(api_token.pk)
+            if due is None:
+                due = self.schedule[api_token.pk] = self.plan(api_token)
+            if due > now:
+                continue
+
+            ok, latency, error = self.refresh(api_token)
+            results.append({'token': api_token, 'ok': ok, 'latency': latency, 'error': error})
+            if ok:
+                self.schedule[api_token.pk] = self.plan(api_token)
+            else:
+                self.schedule[api_token.pk] = time.time() + self.retry_interval
+
+        next_due = min(self.schedule.values(), default=None)
+        wait = max(0.0, next_due - time.time()) if next_due is not None else None
+        return results, wait
@@ -3,7 +3,7 @@ Microsoft API应用的URL配置
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'tokens', views.APITokenViewSet, basename='apitoken')
@@ -13,7 +13,18 @@ router.register(r'teams-messages', views.TeamsMessageViewSet, basename='teamsmes
 router.register(r'email-templates', views.EmailTemplateViewSet, basename='emailtemplate')
 router.register(r'microsoft', views.MicrosoftAPIViewSet, basename='microsoft')
 
+# 异步操作接口（需通过ASGI部署才能发挥并发优势）
+async_urlpatterns = [
+    path('send_teams_message/', async_views.send_teams_message, name='async-send-teams-message'),
+    path('send_email/', async_views.send_email, name='async-send-email'),
+    path('sharepoint_operation/', async_views.sharepoint_operation, name='async-sharepoint-operation'),
+    path('list_teams/', async_views.list_teams, name='async-list-teams'),
+    path('list_emails/', async_views.list_emails, name='async-list-emails'),
+    path('export_items/', async_views.export_items, name='async-export-items'),
+]
+
 urlpatterns = [
+    path('async/microsoft/', include(async_urlpatterns)),
     path('', include(router.urls)),
 ]
 
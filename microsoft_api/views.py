@@ -1,22 +1,56 @@
 """
 REST API视图
 """
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count, Q
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from datetime import timedelta
+from itertools import chain
 
-from .models import APIToken, APIEndpoint, APIUsageLog, TeamsMessage, EmailTemplate
+from .models import (
+    APIToken, APIEndpoint, APIUsageLog, TeamsMessage, EmailTemplate, usage_log_partitions, usage_rollups
+)
 from .serializers import (
     APITokenSerializer, APITokenListSerializer, APIEndpointSerializer,
     APIUsageLogSerializer, APIUsageLogDetailSerializer,
     TeamsMessageSerializer, EmailTemplateSerializer,
-    SendTeamsMessageSerializer, SendEmailSerializer, SharePointOperationSerializer
+    SendTeamsMessageSerializer, SendEmailSerializer, SharePointOperationSerializer,
+    GraphBatchSerializer, GraphExportSerializer, APIUsageLogExportSerializer
 )
-from .services import TeamsService, OutlookService, SharePointService
+from automationapi.circuit import circuit_breakers
+from automationapi.latency import LatencyHistogram
+from automationapi.pagination import PartitionedCursorPagination
+from automationapi.deadline import long_running
+from automationapi.errors import exception_response
+from automationapi.streaming import streaming_export
+from .services import MicrosoftGraphService, TeamsService, OutlookService, SharePointService, graph_session_pool
+from .batch import GraphBatch
+
+
+# 批量请求中各操作对应的服务类
+BATCH_OPERATION_SERVICES = {
+    'send_channel_message': TeamsService,
+    'send_chat_message': TeamsService,
+    'list_teams': TeamsService,
+    'send_email': OutlookService,
+    'list_messages': OutlookService,
+    'get_site': SharePointService,
+    'list_site_lists': SharePointService,
+    'get_list_items': SharePointService,
+}
+
+# 流式导出的数据源 -> (服务类, 迭代方法, 传给迭代方法的参数)
+EXPORT_SOURCES = {
+    'teams': (TeamsService, 'iter_teams', ()),
+    'messages': (OutlookService, 'iter_messages', ('folder',)),
+    'site_lists': (SharePointService, 'iter_site_lists', ('site_id',)),
+    'list_items': (SharePointService, 'iter_list_items', ('site_id', 'list_id')),
+}
 
 
 class APITokenViewSet(viewsets.ModelViewSet):
@@ -54,64 +88,139 @@ class APIEndpointViewSet(viewsets.ModelViewSet):
         stats = APIEndpoint.objects.values('service').annotate(
             total_endpoints=Count('id'),
             active_endpoints=Count('id', filter=Q(is_active=True)),
-            total_calls=Count('usage_logs')
         )
-        return Response(stats)
+        # 调用次数读取小时汇总（包括失败和未收到响应的调用），不扫描日志分区
+        calls = {row['service']: row['count'] for row in usage_rollups.count_by('service')}
+        return Response([
+            {**row, 'total_calls': calls.get(row['service'], 0)} for row in stats
+        ])
+    
+    @action(detail=False, methods=['get'])
+    def latency(self, request):
+        """各端点响应时间的分位数（秒），合并汇总表中的直方图计算，不扫描日志"""
+        days = int(request.query_params.get('days', 7))
+        date_from = timezone.now() - timedelta(days=days)
+        return Response(usage_rollups.latency('endpoint', 'endpoint__name', 'service', since=date_from))
+    
+    @action(detail=True, methods=['get'], url_path='latency', url_name='latency-detail')
+    def latency_detail(self, request, pk=None):
+        """单个端点响应时间的分位数（秒），以及按小时的变化"""
+        endpoint = self.get_object()
+        days = int(request.query_params.get('days', 7))
+        date_from = timezone.now() - timedelta(days=days)
+        
+        summary = usage_rollups.latency(since=date_from, endpoint=endpoint)
+        return Response({
+            'endpoint': endpoint.pk,
+            'summary': summary[0] if summary else LatencyHistogram().summary(),
+            'hourly': usage_rollups.latency_series(date_from, endpoint=endpoint),
+        })
 
 
 class APIUsageLogViewSet(viewsets.ReadOnlyModelViewSet):
-    """API使用日志（只读）"""
+    """API使用日志（只读，按时间分区存储）"""
     
-    queryset = APIUsageLog.objects.select_related('endpoint', 'token', 'user').all()
+    queryset = APIUsageLog.objects.none()
     permission_classes = [IsAuthenticated]
+    pagination_class = PartitionedCursorPagination
+    # 导出的列，endpoint_name 取自端点表
+    export_fields = [
+        'id', 'created_at', 'endpoint', 'token', 'user', 'request_method', 'request_url',
+        'status_code', 'response_time', 'status', 'error_message', 'timeout_phase',
+        'request_id', 'attempt', 'request_body_digest', 'response_body_digest',
+    ]
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return APIUsageLogDetailSerializer
         return APIUsageLogSerializer
     
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        
+    def get_partitioned_query(self):
+        """按过滤参数构造跨分区查询，指定days时只访问相关的分区"""
         # 过滤参数
         endpoint_id = self.request.query_params.get('endpoint', None)
         status_filter = self.request.query_params.get('status', None)
         days = self.request.query_params.get('days', None)
+        request_id = self.request.query_params.get('request_id', None)
+        
+        date_from = timezone.now() - timedelta(days=int(days)) if days else None
+        query = usage_log_partitions.query(since=date_from).select_related('endpoint', 'token', 'user')
         
         if endpoint_id:
-            queryset = queryset.filter(endpoint_id=endpoint_id)
+            query = query.filter(endpoint_id=endpoint_id)
         
         if status_filter:
-            queryset = queryset.filter(status=status_filter)
+            query = query.filter(status=status_filter)
         
-        if days:
-            date_from = timezone.now() - timedelta(days=int(days))
-            queryset = queryset.filter(created_at__gte=date_from)
+        # 同一次调用的所有重试尝试
+        if request_id:
+            query = query.filter(request_id=request_id)
         
-        return queryset
+        return query
+    
+    def get_queryset(self):
+        return self.get_partitioned_query().union()
+    
+    def list(self, request, *args, **kwargs):
+        """按 (created_at, id) 键集分页，带 page 参数时按页码分页"""
+        page = self.paginator.paginate_partitioned(self.get_partitioned_query(), request, self)
+        if page is None:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer(page, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+    
+    def get_object(self):
+        """按主键直接定位日志所在的分区"""
+        try:
+            obj = self.get_partitioned_query().get(pk=self.kwargs['pk'])
+        except (ObjectDoesNotExist, ValueError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """获取使用统计"""
+        """获取使用统计（读取预聚合汇总，不扫描日志）"""
         days = int(request.query_params.get('days', 7))
         date_from = timezone.now() - timedelta(days=days)
         
-        logs = APIUsageLog.objects.filter(created_at__gte=date_from)
+        totals = usage_rollups.totals(since=date_from)
+        by_status = totals['by_status']
+        by_service = usage_rollups.count_by('service', since=date_from)
         
         stats = {
-            'total_calls': logs.count(),
-            'success_calls': logs.filter(status='success').count(),
-            'failed_calls': logs.filter(status='failed').count(),
-            'error_calls': logs.filter(status='error').count(),
-            'by_endpoint': list(logs.values('endpoint__name').annotate(
-                count=Count('id')
-            ).order_by('-count')[:10]),
-            'by_service': list(logs.values('endpoint__service').annotate(
-                count=Count('id')
-            )),
+            'total_calls': totals['count'],
+            'success_calls': by_status.get('success', 0),
+            'failed_calls': by_status.get('failed', 0),
+            'error_calls': by_status.get('error', 0),
+            'avg_response_time': totals['avg_response_time'],
+            'by_endpoint': usage_rollups.count_by('endpoint__name', since=date_from, limit=10),
+            'by_service': [{'endpoint__service': row['service'], 'count': row['count']} for row in by_service],
         }
         
         return Response(stats)
+    
+    @action(detail=False, methods=['get'])
+    @long_running
+    def export(self, request):
+        """
+        流式导出日志（过滤参数与列表相同），逐块读取values()字典，不创建模型实例
+        export_format 为 ndjson、csv 或 columnar，chunk_size 为每次从数据库读取的行数
+        """
+        serializer = APIUsageLogExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        rows = self.get_partitioned_query().iterator(
+            *self.export_fields, chunk_size=data['chunk_size'], endpoint_name=F('endpoint__name')
+        )
+        return streaming_export(
+            rows,
+            export_format=data['export_format'],
+            filename='api_usage_logs',
+            columns=self.export_fields + ['endpoint_name'],
+            batch_size=data['chunk_size']
+        )
 
 
 class TeamsMessageViewSet(viewsets.ModelViewSet):
@@ -168,10 +277,7 @@ class MicrosoftAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
     def send_email(self, request):
@@ -201,10 +307,7 @@ class MicrosoftAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['post'])
     def sharepoint_operation(self, request):
@@ -240,10 +343,7 @@ class MicrosoftAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['get'])
     def list_teams(self, request):
@@ -260,10 +360,7 @@ class MicrosoftAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
-            return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return exception_response(e)
     
     @action(detail=False, methods=['get'])
     def list_emails(self, request):
@@ -282,7 +379,109 @@ class MicrosoftAPIViewSet(viewsets.ViewSet):
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
+            return exception_response(e)
+    
+    @action(detail=False, methods=['post'])
+    @long_running
+    def export_items(self, request):
+        """流式导出Graph列表的所有数据（NDJSON/CSV），自动跟随 @odata.nextLink"""
+        serializer = GraphExportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        data = serializer.validated_data
+        token_id = data.get('token_id')
+        
+        try:
+            service_class, method_name, arg_names = EXPORT_SOURCES[data['source']]
+            service = service_class(token_id=token_id)
+            
+            items = getattr(service, method_name)(
+                *[data[name] for name in arg_names],
+                page_size=data.get('page_size'),
+                prefetch=data['prefetch'],
+                user=request.user
+            )
+            # 先读取第一页，请求失败时仍可返回400
+            first = next(items, None)
+            
+        except Exception as e:
+            return exception_response(e)
+        
+        if first is not None:
+            items = chain([first], items)
+        
+        return streaming_export(items, export_format=data['format'], filename=f"graph_{data['source']}")
+    
+    @action(detail=False, methods=['post'])
+    @long_running
+    def batch(self, request):
+        """批量执行Graph操作（每20个操作合并为一次$batch请求）"""
+        serializer = GraphBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        data = serializer.validated_data
+        token_id = data.get('token_id')
+        operations = data['operations']
+        
+        try:
+            services = {}
+            for operation in operations:
+                service_class = BATCH_OPERATION_SERVICES[operation['operation']]
+                if service_class not in services:
+                    services[service_class] = service_class(token_id=token_id)
+            
+            results = []
+            with GraphBatch(*services.values()) as batch:
+                for operation in operations:
+                    service = services[BATCH_OPERATION_SERVICES[operation['operation']]]
+                    with batch.after(*[results[i] for i in operation['depends_on']]):
+                        method = getattr(service, operation['operation'])
+                        results.append(method(**operation['params'], user=request.user))
+            
+            items = []
+            for operation, result in zip(operations, results):
+                try:
+                    items.append({
+                        'operation': operation['operation'],
+                        'status': 'success',
+                        'data': result.result()
+                    })
+                except Exception as e:
+                    items.append({
+                        'operation': operation['operation'],
+                        'status': 'error',
+                        'message': str(e)
+                    })
+            
             return Response({
-                'status': 'error',
-                'message': str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+                'status': 'success',
+                'message': f'批量执行 {len(operations)} 个操作',
+                'data': items
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return exception_response(e)
+    
+    @action(detail=False, methods=['get'])
+    def pool_stats(self, request):
+        """查看当前进程的Graph连接池统计"""
+        return Response(graph_session_pool.stats())
+    
+    @action(detail=False, methods=['get'])
+    def rate_limits(self, request):
+        """查看各租户限流令牌桶的当前状态（所有worker共享）"""
+        tenants = APIToken.objects.filter(is_active=True).order_by('tenant_id') \
+            .values_list('tenant_id', flat=True).distinct()
+        
+        return Response({
+            'status': 'success',
+            'data': [MicrosoftGraphService.rate_limit_level(tenant_id) for tenant_id in tenants]
+        })
+    
+    @action(detail=False, methods=['get'])
+    def circuit_breakers(self, request):
+        """查看当前进程中各端点熔断器的状态（closed/open/half_open）"""
+        return Response({
+            'status': 'success',
+            'data': circuit_breakers.snapshot('graph:')
+        })